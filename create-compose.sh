@@ -45,6 +45,13 @@ add_server() {
       - OUTPUT_QUEUE_OF_REVIEWS=scraped_reviews_q
       - OUTPUT_QUEUE_OF_BOOKS=scraped_books_q
       - MERGERS_QUANTITY=$WORKERS
+      - CONCURRENT_UPLOADS=$CONCURRENT_UPLOADS
+      - PUBLISHING_CHANNELS=4
+      - UPLOAD_WINDOW=$UPLOAD_WINDOW
+      - MAX_QUEUED_MSGS=5000
+      - GROUP_COMMIT_SIZE=$GROUP_COMMIT_SIZE
+      - GROUP_COMMIT_TIMEOUT=$GROUP_COMMIT_TIMEOUT
+      - SYSTEM_MSG_WIRE_FORMAT=$SYSTEM_MSG_WIRE_FORMAT
     networks:
       - testing_net
     volumes:
@@ -76,6 +83,8 @@ add_clients() {
       - BOOKS_FILE_PATH=/data/books_data.csv
       - BATCH_SIZE=200
       - CLIENT_ID=$i
+      - CONCURRENT_UPLOADS=$CONCURRENT_UPLOADS
+      - UPLOAD_WINDOW=$UPLOAD_WINDOW
     networks:
       - testing_net
     depends_on:
@@ -88,11 +97,9 @@ add_clients() {
 }
 
 
-add_preprocessors() {
-    echo "book_sanitizer" > src/monitorable_controllers.txt
+add_books_path_preprocessors() {
+    echo "book_sanitizer" >> src/monitorable_controllers.txt
     echo "year_preprocessor" >> src/monitorable_controllers.txt
-    echo "decade_preprocessor" >> src/monitorable_controllers.txt
-    echo "review_sanitizer" >> src/monitorable_controllers.txt
     echo "
   book_sanitizer:
     container_name: book_sanitizer
@@ -107,6 +114,7 @@ add_preprocessors() {
       - INPUT_QUEUE_OF_BOOKS=scraped_books_q
       - OUTPUT_QUEUE_OF_BOOKS=sanitized_books_q
       - CONTROLLER_NAME=book_sanitizer
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -129,6 +137,7 @@ add_preprocessors() {
       - OUTPUT_QUEUE_OF_BOOKS_TOWARDS_PREPROC=towards_preprocessor__preprocessed_books_with_year_q
       - OUTPUT_QUEUE_OF_BOOKS_TOWARDS_FILTER=towards_filter__preprocessed_books_with_year_q
       - CONTROLLER_NAME=year_preprocessor
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -137,8 +146,62 @@ add_preprocessors() {
       rabbitmq:
         condition: service_healthy
 " >> docker-compose.yaml
+}
 
+add_fused_books_path() {
+    echo "books_pipeline" >> src/monitorable_controllers.txt
+    echo "
+  books_pipeline:
+    container_name: books_pipeline
+    image: fused_pipeline:latest
+    entrypoint: python3 /main.py
+    environment:
+      - PYTHONUNBUFFERED=1
+      - PYTHONHASHSEED=1
+      - LOGGING_LEVEL=INFO
+      - FUSED_STAGES=book_sanitizer,year_preprocessor,filter_of_books_by_year_and_genre,filter_of_books_by_title,query1_result_generator
+      - BOOK_SANITIZER__INPUT_EXCHANGE=scraped_data_ex
+      - BOOK_SANITIZER__OUTPUT_EXCHANGE=sanitized_books_ex
+      - BOOK_SANITIZER__INPUT_QUEUE_OF_BOOKS=scraped_books_q
+      - BOOK_SANITIZER__OUTPUT_QUEUE_OF_BOOKS=sanitized_books_q
+      - YEAR_PREPROCESSOR__INPUT_EXCHANGE=sanitized_books_ex
+      - YEAR_PREPROCESSOR__OUTPUT_EXCHANGE=preprocessed_books_with_year_ex
+      - YEAR_PREPROCESSOR__INPUT_QUEUE_OF_BOOKS=sanitized_books_q
+      - YEAR_PREPROCESSOR__OUTPUT_QUEUE_OF_BOOKS_TOWARDS_PREPROC=towards_preprocessor__preprocessed_books_with_year_q
+      - YEAR_PREPROCESSOR__OUTPUT_QUEUE_OF_BOOKS_TOWARDS_FILTER=towards_filter__preprocessed_books_with_year_q
+      - FILTER_OF_BOOKS_BY_YEAR_AND_GENRE__INPUT_EXCHANGE=preprocessed_books_with_year_ex
+      - FILTER_OF_BOOKS_BY_YEAR_AND_GENRE__OUTPUT_EXCHANGE=books_filtered_by_year_and_genre_ex
+      - FILTER_OF_BOOKS_BY_YEAR_AND_GENRE__INPUT_QUEUE_OF_BOOKS=towards_filter__preprocessed_books_with_year_q
+      - FILTER_OF_BOOKS_BY_YEAR_AND_GENRE__OUTPUT_QUEUE_OF_BOOKS=books_filtered_by_year_and_genre_q
+      - FILTER_OF_BOOKS_BY_YEAR_AND_GENRE__MIN_YEAR=2000
+      - FILTER_OF_BOOKS_BY_YEAR_AND_GENRE__MAX_YEAR=2023
+      - FILTER_OF_BOOKS_BY_YEAR_AND_GENRE__GENRE=Computers
+      - FILTER_OF_BOOKS_BY_TITLE__INPUT_EXCHANGE=books_filtered_by_year_and_genre_ex
+      - FILTER_OF_BOOKS_BY_TITLE__OUTPUT_EXCHANGE=books_filtered_by_title_ex
+      - FILTER_OF_BOOKS_BY_TITLE__INPUT_QUEUE_OF_BOOKS=books_filtered_by_year_and_genre_q
+      - FILTER_OF_BOOKS_BY_TITLE__OUTPUT_QUEUE_OF_BOOKS=books_filtered_by_title_q
+      - FILTER_OF_BOOKS_BY_TITLE__TITLE_KEYWORD=distributed
+      - QUERY1_RESULT_GENERATOR__INPUT_EXCHANGE=books_filtered_by_title_ex
+      - QUERY1_RESULT_GENERATOR__OUTPUT_EXCHANGE=query_results_ex
+      - QUERY1_RESULT_GENERATOR__INPUT_QUEUE_OF_BOOKS=books_filtered_by_title_q
+      - QUERY1_RESULT_GENERATOR__OUTPUT_QUEUE_OF_QUERY=query_results_q
+      - CONTROLLER_NAME=books_pipeline
+$COMMON_CONTROLLER_ENV
+    networks:
+      - testing_net
+    volumes:
+      - /var/run/docker.sock:/var/run/docker.sock
+    depends_on:
+      rabbitmq:
+        condition: service_healthy
+
+  # ================================================================
+" >> docker-compose.yaml
+}
 
+add_preprocessors() {
+    echo "decade_preprocessor" >> src/monitorable_controllers.txt
+    echo "review_sanitizer" >> src/monitorable_controllers.txt
     echo "
   decade_preprocessor:
     container_name: decade_preprocessor
@@ -157,6 +220,8 @@ add_preprocessors() {
     done
     echo "      - NUM_OF_DYN_OUTPUT_QUEUES=$WORKERS
       - CONTROLLER_NAME=decade_preprocessor
+      - PARTITIONING_MODE=$PARTITIONING_MODE
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -182,6 +247,10 @@ add_preprocessors() {
       done
       echo "      - NUM_OF_DYN_OUTPUT_QUEUES=$WORKERS
       - CONTROLLER_NAME=review_sanitizer
+      - INPUT_EXCHANGE_OF_TITLES_FILTERS=mergers_outputs_ex
+      - INPUT_QUEUE_OF_TITLES_FILTERS=titles_filters_q
+      - PARTITIONING_MODE=$PARTITIONING_MODE
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -213,6 +282,11 @@ add_mergers() {
       - OUTPUT_QUEUE_OF_FULL_REVIEWS=merged_full_reviews_q
       - OUTPUT_QUEUE_OF_BOOKS_CONFIRMS=mergers_confirms_q
       - CONTROLLER_NAME=merger_$i
+      - PUSHDOWN_DECADE_OF_COMPACT_REVIEWS=1990
+      - PUSHDOWN_GENRE_OF_FULL_REVIEWS=fiction
+      - OUTPUT_QUEUE_OF_TITLES_FILTERS=titles_filters_q
+      - TITLES_FILTER_FP_RATE=0.01
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -248,6 +322,7 @@ add_query1_processes() {
       - MAX_YEAR=2023
       - GENRE=Computers
       - CONTROLLER_NAME=filter_of_books_by_year_and_genre
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -270,6 +345,7 @@ add_query1_processes() {
       - OUTPUT_QUEUE_OF_BOOKS=books_filtered_by_title_q
       - TITLE_KEYWORD=distributed
       - CONTROLLER_NAME=filter_of_books_by_title
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -291,6 +367,7 @@ add_query1_processes() {
       - INPUT_QUEUE_OF_BOOKS=books_filtered_by_title_q
       - OUTPUT_QUEUE_OF_QUERY=query_results_q
       - CONTROLLER_NAME=query1_result_generator
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -323,6 +400,9 @@ add_query2_processes() {
       done
       echo "      - NUM_OF_DYN_OUTPUT_QUEUES=$WORKERS
       - CONTROLLER_NAME=author_expander
+      - COMBINER_SIZE_MB=64
+      - PARTITIONING_MODE=$PARTITIONING_MODE
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -349,6 +429,8 @@ add_query2_processes() {
       - OUTPUT_QUEUE_OF_AUTHORS=authors_decades_count_q_$i
       - BATCH_SIZE=200
       - CONTROLLER_NAME=counter_of_decades_per_author_$i
+      - MIN_DECADES_TO_EMIT=10
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -375,6 +457,7 @@ add_query2_processes() {
       - OUTPUT_QUEUE_OF_AUTHORS=authors_filtered_by_decade_q
       - MIN_DECADES_TO_FILTER=10
       - CONTROLLER_NAME=filter_of_authors_by_decade_count_$i
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -400,6 +483,7 @@ add_query2_processes() {
       - OUTPUT_QUEUE_OF_QUERY=query_results_q
       - FILTERS_QUANTITY=$WORKERS
       - CONTROLLER_NAME=query2_result_generator
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -434,6 +518,8 @@ add_query3_processes() {
       done
       echo "      - NUM_OF_DYN_OUTPUT_QUEUES=$WORKERS
       - CONTROLLER_NAME=filter_of_compact_reviews_by_decade
+      - PARTITIONING_MODE=$PARTITIONING_MODE
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -460,6 +546,7 @@ add_query3_processes() {
       - OUTPUT_QUEUE_OF_REVIEWS=review_count_per_book_q
       - BATCH_SIZE=200
       - CONTROLLER_NAME=counter_of_reviews_per_book_$i
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -483,11 +570,16 @@ add_query3_processes() {
       - INPUT_EXCHANGE=review_count_per_book_ex
       - OUTPUT_EXCHANGE=books_filtered_by_review_count_ex
       - INPUT_QUEUE_OF_BOOKS=review_count_per_book_q
-      - OUTPUT_QUEUE_OF_BOOKS_TOWARDS_QUERY3=towards_query3__books_filtered_by_review_count_q
-      - OUTPUT_QUEUE_OF_BOOKS_TOWARDS_sorter=towards_sorter__books_filtered_by_review_count_q
+      - OUTPUT_QUEUE_OF_BOOKS_TOWARDS_QUERY3=towards_query3__books_filtered_by_review_count_q" >> docker-compose.yaml
+      for ((i=1; i<=$WORKERS; i++)); do
+          echo "      - OUTPUT_QUEUE_OF_BOOKS_TOWARDS_SORTER_$i=towards_sorter__books_filtered_by_review_count_q_$i" >> docker-compose.yaml
+      done
+      echo "      - NUM_OF_SORTERS=$WORKERS
       - NUM_OF_COUNTERS=$WORKERS
       - MIN_REVIEWS=500
       - CONTROLLER_NAME=filter_of_books_by_review_count
+      - PARTITIONING_MODE=$PARTITIONING_MODE
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -509,6 +601,7 @@ add_query3_processes() {
       - INPUT_QUEUE_OF_BOOKS=towards_query3__books_filtered_by_review_count_q
       - OUTPUT_QUEUE_OF_QUERY=query_results_q
       - CONTROLLER_NAME=query3_result_generator
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -523,23 +616,53 @@ add_query3_processes() {
 
 
 add_query4_processes() {
-    echo "sorter_of_books_by_score_average" >> src/monitorable_controllers.txt
+    for ((i=1; i<=$WORKERS; i++)); do
+        echo "sorter_of_books_by_score_average_$i" >> src/monitorable_controllers.txt
+        echo "
+  sorter_of_books_by_score_average_$i:
+    container_name: sorter_of_books_by_score_average_$i
+    image: sorter_of_books_by_score_average:latest
+    entrypoint: python3 /main.py
+    environment:
+      - PYTHONUNBUFFERED=1
+      - PYTHONHASHSEED=1
+      - LOGGING_LEVEL=INFO
+      - INPUT_EXCHANGE=books_filtered_by_review_count_ex
+      - OUTPUT_EXCHANGE=local_top_books_by_score_average_ex
+      - INPUT_QUEUE_OF_BOOKS=towards_sorter__books_filtered_by_review_count_q_$i
+      - OUTPUT_QUEUE_OF_BOOKS=local_top_books_by_score_average_q
+      - TOP_OF_BOOKS=10
+      - EMIT_LOCAL_TOP=true
+      - CONTROLLER_NAME=sorter_of_books_by_score_average_$i
+$COMMON_CONTROLLER_ENV
+    networks:
+      - testing_net
+    volumes:
+      - /var/run/docker.sock:/var/run/docker.sock
+    depends_on:
+      rabbitmq:
+        condition: service_healthy" >> docker-compose.yaml
+    done
+
+    echo "merger_of_top_books_by_score_average" >> src/monitorable_controllers.txt
     echo "query4_result_generator" >> src/monitorable_controllers.txt
     echo "
-  sorter_of_books_by_score_average:
-    container_name: sorter_of_books_by_score_average
+  merger_of_top_books_by_score_average:
+    container_name: merger_of_top_books_by_score_average
     image: sorter_of_books_by_score_average:latest
     entrypoint: python3 /main.py
     environment:
       - PYTHONUNBUFFERED=1
       - PYTHONHASHSEED=1
       - LOGGING_LEVEL=INFO
-      - INPUT_EXCHANGE=books_filtered_by_review_count_ex
+      - INPUT_EXCHANGE=local_top_books_by_score_average_ex
       - OUTPUT_EXCHANGE=top_books_by_review_count_ex
-      - INPUT_QUEUE_OF_BOOKS=towards_sorter__books_filtered_by_review_count_q
+      - INPUT_QUEUE_OF_BOOKS=local_top_books_by_score_average_q
       - OUTPUT_QUEUE_OF_BOOKS=top_books_by_review_count_q
       - TOP_OF_BOOKS=10
-      - CONTROLLER_NAME=sorter_of_books_by_score_average
+      - NUM_OF_INPUT_WORKERS=$WORKERS
+      - CONTROLLER_NAME=merger_of_top_books_by_score_average
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -561,6 +684,7 @@ add_query4_processes() {
       - INPUT_QUEUE_OF_BOOKS=top_books_by_review_count_q
       - OUTPUT_QUEUE_OF_QUERY=query_results_q
       - CONTROLLER_NAME=query4_result_generator
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -597,6 +721,8 @@ add_query5_processes() {
       done
       echo "      - NUM_OF_DYN_OUTPUT_QUEUES=$WORKERS
       - CONTROLLER_NAME=filter_of_merged_reviews_by_book_genre
+      - PARTITIONING_MODE=$PARTITIONING_MODE
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -621,7 +747,12 @@ add_query5_processes() {
       - INPUT_QUEUE_OF_REVIEWS=reviews_filtered_by_book_genre_q_$i
       - OUTPUT_QUEUE_OF_REVIEWS=sentiment_per_book_q
       - CONTROLLER_NAME=sentiment_analyzer_$i
+$COMMON_CONTROLLER_ENV
       - BATCH_SIZE=200
+      - SENTIMENT_WORKERS=4
+      - SENTIMENT_ENGINE=$SENTIMENT_ENGINE
+      - POLARITY_CACHE_SIZE_MB=32
+      - POLARITY_CACHE_PERSISTENCE=true
     networks:
       - testing_net
     volumes:
@@ -646,8 +777,11 @@ add_query5_processes() {
       - OUTPUT_QUEUE_OF_BOOKS=books_filtered_by_highest_sentiment_q
       - QUANTILE=0.9
       - CONTROLLER_NAME=filter_of_books_by_sentiment_quantile
+$COMMON_CONTROLLER_ENV
       - BATCH_SIZE=200
       - NUM_OF_SENTIMENT_ANALYZERS=$WORKERS
+      - QUANTILE_MODE=$QUANTILE_MODE
+      - QUANTILE_SKETCH_RANK_ERROR=0.01
     networks:
       - testing_net
     volumes:
@@ -669,6 +803,7 @@ add_query5_processes() {
       - INPUT_QUEUE_OF_BOOKS=books_filtered_by_highest_sentiment_q
       - OUTPUT_QUEUE_OF_QUERY=query_results_q
       - CONTROLLER_NAME=query5_result_generator
+$COMMON_CONTROLLER_ENV
     networks:
       - testing_net
     volumes:
@@ -739,6 +874,72 @@ check_params() {
         echo "Using default value for HEALTH_CHECKERS=1"
         export HEALTH_CHECKERS=1
     fi
+
+    if [ -z "$FUSE_BOOKS_PATH" ]; then
+        echo "Using default value for FUSE_BOOKS_PATH=false"
+        export FUSE_BOOKS_PATH=false
+    fi
+
+    if [ -z "$PARTITIONING_MODE" ]; then
+        echo "Using default value for PARTITIONING_MODE=consistent"
+        export PARTITIONING_MODE=consistent
+    fi
+
+    if [ -z "$SENTIMENT_ENGINE" ]; then
+        echo "Using default value for SENTIMENT_ENGINE=textblob"
+        export SENTIMENT_ENGINE=textblob
+    fi
+
+    if [ -z "$QUANTILE_MODE" ]; then
+        echo "Using default value for QUANTILE_MODE=exact"
+        export QUANTILE_MODE=exact
+    fi
+
+    if [ -z "$CONCURRENT_UPLOADS" ]; then
+        echo "Using default value for CONCURRENT_UPLOADS=true"
+        export CONCURRENT_UPLOADS=true
+    fi
+
+    if [ -z "$UPLOAD_WINDOW" ]; then
+        echo "Using default value for UPLOAD_WINDOW=32"
+        export UPLOAD_WINDOW=32
+    fi
+
+    if [ -z "$GROUP_COMMIT_SIZE" ]; then
+        echo "Using default value for GROUP_COMMIT_SIZE=50"
+        export GROUP_COMMIT_SIZE=50
+    fi
+
+    if [ -z "$GROUP_COMMIT_TIMEOUT" ]; then
+        echo "Using default value for GROUP_COMMIT_TIMEOUT=0.2"
+        export GROUP_COMMIT_TIMEOUT=0.2
+    fi
+
+    if [ -z "$STATE_STORE" ]; then
+        echo "Using default value for STATE_STORE=log"
+        export STATE_STORE=log
+    fi
+
+    if [ -z "$STATE_FSYNC_POLICY" ]; then
+        echo "Using default value for STATE_FSYNC_POLICY=interval"
+        export STATE_FSYNC_POLICY=interval
+    fi
+
+    if [ -z "$ASYNC_PUBLISHING" ]; then
+        echo "Using default value for ASYNC_PUBLISHING=true"
+        export ASYNC_PUBLISHING=true
+    fi
+
+    if [ -z "$SYSTEM_MSG_WIRE_FORMAT" ]; then
+        echo "Using default value for SYSTEM_MSG_WIRE_FORMAT=binary"
+        export SYSTEM_MSG_WIRE_FORMAT=binary
+    fi
+
+    # The shards of a producer share its seq nums, so each of them sees roughly 1 of every WORKERS seq nums
+    if [ -z "$DEDUP_WINDOW_SIZE" ]; then
+        echo "Using default value for DEDUP_WINDOW_SIZE=$((256 * WORKERS))"
+        export DEDUP_WINDOW_SIZE=$((256 * WORKERS))
+    fi
     
     local MAX_INSTANCES=5
     if [ $CLIENTS -gt $MAX_INSTANCES ] || [ $WORKERS -gt $MAX_INSTANCES ] || [ $HEALTH_CHECKERS -gt $MAX_INSTANCES ] ; then
@@ -756,17 +957,37 @@ check_params() {
 
 
 
+# Environment shared by every controller, echoed inside the environment section of each service
+set_common_controller_env() {
+    COMMON_CONTROLLER_ENV="      - GROUP_COMMIT_SIZE=$GROUP_COMMIT_SIZE
+      - GROUP_COMMIT_TIMEOUT=$GROUP_COMMIT_TIMEOUT
+      - STATE_STORE=$STATE_STORE
+      - STATE_FSYNC_POLICY=$STATE_FSYNC_POLICY
+      - ASYNC_PUBLISHING=$ASYNC_PUBLISHING
+      - SYSTEM_MSG_WIRE_FORMAT=$SYSTEM_MSG_WIRE_FORMAT
+      - DEDUP_WINDOW_SIZE=$DEDUP_WINDOW_SIZE"
+}
+
 # =========================================================================
 
 
 check_params
+set_common_controller_env
 add_compose_header
 add_rabbitmq
 add_server
 add_clients
+echo -n "" > src/monitorable_controllers.txt
+if [ "$FUSE_BOOKS_PATH" = "true" ]; then
+    add_fused_books_path
+else
+    add_books_path_preprocessors
+fi
 add_preprocessors
 add_mergers
-add_query1_processes
+if [ "$FUSE_BOOKS_PATH" != "true" ]; then
+    add_query1_processes
+fi
 add_query2_processes
 add_query3_processes
 add_query4_processes
@@ -0,0 +1,88 @@
+"""
+Reviews per second scored by the sentiment analyzer with 1, 2, 4 and 8 local workers.
+
+The batches are scored the same way the analyzer does: split in chunks of about the same amount of characters and mapped over a pool of workers.
+Without a reviews file, a fixed synthetic corpus is used. With the Books_rating.csv file of the dataset, its first reviews are used.
+It must run where the analyzer dependencies (pika, textblob and numpy) are installed, e.g. in the sentiment analyzer image.
+
+Usage: python misc/benchmarks/bench_sentiment_workers.py [--engine textblob|lexicon] [--reviews Books_rating.csv] [--amount 4000]
+"""
+import argparse
+import csv
+import functools
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "..", "src"))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "..", "src", "controllers", "accumulators", "sentiment_analyzer"))
+
+from sentiment_analyzer import (CHUNKS_PER_WORKER, SENTIMENT_ENGINE_TEXTBLOB, SENTIMENT_ENGINES, init_sentiment_worker,
+                                polarities_of_texts, split_in_chunks_by_length)
+
+WORKERS = [1, 2, 4, 8]
+BATCH_SIZE = 200
+SENTENCES = [
+    "This book was absolutely wonderful and I could not put it down.",
+    "The plot is slow, the characters are flat and the ending is terrible.",
+    "A decent read, although some chapters felt unnecessarily long.",
+    "I loved the vivid descriptions of the countryside.",
+    "Not the best work of the author, but still worth buying.",
+    "The translation is awful and full of mistakes.",
+    "An excellent introduction to distributed systems for beginners.",
+    "It is a boring book with a very predictable story.",
+    "Highly recommended for anyone interested in history!",
+    "The second half is much better than the first one.",
+]
+
+
+def load_reviews(reviews_file_path: str | None, amount: int) -> list[str]:
+    if reviews_file_path is not None:
+        with open(reviews_file_path, 'r') as f:
+            reviews = [row["review/text"] for _, row in zip(range(amount), csv.DictReader(f))]
+        return reviews
+    rng = random.Random(0)
+    return [" ".join(rng.choices(SENTENCES, k=rng.randint(1, 12))) for _ in range(amount)]
+
+
+def reviews_per_second(reviews: list[str], workers: int, sentiment_engine: str) -> float:
+    score = functools.partial(polarities_of_texts, sentiment_engine=sentiment_engine)
+    batches = [reviews[i:i + BATCH_SIZE] for i in range(0, len(reviews), BATCH_SIZE)]
+    if workers == 1:
+        init_sentiment_worker(sentiment_engine)
+        start = time.perf_counter()
+        for batch in batches:
+            score(batch)
+        return len(reviews) / (time.perf_counter() - start)
+
+    with Pool(workers, initializer=init_sentiment_worker, initargs=(sentiment_engine,)) as pool:
+        # Warms up the workers so the time to start them is not measured
+        pool.map(score, [batches[0][:1]] * workers)
+        start = time.perf_counter()
+        for batch in batches:
+            pool.map(score, split_in_chunks_by_length(batch, workers * CHUNKS_PER_WORKER))
+        return len(reviews) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=SENTIMENT_ENGINES, default=SENTIMENT_ENGINE_TEXTBLOB)
+    parser.add_argument("--reviews", default=None, help="Books_rating.csv file of the dataset")
+    parser.add_argument("--amount", type=int, default=4000, help="amount of reviews to score")
+    args = parser.parse_args()
+
+    reviews = load_reviews(args.reviews, args.amount)
+    print(f"{len(reviews)} reviews scored with the {args.engine} engine on {os.cpu_count()} cores")
+    print(f"{'workers':>8} {'reviews/s':>12} {'speedup':>8}")
+    baseline = None
+    for workers in WORKERS:
+        throughput = reviews_per_second(reviews, workers, args.engine)
+        baseline = baseline or throughput
+        print(f"{workers:>8} {throughput:>12.0f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
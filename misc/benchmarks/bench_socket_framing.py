@@ -0,0 +1,75 @@
+"""
+Throughput of the length prefixed framing of SocketConnectionHandler over a loopback TCP connection, for several frame sizes.
+
+- send_message: one write per frame, as the client sends its batches
+- send_messages: the frames sent in groups with a single write, as the result streams of the server flush their chunks
+- read_frame: the frames read as views of the receive buffer, without copying them
+- read_message_raw: the frames copied to bytes after each read
+
+Usage: python misc/benchmarks/bench_socket_framing.py
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+from shared.socket_connection_handler import SocketConnectionHandler
+
+FRAME_SIZES = [1024, 64 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+BYTES_PER_CASE = 200 * 1024 * 1024
+MAX_FRAMES_PER_CASE = 20000
+FRAMES_PER_WRITE = 64
+
+
+def connected_handlers() -> tuple[SocketConnectionHandler, SocketConnectionHandler]:
+    listener = socket.create_server(("127.0.0.1", 0))
+    sender_socket = socket.create_connection(listener.getsockname())
+    receiver_socket, _ = listener.accept()
+    listener.close()
+    return SocketConnectionHandler(sender_socket), SocketConnectionHandler(receiver_socket)
+
+
+def send_one_per_write(handler: SocketConnectionHandler, message: str, frames: int):
+    for _ in range(frames):
+        handler.send_message(message)
+
+
+def send_grouped(handler: SocketConnectionHandler, message: str, frames: int):
+    for sent in range(0, frames, FRAMES_PER_WRITE):
+        handler.send_messages([message] * min(FRAMES_PER_WRITE, frames - sent))
+
+
+def frames_per_second(frame_size: int, send, read) -> float:
+    message = "x" * frame_size
+    frames = max(3, min(MAX_FRAMES_PER_CASE, BYTES_PER_CASE // frame_size))
+    sender, receiver = connected_handlers()
+    writer = threading.Thread(target=send, args=(sender, message, frames))
+    start = time.perf_counter()
+    writer.start()
+    for _ in range(frames):
+        assert len(read(receiver)) == frame_size
+    writer.join()
+    elapsed = time.perf_counter() - start
+    sender.close()
+    receiver.close()
+    return frames / elapsed
+
+
+def main():
+    cases = {
+        "send_message + read_frame": (send_one_per_write, SocketConnectionHandler.read_frame),
+        "send_message + read_message_raw": (send_one_per_write, SocketConnectionHandler.read_message_raw),
+        "send_messages + read_frame": (send_grouped, SocketConnectionHandler.read_frame),
+    }
+    print(f"{'frame':>10} {'case':<34} {'frames/s':>12} {'MiB/s':>10}")
+    for frame_size in FRAME_SIZES:
+        for case_name, (send, read) in cases.items():
+            rate = frames_per_second(frame_size, send, read)
+            print(f"{frame_size // 1024:>6} KiB {case_name:<34} {rate:>12.1f} {rate * frame_size / 2 ** 20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
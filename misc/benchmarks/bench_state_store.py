@@ -0,0 +1,59 @@
+"""
+Cost of committing a small delta with each state store as the state grows.
+
+The snapshot store dumps the whole state on every commit, so its cost grows with the state. The log store appends the deltas of the commit, so its cost stays flat.
+
+Usage: python misc/benchmarks/bench_state_store.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+from shared.state_store import (FSYNC_POLICY_NEVER, INCREMENT_OP, SET_OP, LogStateStore, SnapshotStateStore,
+                                apply_state_delta)
+
+CLIENT_ID = 1
+STATE_SIZES = [1_000, 10_000, 100_000]
+COMMITS = 200
+SNAPSHOT_THRESHOLD = 8 * 1024 * 1024
+
+
+def build_state(books_count: int) -> dict:
+    return {CLIENT_ID: {"books": {f"Book title number {i}": [1990 + i % 30, 4.5, 12] for i in range(books_count)},
+                        "last_seq_num": 0}}
+
+
+def run_commits(store, state: dict) -> float:
+    """
+    Applies and commits the same deltas a controller records for each message: a seq num bump and an inserted book
+    """
+    start = time.perf_counter()
+    for i in range(COMMITS):
+        deltas = [[INCREMENT_OP, [CLIENT_ID, "last_seq_num"], 1],
+                  [SET_OP, [CLIENT_ID, "books", f"New book {i}"], [2000, 3.0, 1]]]
+        for delta in deltas:
+            apply_state_delta(state, delta)
+            store.record(delta)
+        store.commit(state)
+    return (time.perf_counter() - start) / COMMITS
+
+
+def main():
+    print(f"{'books in state':>15} {'snapshot (ms/commit)':>22} {'log (ms/commit)':>17}")
+    for books_count in STATE_SIZES:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            snapshot_store = SnapshotStateStore(os.path.join(tmp_dir, "snapshot_state.json"), FSYNC_POLICY_NEVER)
+            snapshot_cost = run_commits(snapshot_store, build_state(books_count))
+
+            log_store = LogStateStore(os.path.join(tmp_dir, "log_state.json"), FSYNC_POLICY_NEVER, 1, SNAPSHOT_THRESHOLD)
+            log_store.load()
+            log_cost = run_commits(log_store, build_state(books_count))
+            log_store.current_segment_file.close()
+        print(f"{books_count:>15} {snapshot_cost * 1000:>22.3f} {log_cost * 1000:>17.3f}")
+
+
+if __name__ == "__main__":
+    main()
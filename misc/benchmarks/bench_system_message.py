@@ -0,0 +1,56 @@
+"""
+Encode and decode cost of the text and binary SystemMessage formats for several payload sizes.
+
+- decode: reading the header fields of a message, as the dedup and routing of every controller does
+- decode+payload: decoding the message and reading its whole payload
+- forward: decoding a message and encoding it again without touching the payload, as a filter that lets a batch through does
+
+Usage: python misc/benchmarks/bench_system_message.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+from shared.protocol_messages import SystemMessage, SystemMessageType
+
+PAYLOAD_SIZES = [1024, 64 * 1024, 1024 * 1024]
+TARGET_SECONDS_PER_CASE = 0.5
+
+
+def ops_per_second(func) -> float:
+    timer = timeit.Timer(func)
+    iterations, elapsed = timer.autorange()
+    iterations = max(1, int(iterations * TARGET_SECONDS_PER_CASE / elapsed))
+    return iterations / min(timer.repeat(repeat=3, number=iterations))
+
+
+def build_msg(payload_size: int) -> SystemMessage:
+    payload = ("Some review text, with 'quotes' and numbers 4.5; " * (payload_size // 50 + 1))[:payload_size]
+    return SystemMessage(SystemMessageType.DATA, 3, "filter_of_books_by_year_and_genre", 123456, payload)
+
+
+def bench_format(msg: SystemMessage, encode, decode) -> dict[str, float]:
+    encoded = encode(msg)
+    return {
+        "encode": ops_per_second(lambda: encode(msg)),
+        "decode": ops_per_second(lambda: decode(encoded).controller_seq_num),
+        "decode+payload": ops_per_second(lambda: decode(encoded).payload),
+        "forward": ops_per_second(lambda: encode(decode(encoded))),
+    }
+
+
+def main():
+    print(f"{'payload':>9} {'operation':>15} {'text (ops/s)':>14} {'binary (ops/s)':>16} {'speedup':>8}")
+    for payload_size in PAYLOAD_SIZES:
+        msg = build_msg(payload_size)
+        # The broker hands the body of a message as bytes, so the text frames are decoded from their encoded form
+        text = bench_format(msg, lambda m: m.encode_to_str().encode(), SystemMessage.decode_from_bytes)
+        binary = bench_format(msg, SystemMessage.encode_to_bytes, SystemMessage.decode_from_bytes)
+        for operation in text:
+            print(f"{payload_size // 1024:>7}Ki {operation:>15} {text[operation]:>14.0f} {binary[operation]:>16.0f} {binary[operation] / text[operation]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ from shared.protocol_messages import QueryMessage, QueryMessageType
 from shared.socket_connection_handler import SocketConnectionHandler
 from shared import constants
 import signal
+from typing import Optional
 from multiprocessing.connection import Connection as PipeConnection
 
 
@@ -15,13 +16,24 @@ CLIENT_RESULTS_BASE_PATH = "./results/client_"
 MAX_RESULT_BYTES_FOR_RESULTS_LOGS = 100
 
 class Client:
-    def __init__(self, server_ip, server_port, reviews_file_path, books_file_path, batch_size, client_id):
+    def __init__(self, server_ip, server_port, reviews_file_path, books_file_path, batch_size, client_id, concurrent_uploads: bool = False, upload_window: int = 0):
+        """
+        ## Important parameter details:
+        - concurrent_uploads: When True, the batches of books and reviews are sent alternately, so the reviews do not wait for every book to be processed. The server must be deployed with concurrent uploads too.
+        - upload_window: When greater than 0, the batches are sent without waiting for the response to each one of them, as long as the server granted credit for them. The size of the window is decided by the server, which must be deployed with an upload window too.
+        """
         self.server_ip = server_ip
         self.server_port = server_port
         self.reviews_file_path = reviews_file_path
         self.books_file_path = books_file_path
         self.batch_size = batch_size
         self.client_id = client_id
+        self.concurrent_uploads = concurrent_uploads
+        self.upload_window = upload_window
+        # Cumulative amounts of upload messages sent, acknowledged by the server and allowed by the credit of the server
+        self.sent_msgs = 0
+        self.acked_msgs = 0
+        self.granted_msgs = 0
         self.results_dir_path = f"{CLIENT_RESULTS_BASE_PATH}{client_id}/"
         self.data_connection_handler = None
         signal.signal(signal.SIGTERM, self.__handle_shutdown)
@@ -53,24 +65,40 @@ class Client:
         listener_for_sv_results.listen()
         logging.info("Listening for server results at port {}".format(constants.CLIENT_RESULTS_PORT))
         finished_receiving_results = False
+        # Seq number of the last result chunk received. The chunks that the server sends again after reconnecting are discarded.
+        last_received_chunk = 0
         self.__clear_results_dir_for_client()
         while not finished_receiving_results:
+            results_connection_handler = None
             try:
                 sv_sock, _ = listener_for_sv_results.accept()
                 results_connection_handler = SocketConnectionHandler.create_from_socket(sv_sock)
-                received_msg_str, size_in_lines = results_connection_handler.read_message_with_size_in_lines()
-                received_msg = QueryMessage.decode_from_str(received_msg_str)
-                if received_msg.type == QueryMessageType.CONTINUE:
-                    sender_pipe.send(CONTINUE_WITH_REVIEWS_DATA)
-                elif received_msg.type == QueryMessageType.SV_RESULT:
-                    logging.info(f"\n \n   [[[ Size of received result: {size_in_lines - 1} rows ]]]\n {received_msg.payload[:MAX_RESULT_BYTES_FOR_RESULTS_LOGS]}... \n")
-                    self.__save_results_to_file(received_msg.payload)
-                elif received_msg.type == QueryMessageType.SV_FINISHED:
-                    logging.info("[ SERVER FINISHED SENDING RESULTS, EXITING... ]")
-                    finished_receiving_results = True
-                results_connection_handler.close()
+                # The server keeps the connection open, and finishes by flushing the SV_FINISHED message
+                while True:
+                    received_msg_str, size_in_lines = results_connection_handler.read_message_with_size_in_lines()
+                    received_chunk = QueryMessage.decode_from_str(received_msg_str)
+                    if received_chunk.type == QueryMessageType.RESULTS_FLUSH:
+                        results_connection_handler.send_message(QueryMessage(QueryMessageType.RESULTS_ACK, self.client_id, str(last_received_chunk)).encode_to_str())
+                        if finished_receiving_results:
+                            break
+                        continue
+                    chunk_seq_num, received_msg = received_chunk.get_result_chunk()
+                    if chunk_seq_num <= last_received_chunk:
+                        continue
+                    last_received_chunk = chunk_seq_num
+                    if received_msg.type == QueryMessageType.CONTINUE:
+                        sender_pipe.send(CONTINUE_WITH_REVIEWS_DATA)
+                    elif received_msg.type == QueryMessageType.SV_RESULT:
+                        logging.info(f"\n \n   [[[ Size of received result: {size_in_lines - 1} rows ]]]\n {received_msg.payload[:MAX_RESULT_BYTES_FOR_RESULTS_LOGS]}... \n")
+                        self.__save_results_to_file(received_msg.payload)
+                    elif received_msg.type == QueryMessageType.SV_FINISHED:
+                        logging.info("[ SERVER FINISHED SENDING RESULTS, EXITING... ]")
+                        finished_receiving_results = True
             except Exception as e:
                 logging.error("Error handling server results: {}".format(str(e)))
+            finally:
+                if results_connection_handler is not None:
+                    results_connection_handler.close()
 
     def __clear_results_dir_for_client(self):
         if not os.path.exists(self.results_dir_path):
@@ -97,12 +125,71 @@ class Client:
 
     def send_files_data(self, receiver_pipe: PipeConnection):
         logging.info("Sending files data to server")
+        if self.concurrent_uploads:
+            self.send_files_data_concurrently()
+            return
         with open(self.books_file_path, 'r') as file:
             self.send_books_data(receiver_pipe, file) 
         with open(self.reviews_file_path, 'r') as file:
             self.send_reviews_data(file)
 
 
+    def send_files_data_concurrently(self):
+        logging.info("[ SENDING BOOKS AND REVIEWS DATA CONCURRENTLY ] STARTED")
+        with open(self.books_file_path, 'r') as books_file, open(self.reviews_file_path, 'r') as reviews_file:
+            books_file.readline()
+            reviews_file.readline()
+            completed_books = False
+            completed_reviews = False
+            while not (completed_books and completed_reviews):
+                if not completed_books:
+                    completed_books = self.__send_next_batch(books_file, QueryMessageType.DATA_B, QueryMessageType.EOF_B)
+                if not completed_reviews:
+                    completed_reviews = self.__send_next_batch(reviews_file, QueryMessageType.DATA_R, QueryMessageType.EOF_R)
+            self.__wait_for_acks()
+        logging.info("[ SENDING BOOKS AND REVIEWS DATA CONCURRENTLY ] FINISHED")
+
+    def __send_next_batch(self, file: io.TextIOWrapper, data_msg_type: QueryMessageType, eof_msg_type: QueryMessageType) -> bool:
+        """
+        Sends the next batch of the file, or its EOF if the file is completed. Returns True if the EOF was sent.
+        """
+        batch = self.__get_next_batch_from_file(file)
+        if not batch:
+            msg_for_server = QueryMessage(eof_msg_type, self.client_id).encode_to_str()
+        else:
+            msg_for_server = QueryMessage(data_msg_type, self.client_id, batch).encode_to_str()
+        response = self.__send_upload_msg(msg_for_server)
+        if response is not None and response.type != QueryMessageType.DATA_ACK:
+            raise RuntimeError(f"Unexpected response from server: {response.type}")
+        return not batch
+
+    def __send_upload_msg(self, msg_for_server: str) -> Optional[QueryMessage]:
+        """
+        Without an upload window, sends the message and returns the response of the server.
+        With it, the message is sent as soon as the server granted credit for it and None is returned, as the server acknowledges the messages cumulatively.
+        """
+        if not self.upload_window:
+            self.data_connection_handler.send_message(msg_for_server)
+            return QueryMessage.decode_from_str(self.data_connection_handler.read_message())
+        while self.sent_msgs >= self.granted_msgs:
+            self.__read_credit()
+        self.data_connection_handler.send_message(msg_for_server)
+        self.sent_msgs += 1
+        return None
+
+    def __read_credit(self):
+        response = QueryMessage.decode_from_str(self.data_connection_handler.read_message())
+        if response.type != QueryMessageType.CREDIT:
+            raise RuntimeError(f"Unexpected response from server: {response.type}")
+        self.acked_msgs, self.granted_msgs = response.get_credit()
+
+    def __wait_for_acks(self):
+        """
+        Blocks until the server acknowledged every message sent with the upload window
+        """
+        while self.acked_msgs < self.sent_msgs:
+            self.__read_credit()
+
     def send_books_data(self, receiver_pipe: PipeConnection, file: io.TextIOWrapper):
         logging.info("[ SENDING BOOKS DATA ] STARTED")
         completed_books = False
@@ -112,22 +199,30 @@ class Client:
             if not batch:
                 completed_books = True
                 msg_for_server = QueryMessage(QueryMessageType.EOF_B, self.client_id).encode_to_str()
-                self.data_connection_handler.send_message(msg_for_server)
             else: 
                 msg_for_server = QueryMessage(QueryMessageType.DATA_B, self.client_id, batch).encode_to_str()
-                self.data_connection_handler.send_message(msg_for_server)
-            response = QueryMessage.decode_from_str(self.data_connection_handler.read_message())
+            response = self.__send_upload_msg(msg_for_server)
+            if response is None:
+                # With the upload window, the server does not tell the client to wait, but the reviews are only sent once every merger confirmed the books
+                if completed_books:
+                    self.__wait_for_acks()
+                    self.__wait_for_continuation(receiver_pipe)
+                continue
             if response.type == QueryMessageType.DATA_ACK:
                 continue
             elif response.type == QueryMessageType.WAIT_FOR_SV:
-                logging.info("All books data was sent. Waiting for server to confirm continuation with reviews data")
-                msg = receiver_pipe.recv()
-                if msg == CONTINUE_WITH_REVIEWS_DATA:
-                    logging.info("Server confirmed continuation")
-                else:
-                    logging.error("Server did not confirm continuation")
+                if not self.__wait_for_continuation(receiver_pipe):
                     break
 
+    def __wait_for_continuation(self, receiver_pipe: PipeConnection) -> bool:
+        logging.info("All books data was sent. Waiting for server to confirm continuation with reviews data")
+        msg = receiver_pipe.recv()
+        if msg == CONTINUE_WITH_REVIEWS_DATA:
+            logging.info("Server confirmed continuation")
+            return True
+        logging.error("Server did not confirm continuation")
+        return False
+
     def send_reviews_data(self, file):
         logging.info("[ SENDING REVIEWS DATA ] STARTED")
         completed_reviews = False
@@ -137,16 +232,15 @@ class Client:
             if not batch:
                 completed_reviews = True
                 msg_for_server = QueryMessage(QueryMessageType.EOF_R, self.client_id).encode_to_str()
-                self.data_connection_handler.send_message(msg_for_server)
             else: 
                 msg_for_server = QueryMessage(QueryMessageType.DATA_R, self.client_id, batch).encode_to_str()
-                self.data_connection_handler.send_message(msg_for_server)
-            response = QueryMessage.decode_from_str(self.data_connection_handler.read_message())
-            if response.type == QueryMessageType.DATA_ACK:
+            response = self.__send_upload_msg(msg_for_server)
+            if response is None or response.type == QueryMessageType.DATA_ACK:
                 continue
             else:
                 logging.error("Error sending reviews data")
                 break
+        self.__wait_for_acks()
 
     def __get_next_batch_from_file(self, file):
         batch = ""
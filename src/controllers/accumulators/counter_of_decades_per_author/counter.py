@@ -1,13 +1,19 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 from shared import constants
+from shared.batch_schemas import AUTHOR_DECADES_COUNT_SCHEMA, AUTHOR_DECADE_SCHEMA
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 
 
 AUTHOR_IDX = 0
 DECADE_IDX = 1
 
+# The decades of each author are kept as a bitmask with one bit per decade. The decades are numbered in zigzag order around
+# PIVOT_DECADE (2000 -> bit 0, 1990 -> bit 1, 2010 -> bit 2, 1980 -> bit 3, ...), so the masks of recent decades are small integers.
+PIVOT_DECADE = 2000
+# Mask of the authors that were already emitted when they reached the minimum of decades. As it has every bit set, the decades received afterwards never change it.
+EMITTED_AUTHOR = -1
+
 class CounterOfDecadesPerAuthor(MonitorableProcess):
     def __init__(self, 
                  input_exchange: str, 
@@ -15,9 +21,15 @@ class CounterOfDecadesPerAuthor(MonitorableProcess):
                  input_queue_of_authors: str, 
                  output_queue_of_authors: str,
                  batch_size: int,
-                 controller_name: str):
+                 controller_name: str,
+                 min_decades_to_emit: int = 0):
+        """
+        ## Important parameter details:
+        - min_decades_to_emit: When greater than 0, each author is emitted as soon as it reaches this amount of decades, with the decades count at that moment, and the authors that do not reach it are not emitted at EOF. When 0, every author is emitted at EOF.
+        """
         super().__init__(controller_name)
         self.batch_size = batch_size
+        self.min_decades_to_emit = min_decades_to_emit
 
         self.input_exchange = input_exchange
         self.output_exchange = output_exchange
@@ -28,10 +40,10 @@ class CounterOfDecadesPerAuthor(MonitorableProcess):
         
         
     def start(self):
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange,
-                                                         output_queues_to_bind={self.output_queue_of_authors: [self.output_queue_of_authors]},
-                                                         input_exchange_name=self.input_exchange,
-                                                         input_queues_to_recv_from=[self.input_queue_of_authors])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange,
+                                                                        output_queues_to_bind={self.output_queue_of_authors: [self.output_queue_of_authors]},
+                                                                        input_exchange_name=self.input_exchange,
+                                                                        input_queues_to_recv_from=[self.input_queue_of_authors])
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue_of_authors, self.state_handler_callback,self.__count_authors)
         self.mq_connection_handler.start_consuming()
             
@@ -42,53 +54,68 @@ class CounterOfDecadesPerAuthor(MonitorableProcess):
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_of_authors, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue_of_authors, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            authors_decades_batch = body.get_batch_iter_from_payload()
-            for author_decade in authors_decades_batch:
+            authors_decades_batch = body.get_batch_from_payload(AUTHOR_DECADE_SCHEMA)
+            decades_mask_per_author: dict[str, int] = {}
+            for author_decade in authors_decades_batch.rows():
                 author = author_decade[AUTHOR_IDX]
-                decade = author_decade[DECADE_IDX]
-                self.__update_authors_decades_per_client(body.client_id, author, decade)
+                decades_mask_per_author[author] = decades_mask_per_author.get(author, 0) | decade_bit(author_decade[DECADE_IDX])
+            self.__update_authors_decades_per_client(body.client_id, decades_mask_per_author)
 
         
     def __send_results(self, client_id):
         payload_current_size = 0
-        payload_to_send = ""
-        authors_decades = list(self.state[client_id].get("authors_decades", {}).items())
+        batch_to_send = ColumnarBatch(AUTHOR_DECADES_COUNT_SCHEMA)
+        authors_decades = [(author, decades_mask.bit_count()) for author, decades_mask in self.state[client_id].get("authors_decades", {}).items()
+                           if decades_mask != EMITTED_AUTHOR and decades_mask.bit_count() >= self.min_decades_to_emit]
         
-        for i, (author, decades) in enumerate(authors_decades):
-            payload_to_send += f"{author},{len(decades)}\n"
+        for i, (author, decades_count) in enumerate(authors_decades):
+            batch_to_send.append_row(author, decades_count)
             payload_current_size += 1
             if (payload_current_size == self.batch_size) or (i == len(authors_decades) - 1):
                 seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
-                self.mq_connection_handler.send_message(self.output_queue_of_authors, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, payload_to_send).encode_to_str())
+                self.mq_connection_handler.send_message(self.output_queue_of_authors, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, batch_to_send.encode()))
                 self.update_self_seq_number(client_id, seq_num_to_send)
-                payload_to_send = ""
+                batch_to_send = ColumnarBatch(AUTHOR_DECADES_COUNT_SCHEMA)
                 payload_current_size = 0
         
         seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
-        self.mq_connection_handler.send_message(self.output_queue_of_authors, SystemMessage(SystemMessageType.EOF_B, client_id, self.controller_name, seq_num_to_send).encode_to_str())
+        self.mq_connection_handler.send_message(self.output_queue_of_authors, SystemMessage(SystemMessageType.EOF_B, client_id, self.controller_name, seq_num_to_send))
         self.update_self_seq_number(client_id, seq_num_to_send)
-        self.state[client_id]["authors_decades"] = {}
+        self.set_state_value(client_id, ["authors_decades"], {})
         logging.info("Sent EOF message to output queue")
 
         
-    def __update_authors_decades_per_client(self, client_id, author, decade):
-        if client_id in self.state:
-            if "authors_decades" in self.state[client_id]:
-                if author in self.state[client_id]["authors_decades"]:
-                    self.state[client_id]["authors_decades"][author].add(decade)
-                else:
-                    self.state[client_id]["authors_decades"][author] = set([decade])
-            else:
-                self.state[client_id]["authors_decades"] = {author: set([decade])}
-        else:
-            self.state[client_id] = {"authors_decades": {author: set([decade])}}
+    def __update_authors_decades_per_client(self, client_id, decades_mask_per_author: dict[str, int]):
+        authors_decades = self.state[client_id].get("authors_decades", {})
+        batch_to_send = ColumnarBatch(AUTHOR_DECADES_COUNT_SCHEMA)
+        for author, decades_mask in decades_mask_per_author.items():
+            # Only the decades that are new for the author are recorded in the state
+            if decades_mask & ~authors_decades.get(author, 0):
+                decades_count = self.bit_or_state_value(client_id, ["authors_decades", author], decades_mask).bit_count()
+                if self.min_decades_to_emit > 0 and decades_count >= self.min_decades_to_emit:
+                    batch_to_send.append_row(author, decades_count)
+                    self.set_state_value(client_id, ["authors_decades", author], EMITTED_AUTHOR)
+        if batch_to_send:
+            seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
+            self.mq_connection_handler.send_message(self.output_queue_of_authors, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, batch_to_send.encode()))
+            self.update_self_seq_number(client_id, seq_num_to_send)
             
     def __parse_decades_state(self):   
-        # Convert list returned by json to set
+        # States saved before the decade bitmasks kept a list of decades per author
         for client_id, client_data in self.state.items():
             if "authors_decades" in client_data:
                 for author, decades in client_data["authors_decades"].items():
-                    self.state[client_id]["authors_decades"][author] = set(decades)
\ No newline at end of file
+                    if not isinstance(decades, int):
+                        decades_mask = 0
+                        for decade in decades:
+                            decades_mask |= decade_bit(int(decade))
+                        self.state[client_id]["authors_decades"][author] = decades_mask
+
+
+def decade_bit(decade: int) -> int:
+    decades_from_pivot = (decade - PIVOT_DECADE) // 10
+    bit_index = 2 * decades_from_pivot if decades_from_pivot >= 0 else -2 * decades_from_pivot - 1
+    return 1 << bit_index
@@ -1,16 +1,20 @@
 import logging
-from shared.mq_connection_handler import MQConnectionHandler
 from shared import constants
 import csv
 import io
+from shared.batch_schemas import BOOKS_REVIEWS_SCHEMA, COMPACT_REVIEWS_SCHEMA
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 
 TITLE_IDX = 0
 AUTHORS_IDX = 1
 SCORE_IDX = 2
 DECADE_IDX = 3
 
+# Each book is kept as a row of the output batch, with the sum of its scores and its amount of reviews instead of the list of scores
+SCORE_SUM_IDX = 2
+REVIEWS_COUNT_IDX = 4
+
 
 class CounterOfReviewsPerBook(MonitorableProcess):
     def __init__(self, 
@@ -27,10 +31,10 @@ class CounterOfReviewsPerBook(MonitorableProcess):
         self.output_exchange_name = output_exchange_name
         self.input_queue_name = input_queue_name
         self.output_queue_name = output_queue_name
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange_name,
-                                                         output_queues_to_bind={self.output_queue_name: [self.output_queue_name]},
-                                                         input_exchange_name=self.input_exchange_name,
-                                                         input_queues_to_recv_from=[self.input_queue_name])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange_name,
+                                                                        output_queues_to_bind={self.output_queue_name: [self.output_queue_name]},
+                                                                        input_exchange_name=self.input_exchange_name,
+                                                                        input_queues_to_recv_from=[self.input_queue_name])
        
     def start(self):
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue_name, self.state_handler_callback, self.__count_reviews)
@@ -38,7 +42,7 @@ class CounterOfReviewsPerBook(MonitorableProcess):
     
     def __count_reviews(self, body: SystemMessage):
         """
-        The message should have the following format: title,authors,score,decade
+        The batch should have the following columns: title,authors,score,decade
         """
         if body.type == SystemMessageType.EOF_R:
             logging.info(f"Received EOF_R from [ client_{body.client_id} ]. Sending results to output queue.")
@@ -46,34 +50,36 @@ class CounterOfReviewsPerBook(MonitorableProcess):
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            reviews = body.get_batch_iter_from_payload()
-            for row in reviews:
+            reviews = body.get_batch_from_payload(COMPACT_REVIEWS_SCHEMA)
+            for row in reviews.rows():
                 title = row[TITLE_IDX]
-                self.state[body.client_id].setdefault("books_reviews", dict()).setdefault(title, [row[TITLE_IDX],row[AUTHORS_IDX],list(),row[DECADE_IDX]])
-                self.state[body.client_id]["books_reviews"][title][SCORE_IDX].append(row[SCORE_IDX])  
+                if title not in self.state[body.client_id].get("books_reviews", {}):
+                    self.set_state_value(body.client_id, ["books_reviews", title], [row[TITLE_IDX],row[AUTHORS_IDX],0,row[DECADE_IDX],0])
+                self.increment_state_value(body.client_id, ["books_reviews", title, SCORE_SUM_IDX], row[SCORE_IDX])
+                self.increment_state_value(body.client_id, ["books_reviews", title, REVIEWS_COUNT_IDX])
                     
     
     def __send_results(self, body: SystemMessage):
         payload_current_size = 0
-        payload_to_send = ""
+        batch_to_send = ColumnarBatch(BOOKS_REVIEWS_SCHEMA)
         books_reviews = self.state.get(body.client_id, {}).get("books_reviews", {})
         books_reviews_items = list(books_reviews.items())
 
         for i, (title, review) in enumerate(books_reviews_items):
-            payload_to_send += f"{title},\"{review[AUTHORS_IDX]}\",\"{review[SCORE_IDX]}\",{review[DECADE_IDX]},{len(review[SCORE_IDX])}\n"
+            batch_to_send.append_row(title, review[AUTHORS_IDX], review[SCORE_SUM_IDX], review[DECADE_IDX], review[REVIEWS_COUNT_IDX])
             payload_current_size += 1
             if (payload_current_size == self.batch_size) or (i == len(books_reviews_items) - 1):
                 next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-                self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, payload_to_send).encode_to_str())
+                self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, batch_to_send.encode()))
                 self.update_self_seq_number(body.client_id, next_seq_num)
-                payload_to_send = ""
+                batch_to_send = ColumnarBatch(BOOKS_REVIEWS_SCHEMA)
                 payload_current_size = 0
 
         next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-        self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num).encode_to_str())
+        self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num))
         self.update_self_seq_number(body.client_id, next_seq_num)
-        self.state[body.client_id]["books_reviews"] = {}
+        self.set_state_value(body.client_id, ["books_reviews"], {})
         logging.info("Sent EOF message to output queue")
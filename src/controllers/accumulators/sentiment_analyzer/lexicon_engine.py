@@ -0,0 +1,192 @@
+import functools
+import logging
+import re
+import numpy as np
+from textblob._text import EMOTICONS
+from textblob.en import sentiment as textblob_sentiment
+
+# Polarity engine that scores whole batches of texts with the lexicon of TextBlob, reproducing the rules of TextBlob.sentiment.polarity:
+# - Each known word is an assessment with the polarity of the word. A known adverb (modifier) is merged with the known word that follows it ("very good"), which takes the polarity of that word multiplied by the intensity of the adverb.
+# - A negation before a known word ("not good") inverts the intensity of the assessment, and negated assessments count as -0.5 times their polarity. Negations are retained across small words ("not a good").
+# - Each exclamation mark after an assessment multiplies its polarity by 1.25, and emoticons are assessments with the polarity of their mood.
+# - The polarity of a text is the mean of the polarities of its assessments, or 0 if there are none.
+#
+# The texts are tokenized with a single regex that splits them like the tokenizer of TextBlob does.
+# Parity with TextBlob.sentiment.polarity: the polarities are the same up to float rounding (1e-9) for texts of words, contractions, punctuation and spaced emoticons, as checked by tests/test_lexicon_engine.py on a fixed corpus of reviews.
+# The tokenizers only differ on corner cases such as emoticons glued to words ("great:-D") or abbreviations of one letter, where the polarity of a text may differ by up to 0.15.
+
+# Flags of each entry of the vocabulary
+KNOWN = 1
+MODIFIER = 2
+LY_MODIFIER = 4
+NEGATION = 8
+EMOTICON = 16
+EXCLAMATION = 32
+
+EXCLAMATION_BOOST = 1.25
+NEGATED_POLARITY_FACTOR = -0.5
+SARCASM = "(!)"
+
+# Unknown words longer than these do not retain the preceding negation or modifier
+MAX_LENGTH_RETAINING_NEGATION = 1
+MAX_LENGTH_RETAINING_MODIFIER = 2
+
+# Punctuation marks are split from the start and the end of the words, except for the periods at the start, and quotes are split everywhere, so none of them are part of the tokens
+PUNCTUATION_MARKS = ".,;:!?()[]{}`'\"@#$^&*+-|=~_"
+QUOTES = "'\"“”‘’"
+QUOTES_PATTERN = re.escape(QUOTES)
+EDGE_PATTERN = re.escape(PUNCTUATION_MARKS + QUOTES)
+LEADING_EDGE_PATTERN = re.escape(PUNCTUATION_MARKS.replace(".", "") + QUOTES)
+
+
+class LexiconPolarityEngine:
+    def __init__(self):
+        """
+        Loads the lexicon of TextBlob into a sorted vocabulary, so that all the tokens of a batch are looked up at once, and arrays with the polarity, intensity and flags of each word.
+        """
+        textblob_sentiment.load()
+        entries: dict[str, tuple[float, float, int]] = {}
+        for word, scores_by_pos in textblob_sentiment.items():
+            polarity, _, intensity = scores_by_pos[None]
+            flags = KNOWN
+            if any(pos in scores_by_pos for pos in textblob_sentiment.modifiers):
+                flags |= MODIFIER
+                if textblob_sentiment.modifier(word):
+                    flags |= LY_MODIFIER
+            entries[word] = (polarity, intensity, flags)
+        for negation in textblob_sentiment.negations:
+            polarity, intensity, flags = entries.get(negation, (0.0, 1.0, 0))
+            entries[negation] = (polarity, intensity, flags | NEGATION)
+
+        # Emoticons are matched with their case and with optional spaces between their characters, as TextBlob does, but looked up in lower case like the rest of the tokens.
+        # Emoticons made of letters (e.g. xD) are words for TextBlob.
+        emoticons = {SARCASM: 0.0}
+        for (_, mood_polarity), mood_emoticons in EMOTICONS.items():
+            for emoticon in mood_emoticons:
+                if not emoticon.isalpha():
+                    emoticons[emoticon] = mood_polarity
+        for emoticon, mood_polarity in emoticons.items():
+            entries.setdefault(emoticon.lower(), (mood_polarity, 1.0, EMOTICON))
+        entries["!"] = (0.0, 1.0, EXCLAMATION)
+
+        vocabulary = sorted(entries)
+        self.vocabulary = np.array(vocabulary)
+        self.polarities = np.array([entries[word][0] for word in vocabulary], dtype=np.float64)
+        self.intensities = np.array([entries[word][1] for word in vocabulary], dtype=np.float64)
+        self.flags = np.array([entries[word][2] for word in vocabulary], dtype=np.int64)
+
+        # Emoticons made only of punctuation marks are always split from the words around them, the rest only when they are not glued to a word
+        emoticons_by_length = sorted(emoticons, key=len, reverse=True)
+        split_emoticons_pattern = "|".join(self.__emoticon_pattern(emoticon) for emoticon in emoticons_by_length if all(char in PUNCTUATION_MARKS for char in emoticon))
+        glued_emoticons_pattern = "|".join(self.__emoticon_pattern(emoticon) for emoticon in emoticons_by_length if not all(char in PUNCTUATION_MARKS for char in emoticon))
+        word_pattern = f"[^\\s{LEADING_EDGE_PATTERN}](?:[^\\s{QUOTES_PATTERN}]*[^\\s{EDGE_PATTERN}])?"
+        self.token_regex = re.compile(f"{split_emoticons_pattern}|(?:{glued_emoticons_pattern})(?=[\\s{EDGE_PATTERN}]|$)|\\.{{3,}}(?=[\\s{EDGE_PATTERN}]|$)|{word_pattern}|!")
+        logging.info(f"[LEXICON ENGINE]: loaded {len(vocabulary)} words and emoticons")
+
+    def __emoticon_pattern(self, emoticon: str) -> str:
+        return " ?".join(re.escape(char) for char in emoticon)
+
+    def __tokenize(self, text: str) -> list[str]:
+        return self.token_regex.findall(text.replace("n't", " n't"))
+
+    def polarities_of_texts(self, texts: list[str]) -> list[float]:
+        """
+        Returns the polarity of each text, in the same order as the texts.
+        """
+        tokens_of_texts = [self.__tokenize(text) for text in texts]
+        tokens_per_text = np.array([len(tokens) for tokens in tokens_of_texts], dtype=np.int64)
+        tokens = np.array([token for tokens in tokens_of_texts for token in tokens], dtype=str)
+        if len(tokens) == 0:
+            return [0.0] * len(texts)
+        tokens = np.char.replace(np.char.lower(tokens), " ", "")
+
+        # Every token that is not in the vocabulary is an unknown word
+        positions = np.searchsorted(self.vocabulary, tokens).clip(max=len(self.vocabulary) - 1)
+        in_vocabulary = self.vocabulary[positions] == tokens
+        flags = np.where(in_vocabulary, self.flags[positions], 0)
+        polarities = np.where(in_vocabulary, self.polarities[positions], 0.0)
+        intensities = np.where(in_vocabulary, self.intensities[positions], 1.0)
+        lengths = np.char.str_len(tokens)
+
+        known = (flags & KNOWN) != 0
+        modifier = (flags & MODIFIER) != 0
+        ly_modifier = (flags & LY_MODIFIER) != 0
+        negation = (flags & NEGATION) != 0
+        emoticon = (flags & EMOTICON) != 0
+        exclamation = (flags & EXCLAMATION) != 0
+        unknown = ~known
+
+        text_of_token = np.repeat(np.arange(len(texts)), tokens_per_text)
+        first_token_of_text = np.repeat(np.cumsum(tokens_per_text) - tokens_per_text, tokens_per_text)
+
+        def last_before(mask: np.ndarray) -> np.ndarray:
+            """
+            Index of the last token before each token, in the same text, for which mask is set, or -1 if there is none
+            """
+            indexes = np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+            indexes = np.concatenate(([-1], indexes[:-1]))
+            return np.where(indexes >= first_token_of_text, indexes, -1)
+
+        # Preceding modifier: the last known word, unless a long unknown word came after it.
+        # A negation after an adverb ending in -ly negates the assessment of the adverb instead ("really not good"), and keeps the modifier.
+        last_modifier_candidate = last_before(known | (unknown & ~negation & (lengths > MAX_LENGTH_RETAINING_MODIFIER)))
+        last_breaking_negation = last_before(unknown & negation & (lengths > MAX_LENGTH_RETAINING_MODIFIER))
+        candidate = last_modifier_candidate.clip(min=0)
+        preceded_by_modifier = (last_modifier_candidate >= 0) & known[candidate] & modifier[candidate]
+        preceded_by_ly_modifier = preceded_by_modifier & ly_modifier[candidate]
+        modified = known & preceded_by_modifier & (ly_modifier[candidate] | (last_breaking_negation < last_modifier_candidate))
+        negates_modifier = unknown & negation & preceded_by_ly_modifier
+
+        # Preceding negation: the last negation, unless a known word or an unknown word that is not small came after it
+        last_negation_candidate = last_before(known | negation | (unknown & (lengths > MAX_LENGTH_RETAINING_NEGATION)))
+        candidate = last_negation_candidate.clip(min=0)
+        negated = known & (last_negation_candidate >= 0) & negation[candidate] & ~negates_modifier[candidate]
+        intensities = np.where(negated, 1.0 / intensities, intensities)
+
+        # Each assessment starts with a known word that is not modified or with an emoticon, and spans the modified words that follow it
+        assessing = known | emoticon
+        assessing_tokens = np.flatnonzero(assessing)
+        if len(assessing_tokens) == 0:
+            return [0.0] * len(texts)
+        starts = emoticon[assessing_tokens] | ~modified[assessing_tokens]
+        starts_positions = np.flatnonzero(starts)
+        assessment_of_assessing_token = np.cumsum(starts) - 1
+        ends_positions = np.concatenate((starts_positions[1:] - 1, [len(assessing_tokens) - 1]))
+
+        # A modified word takes the polarity of the word multiplied by the intensity of the previous word of the assessment
+        end_tokens = assessing_tokens[ends_positions]
+        previous_tokens = assessing_tokens[(ends_positions - 1).clip(min=0)]
+        assessment_polarities = np.where(ends_positions > starts_positions,
+                                         (polarities[end_tokens] * intensities[previous_tokens]).clip(-1.0, 1.0),
+                                         polarities[assessing_tokens[starts_positions]])
+
+        assessment_of_token = np.full(len(tokens), -1)
+        assessment_of_token[assessing_tokens] = assessment_of_assessing_token
+        is_last_of_assessment = np.zeros(len(tokens), dtype=bool)
+        is_last_of_assessment[end_tokens] = True
+
+        # Exclamation marks boost the assessment before them, unless a modified word is merged into it afterwards
+        last_assessing = last_before(assessing)
+        boosting = last_assessing[exclamation]
+        boosting = boosting[boosting >= 0]
+        boosting = boosting[is_last_of_assessment[boosting]]
+        boosts = np.bincount(assessment_of_token[boosting], minlength=len(starts_positions))
+        assessment_polarities = (assessment_polarities * EXCLAMATION_BOOST ** boosts).clip(-1.0, 1.0)
+
+        negated_assessments = np.logical_or.reduceat(negated[assessing_tokens], starts_positions)
+        negated_modifiers = last_assessing[negates_modifier]
+        negated_assessments[assessment_of_token[negated_modifiers[negated_modifiers >= 0]]] = True
+        assessment_polarities = np.where(negated_assessments, assessment_polarities * NEGATED_POLARITY_FACTOR, assessment_polarities)
+
+        text_of_assessment = text_of_token[assessing_tokens[starts_positions]]
+        polarity_sums = np.bincount(text_of_assessment, weights=assessment_polarities, minlength=len(texts))
+        assessments_per_text = np.bincount(text_of_assessment, minlength=len(texts))
+        return (polarity_sums / np.maximum(assessments_per_text, 1)).tolist()
+
+
+@functools.cache
+def load_lexicon_engine() -> LexiconPolarityEngine:
+    """
+    Engine of the current process. The lexicon is loaded the first time that it is called.
+    """
+    return LexiconPolarityEngine()
@@ -1,16 +1,24 @@
-from shared.initializers import init_configs, init_log
+from shared.initializers import init_configs, init_log, init_optional_configs
 from sentiment_analyzer import SentimentAnalyzer
 import logging
 
 def main():
     config_params = init_configs(["LOGGING_LEVEL", "INPUT_EXCHANGE", "OUTPUT_EXCHANGE", "INPUT_QUEUE_OF_REVIEWS", "OUTPUT_QUEUE_OF_REVIEWS", "CONTROLLER_NAME", "BATCH_SIZE"])
     init_log(config_params["LOGGING_LEVEL"])
+    optional_config_params = init_optional_configs({"SENTIMENT_WORKERS": "1", 
+                                                    "SENTIMENT_ENGINE": "textblob",
+                                                    "POLARITY_CACHE_SIZE_MB": "0",
+                                                    "POLARITY_CACHE_PERSISTENCE": "false"})
     sentiment_analyzer = SentimentAnalyzer(config_params["INPUT_EXCHANGE"], 
                                            config_params["OUTPUT_EXCHANGE"], 
                                            config_params["INPUT_QUEUE_OF_REVIEWS"], 
                                            config_params["OUTPUT_QUEUE_OF_REVIEWS"],
                                            int(config_params["BATCH_SIZE"]),
-                                           config_params["CONTROLLER_NAME"])
+                                           config_params["CONTROLLER_NAME"],
+                                           int(optional_config_params["SENTIMENT_WORKERS"]),
+                                           optional_config_params["SENTIMENT_ENGINE"],
+                                           int(optional_config_params["POLARITY_CACHE_SIZE_MB"]),
+                                           optional_config_params["POLARITY_CACHE_PERSISTENCE"].lower() == "true")
     sentiment_analyzer.start()
     
 if __name__ == "__main__":
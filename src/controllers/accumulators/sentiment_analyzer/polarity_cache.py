@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+from shared.atomic_writer import AtomicWriter
+
+DIGEST_SIZE = 8
+# Approximate memory used by each entry: the int digest, the float polarity and the node of the ordered dict
+ESTIMATED_BYTES_PER_ENTRY = 160
+
+
+class PolarityCache:
+    def __init__(self, max_size_in_bytes: int, sentiment_engine: str, cache_file_path: Optional[str] = None):
+        """
+        LRU cache of the polarity of the review texts, keyed by a digest of the normalized text, so the reviews that are posted many times are only scored once.
+        The polarity only depends on the text, so the cache is shared by all the clients and it is not reset on abort.
+
+        :param max_size_in_bytes: memory budget of the cache. The least recently used entries are evicted when it is exceeded.
+        :param sentiment_engine: engine that scored the polarities. A persisted cache is discarded if it was filled by another engine.
+        :param cache_file_path: file where the cache is persisted, so it survives restarts. If None, the cache is only kept in memory.
+        """
+        self.max_entries = max(1, max_size_in_bytes // ESTIMATED_BYTES_PER_ENTRY)
+        self.sentiment_engine = sentiment_engine
+        self.cache_file_path = cache_file_path
+        self.polarity_of_digest: OrderedDict[int, float] = OrderedDict()
+        self.has_unsaved_entries = False
+
+        self.lookups = 0
+        self.hits = 0
+        self.scored_texts = 0
+        self.scoring_time = 0.0
+        self.__load()
+
+    def __digest(self, text: str) -> int:
+        """
+        Digest of the text with its whitespace collapsed, which does not change its polarity as the texts are tokenized on whitespace
+        """
+        normalized_text = " ".join(text.split())
+        return int.from_bytes(hashlib.blake2b(normalized_text.encode('utf-8'), digest_size=DIGEST_SIZE).digest(), 'big')
+
+    def polarities_of_texts(self, texts: list[str], calculate_polarities: Callable[[list[str]], list[float]]) -> list[float]:
+        """
+        Returns the polarity of each text, in the same order as the texts. Only the texts that are not cached are scored, each of them once even if it is repeated in the batch.
+        """
+        polarities: list[Optional[float]] = [None] * len(texts)
+        indexes_of_missing_digest: dict[int, list[int]] = {}
+        for index, text in enumerate(texts):
+            digest = self.__digest(text)
+            polarity = self.polarity_of_digest.get(digest)
+            if polarity is not None:
+                self.polarity_of_digest.move_to_end(digest)
+                polarities[index] = polarity
+            else:
+                indexes_of_missing_digest.setdefault(digest, []).append(index)
+        self.lookups += len(texts)
+        self.hits += len(texts) - len(indexes_of_missing_digest)
+
+        if indexes_of_missing_digest:
+            texts_to_score = [texts[indexes[0]] for indexes in indexes_of_missing_digest.values()]
+            start_time = time.perf_counter()
+            scored_polarities = calculate_polarities(texts_to_score)
+            self.scoring_time += time.perf_counter() - start_time
+            self.scored_texts += len(texts_to_score)
+            for (digest, indexes), polarity in zip(indexes_of_missing_digest.items(), scored_polarities):
+                for index in indexes:
+                    polarities[index] = polarity
+                self.__put(digest, polarity)
+        return polarities
+
+    def __put(self, digest: int, polarity: float):
+        self.polarity_of_digest[digest] = polarity
+        if len(self.polarity_of_digest) > self.max_entries:
+            self.polarity_of_digest.popitem(last=False)
+        self.has_unsaved_entries = True
+
+    def log_stats(self):
+        hit_rate = self.hits / self.lookups if self.lookups else 0.0
+        avg_scoring_time = self.scoring_time / self.scored_texts if self.scored_texts else 0.0
+        logging.info(f"[POLARITY CACHE]: hit rate {hit_rate:.1%} ({self.hits}/{self.lookups}), {len(self.polarity_of_digest)}/{self.max_entries} entries, ~{self.hits * avg_scoring_time:.2f}s of scoring saved")
+
+    def save(self):
+        """
+        Persists the entries in LRU order, if the cache has a file and there are new entries since the last save
+        """
+        if self.cache_file_path is None or not self.has_unsaved_entries:
+            return
+        writer = AtomicWriter(self.cache_file_path)
+        writer.write(json.dumps({"sentiment_engine": self.sentiment_engine, "entries": list(self.polarity_of_digest.items())}))
+        self.has_unsaved_entries = False
+
+    def __load(self):
+        if self.cache_file_path is None:
+            return
+        try:
+            with open(self.cache_file_path, 'r') as f:
+                cache_json = json.load(f)
+        except FileNotFoundError:
+            return
+        if cache_json["sentiment_engine"] != self.sentiment_engine:
+            logging.info(f"[POLARITY CACHE]: discarding the persisted cache of the {cache_json['sentiment_engine']} engine")
+            return
+        for digest, polarity in cache_json["entries"][-self.max_entries:]:
+            self.polarity_of_digest[digest] = polarity
+        logging.info(f"[POLARITY CACHE]: loaded {len(self.polarity_of_digest)} entries from {self.cache_file_path}")
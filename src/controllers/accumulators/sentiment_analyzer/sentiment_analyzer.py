@@ -1,16 +1,19 @@
-import json
-from shared.atomic_writer import AtomicWriter
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
-from shared.protocol_messages import SystemMessage, SystemMessageType
+import functools
+import os
+import signal
+from multiprocessing import Pool
+from shared.batch_schemas import BOOKS_AVG_POLARITY_SCHEMA, REVIEWS_TEXT_SCHEMA
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 from textblob import TextBlob
-import math
+from lexicon_engine import load_lexicon_engine
+from polarity_cache import PolarityCache
 from shared.monitorable_process import MonitorableProcess
+from shared.state_store import SnapshotStateStore
 
 
 from typing import TypeAlias
 
-from shared.monitorable_process import ClientID_t
 BookTitle_t: TypeAlias = str
 AccumulatedPolarity_t: TypeAlias = float
 TotalReviews_t: TypeAlias = int
@@ -23,6 +26,51 @@ TOTAL_REVIEWS_IDX = 1
 TITLE_IDX = 0
 TEXT_IDX = 1
 
+# Before the books were kept in the state, they were saved apart in this file
+LEGACY_BOOKS_STATE_FILE_PATH = "books_state.json"
+
+# Each worker gets about this amount of chunks per batch, so that a chunk with long texts does not leave the rest of the workers idle
+CHUNKS_PER_WORKER = 4
+
+# 'textblob' scores each text with TextBlob, 'lexicon' scores whole batches with the lexicon engine, with the same polarities up to the tolerance documented in lexicon_engine
+SENTIMENT_ENGINE_TEXTBLOB = "textblob"
+SENTIMENT_ENGINE_LEXICON = "lexicon"
+SENTIMENT_ENGINES = (SENTIMENT_ENGINE_TEXTBLOB, SENTIMENT_ENGINE_LEXICON)
+
+
+def init_sentiment_worker(sentiment_engine: str):
+    # Workers inherit the shutdown handler of the controller, but they must just die when the pool is terminated
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if sentiment_engine == SENTIMENT_ENGINE_LEXICON:
+        load_lexicon_engine()
+
+
+def polarities_of_texts(texts: list[str], sentiment_engine: str = SENTIMENT_ENGINE_TEXTBLOB) -> list[float]:
+    if sentiment_engine == SENTIMENT_ENGINE_LEXICON:
+        return load_lexicon_engine().polarities_of_texts(texts)
+    return [TextBlob(text).sentiment.polarity for text in texts]
+
+
+def split_in_chunks_by_length(texts: list[str], max_chunks: int) -> list[list[str]]:
+    """
+    Splits the texts, keeping their order, in at most about max_chunks chunks with about the same amount of characters
+    """
+    target_chunk_length = sum(len(text) for text in texts) / max_chunks
+    chunks = []
+    current_chunk = []
+    current_chunk_length = 0
+    for text in texts:
+        current_chunk.append(text)
+        current_chunk_length += len(text)
+        if current_chunk_length >= target_chunk_length:
+            chunks.append(current_chunk)
+            current_chunk = []
+            current_chunk_length = 0
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
 class SentimentAnalyzer(MonitorableProcess):
     def __init__(self, 
                  input_exchange_name: str, 
@@ -30,15 +78,34 @@ class SentimentAnalyzer(MonitorableProcess):
                  input_queue_name: str, 
                  output_queue_name: str,
                  batch_size: int,
-                 controller_name: str):
+                 controller_name: str,
+                 sentiment_workers: int = 1,
+                 sentiment_engine: str = SENTIMENT_ENGINE_TEXTBLOB,
+                 polarity_cache_size_mb: int = 0,
+                 polarity_cache_persistence: bool = False):
         super().__init__(controller_name)
+        self.__migrate_legacy_books_state_file()
+        if sentiment_engine not in SENTIMENT_ENGINES:
+            raise ValueError(f"Unknown sentiment engine: {sentiment_engine}. Available engines: {SENTIMENT_ENGINES}")
         self.output_queue = output_queue_name
         self.batch_size = batch_size
-        
-        self.books_state_file_path = "books_state.json"
-        self.books_state: dict[ClientID_t, dict[BookTitle_t, BookData_t]] = self.__load_books_state_file()
-
-        self.mq_connection_handler = MQConnectionHandler(
+        self.sentiment_workers = sentiment_workers
+        self.sentiment_engine = sentiment_engine
+        self.polarities_of_texts = functools.partial(polarities_of_texts, sentiment_engine=sentiment_engine)
+        self.sentiment_pool = None
+        if sentiment_workers > 1:
+            # The pool is created before the connections are opened so that the workers do not inherit them
+            self.sentiment_pool = Pool(sentiment_workers, initializer=init_sentiment_worker, initargs=(sentiment_engine,))
+            self.joinable_processes.append(self.sentiment_pool)
+        elif sentiment_engine == SENTIMENT_ENGINE_LEXICON:
+            load_lexicon_engine()
+        logging.info(f"[SENTIMENT ENGINE]: {sentiment_engine} with {sentiment_workers} workers")
+        self.polarity_cache = None
+        if polarity_cache_size_mb > 0:
+            cache_file_path = f"{controller_name}_polarity_cache.json" if polarity_cache_persistence else None
+            self.polarity_cache = PolarityCache(polarity_cache_size_mb * 1024 * 1024, sentiment_engine, cache_file_path)
+
+        self.mq_connection_handler = self.create_mq_connection_handler(
             output_exchange_name=output_exchange_name, 
             output_queues_to_bind={output_queue_name: [output_queue_name]}, 
             input_exchange_name=input_exchange_name, 
@@ -58,83 +125,92 @@ class SentimentAnalyzer(MonitorableProcess):
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            reviews = body.get_batch_iter_from_payload()
-            for review in reviews:
-                title = review[TITLE_IDX]
-                text = review[TEXT_IDX]
-                polarity = TextBlob(text).sentiment.polarity
+            reviews = body.get_batch_from_payload(REVIEWS_TEXT_SCHEMA)
+            titles = reviews.columns[TITLE_IDX]
+            if self.polarity_cache is None:
+                polarities = self.__calculate_polarities(reviews.columns[TEXT_IDX])
+            else:
+                polarities = self.polarity_cache.polarities_of_texts(reviews.columns[TEXT_IDX], self.__calculate_polarities)
+            for title, polarity in zip(titles, polarities):
                 self.__add_polarity_for_book(body.client_id, title, polarity)
-            self.__save_books_state_file()
             
         
     def __handle_eof_reviews(self, client_id):
-        remaining_amount_of_books = len(self.books_state.get(client_id, {}))
+        books_data_of_client: dict[BookTitle_t, BookData_t] = self.state[client_id].get("books", {})
+        remaining_amount_of_books = len(books_data_of_client)
+        books_iter = iter(books_data_of_client.items())
         payload_current_size = 0
-        payload_to_send = ""
+        batch_to_send = ColumnarBatch(BOOKS_AVG_POLARITY_SCHEMA)
         while (remaining_amount_of_books > 0) and (payload_current_size < self.batch_size):
-            title, avg_polarity = self.__pop_average_polarity_of_book(client_id)
-            payload_to_send += f"{title},{avg_polarity}" + "\n"
+            title, avg_polarity = self.__average_polarity_of_book(*next(books_iter))
+            batch_to_send.append_row(title, avg_polarity)
             payload_current_size += 1
             remaining_amount_of_books -= 1
             if payload_current_size == self.batch_size or remaining_amount_of_books == 0:
                 seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
-                self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, payload_to_send).encode_to_str())
+                self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, batch_to_send.encode()))
                 self.update_self_seq_number(client_id, seq_num_to_send)
-                payload_to_send = ""
+                batch_to_send = ColumnarBatch(BOOKS_AVG_POLARITY_SCHEMA)
                 payload_current_size = 0
 
         seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
-        self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, client_id, self.controller_name, seq_num_to_send).encode_to_str())
+        self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, client_id, self.controller_name, seq_num_to_send))
         self.update_self_seq_number(client_id, seq_num_to_send)
         logging.info("Sent EOF_R message to output queue")
-        self.books_state[client_id] = {}
-        self.__save_books_state_file()
+        self.set_state_value(client_id, ["books"], {})
+        if self.polarity_cache is not None:
+            self.polarity_cache.log_stats()
+            self.polarity_cache.save()
 
     # ==============================================================================================================
 
+
+    def __calculate_polarities(self, texts: list[str]) -> list[float]:
+        """
+        Returns the polarity of each text, in the same order as the texts.
+        When there is a pool of workers, the texts are split in chunks of about the same amount of characters, as the time to score a text grows with its length, and the chunks are scored in parallel.
+        """
+        if self.sentiment_pool is None or len(texts) < 2:
+            return self.polarities_of_texts(texts)
+
+        chunks = split_in_chunks_by_length(texts, self.sentiment_workers * CHUNKS_PER_WORKER)
+        polarities = []
+        for chunk_polarities in self.sentiment_pool.map(self.polarities_of_texts, chunks):
+            polarities.extend(chunk_polarities)
+        return polarities
+
         
     def __add_polarity_for_book(self, client_id: int, title: str, polarity: float):
-        if client_id in self.books_state:
-            if title in self.books_state[client_id]:
-                self.books_state[client_id][title][POLARITY_IDX] = math.fsum(
-                    [self.books_state[client_id][title][POLARITY_IDX], polarity]
-                )
-                self.books_state[client_id][title][TOTAL_REVIEWS_IDX] += 1
-            else:
-                self.books_state[client_id][title] = [polarity, 1]
+        if title in self.state[client_id].get("books", {}):
+            self.increment_state_value(client_id, ["books", title, POLARITY_IDX], polarity)
+            self.increment_state_value(client_id, ["books", title, TOTAL_REVIEWS_IDX])
         else:
-            self.books_state[client_id] = {title: [polarity, 1]}
-
+            self.set_state_value(client_id, ["books", title], [polarity, 1])
 
 
-    def __pop_average_polarity_of_book(self, client_id) -> tuple[str, float]:
+    def __average_polarity_of_book(self, title: str, acc_values: BookData_t) -> tuple[str, float]:
         """
-        Returns the mean of the polarity of a single book and removes it from the accumulator
+        Returns the mean of the polarity of a single book
         """
-        title, acc_values = self.books_state[client_id].popitem()
-
         polarity = acc_values[POLARITY_IDX]
         total_reviews = acc_values[TOTAL_REVIEWS_IDX]
         avg_polarity = polarity / total_reviews
         return title, avg_polarity
-    
-    
-    # ==============================================================================================================
 
 
-    def __save_books_state_file(self):
-        writer = AtomicWriter(self.books_state_file_path)
-        writer.write(json.dumps(self.books_state))
-    
-
-    def __load_books_state_file(self) -> dict:
-        try:
-            with open(self.books_state_file_path, 'r') as f:
-                state_json = json.load(f)
-                return {int(k): v for k, v in state_json.items()}
-        except FileNotFoundError:
-            return {}
-        
\ No newline at end of file
+    def __migrate_legacy_books_state_file(self):
+        """
+        Moves the books of the legacy books file into the state of their clients. The file is deleted once the state with them is committed, so a restart in between migrates them again.
+        """
+        if not os.path.exists(LEGACY_BOOKS_STATE_FILE_PATH):
+            return
+        legacy_books_state = SnapshotStateStore(LEGACY_BOOKS_STATE_FILE_PATH).load()
+        for client_id, books in legacy_books_state.items():
+            if books and "books" not in self.state.get(client_id, {}):
+                self.set_state_value(client_id, ["books"], books)
+        self.save_state_file()
+        os.remove(LEGACY_BOOKS_STATE_FILE_PATH)
+        logging.info(f"[STATE MIGRATED]: the books of {len(legacy_books_state)} clients were moved from {LEGACY_BOOKS_STATE_FILE_PATH} to the state")
@@ -1,8 +1,8 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 from shared import constants
+from shared.batch_schemas import AUTHOR_DECADES_COUNT_SCHEMA
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 
 
 AUTHOR_IDX = 0
@@ -25,37 +25,36 @@ class FilterOfAuthorsByDecadesCount(MonitorableProcess):
         self.mq_connection_handler = None
         
     def start(self):
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange_name, 
-                                                         output_queues_to_bind={self.output_queue_name: [self.output_queue_name]}, 
-                                                         input_exchange_name=self.input_exchange_name, 
-                                                         input_queues_to_recv_from=[self.input_queue_name])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange_name, 
+                                                                        output_queues_to_bind={self.output_queue_name: [self.output_queue_name]}, 
+                                                                        input_exchange_name=self.input_exchange_name, 
+                                                                        input_queues_to_recv_from=[self.input_queue_name])
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue_name, self.state_handler_callback, self.__filter_authors_by_decades_quantity)
         self.mq_connection_handler.channel.start_consuming()
         
             
     def __filter_authors_by_decades_quantity(self, body: SystemMessage):
-        logging.debug(f"Received message: {body.payload}")
         if body.type == SystemMessageType.EOF_B:
             logging.info("EOF received. Sending EOF message to output queue")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send))
             self.update_self_seq_number(body.client_id, seq_num_to_send)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            payload_to_send = ""
-            batch_of_author_decades = body.get_batch_iter_from_payload()
-            for author_decades in batch_of_author_decades:
+            batch_to_send = ColumnarBatch(AUTHOR_DECADES_COUNT_SCHEMA)
+            batch_of_author_decades = body.get_batch_from_payload(AUTHOR_DECADES_COUNT_SCHEMA)
+            for author_decades in batch_of_author_decades.rows():
                 author = author_decades[AUTHOR_IDX]
                 decades = author_decades[DECADE_IDX]
-                if int(decades) >= self.min_decades_to_filter:
-                    payload_to_send += f"{author},{decades}\n"
-            if payload_to_send:
+                if decades >= self.min_decades_to_filter:
+                    batch_to_send.append_row(author, decades)
+            if batch_to_send:
                 seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-                self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, payload_to_send).encode_to_str())
+                self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, batch_to_send.encode()))
                 self.update_self_seq_number(body.client_id, seq_num_to_send)
 
         
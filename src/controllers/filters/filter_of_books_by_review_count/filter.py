@@ -1,15 +1,15 @@
-from shared.mq_connection_handler import MQConnectionHandler
 from shared import constants
 import logging
 import csv
 import io
+from shared.batch_schemas import BOOKS_REVIEWS_COUNT_SCHEMA, BOOKS_REVIEWS_SCHEMA, BOOKS_SCORES_SCHEMA
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 
 
 TITLE_IDX = 0
 AUTHORS_IDX = 1
-SCORES_LIST_IDX = 2
+SCORE_SUM_IDX = 2
 DECADE_IDX = 3
 REVIEW_COUNT_IDX = 4
 
@@ -19,7 +19,7 @@ class FilterByReviewsCount(MonitorableProcess):
                  output_exchange: str, 
                  input_queue: str, 
                  output_queue_towards_query3: str,
-                 output_queue_towards_sorter: str, 
+                 output_queues_towards_sorters: list[str], 
                  min_reviews: int, 
                  num_of_counters: int,
                  controller_name: str):
@@ -28,13 +28,15 @@ class FilterByReviewsCount(MonitorableProcess):
         self.output_exchange = output_exchange
         self.input_queue = input_queue
         self.output_queue_towards_query3 = output_queue_towards_query3
-        self.output_queue_towards_sorter = output_queue_towards_sorter
+        self.output_queues_towards_sorters = output_queues_towards_sorters
         self.num_of_counters = int(num_of_counters)
         self.min_reviews = int(min_reviews)
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange, 
-                                                         output_queues_to_bind={self.output_queue_towards_query3: [self.output_queue_towards_query3], self.output_queue_towards_sorter: [output_queue_towards_sorter]},
-                                                         input_exchange_name=self.input_exchange,
-                                                         input_queues_to_recv_from=[self.input_queue])        
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange, 
+                                                                        output_queues_to_bind={self.output_queue_towards_query3: [self.output_queue_towards_query3], **{queue_name: [queue_name] for queue_name in self.output_queues_towards_sorters}},
+                                                                        input_exchange_name=self.input_exchange,
+                                                                        input_queues_to_recv_from=[self.input_queue])        
+        # Each book goes to a single sorter shard, so the local tops of the shards are disjoint
+        self.partitioner = self.create_partitioner(self.output_queues_towards_sorters)
         
     def start(self):
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue, self.state_handler_callback, self.__filter_books)
@@ -42,40 +44,41 @@ class FilterByReviewsCount(MonitorableProcess):
         
     def __filter_books(self, body: SystemMessage):
         """ 
-        The body is a csv line with the following format in the line: "title,review_score,decade,reviews_count" 
+        The body is a batch with the following columns: "title,authors,score_sum,decade,reviews_count" 
         The filter should filter out books with reviews_count less than min_reviews and send the result to the outputsqueue.
         """
-        logging.debug(f"Received message from input queue: {body.payload}")
         if body.type == SystemMessageType.EOF_R:
-            client_eofs_received = self.state.get(body.client_id, {}).get("eofs_received", 0) + 1
-            self.state[body.client_id].update({"eofs_received": client_eofs_received})
+            client_eofs_received = self.increment_state_value(body.client_id, ["eofs_received"])
             if client_eofs_received == self.num_of_counters:
                 next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
                 logging.info(f"Received EOF from all counters (for [ client_{body.client_id} ]). Sending EOF to output queues.")
-                self.mq_connection_handler.send_message(self.output_queue_towards_query3, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num).encode_to_str())
-                self.mq_connection_handler.send_message(self.output_queue_towards_sorter, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num).encode_to_str())
+                self.mq_connection_handler.send_message(self.output_queue_towards_query3, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num))
+                for queue_name in self.output_queues_towards_sorters:
+                    self.mq_connection_handler.send_message(queue_name, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num))
                 self.update_self_seq_number(body.client_id, next_seq_num)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_towards_query3, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.mq_connection_handler.send_message(self.output_queue_towards_sorter, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue_towards_query3, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            for queue_name in self.output_queues_towards_sorters:
+                self.mq_connection_handler.send_message(queue_name, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            books = body.get_batch_iter_from_payload()
-            payload_to_send_towards_query3 = ""
-            payload_to_send_towards_sorter = ""
-            for book in books:
-                reviews_count = int(book[REVIEW_COUNT_IDX])
+            books = body.get_batch_from_payload(BOOKS_REVIEWS_SCHEMA)
+            batch_to_send_towards_query3 = ColumnarBatch(BOOKS_REVIEWS_COUNT_SCHEMA)
+            batch_per_sorter = {queue_name: ColumnarBatch(BOOKS_SCORES_SCHEMA) for queue_name in self.output_queues_towards_sorters}
+            for book in books.rows():
+                reviews_count = book[REVIEW_COUNT_IDX]
                 if reviews_count >= self.min_reviews:
-                    payload_to_send_towards_query3 += f"{book[TITLE_IDX]},{reviews_count},\"{book[AUTHORS_IDX]}\"\n"
-                    payload_to_send_towards_sorter += f"{book[TITLE_IDX]},\"{book[SCORES_LIST_IDX]}\"\n"
+                    batch_to_send_towards_query3.append_row(book[TITLE_IDX], reviews_count, book[AUTHORS_IDX])
+                    batch_per_sorter[self.partitioner.select_queue(book[TITLE_IDX])].append_row(book[TITLE_IDX], book[SCORE_SUM_IDX], reviews_count)
 
-            if payload_to_send_towards_query3 and payload_to_send_towards_sorter:
+            if batch_to_send_towards_query3:
                 next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
 
-                self.mq_connection_handler.send_message(self.output_queue_towards_query3, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, payload_to_send_towards_query3).encode_to_str())
-                self.update_self_seq_number(body.client_id, next_seq_num)
-                self.mq_connection_handler.send_message(self.output_queue_towards_sorter, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, payload_to_send_towards_sorter).encode_to_str())
+                self.mq_connection_handler.send_message(self.output_queue_towards_query3, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, batch_to_send_towards_query3.encode()))
+                for queue_name, batch in batch_per_sorter.items():
+                    if batch:
+                        self.mq_connection_handler.send_message(queue_name, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, batch.encode()))
 
                 self.update_self_seq_number(body.client_id, next_seq_num)
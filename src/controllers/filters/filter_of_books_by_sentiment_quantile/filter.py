@@ -1,13 +1,26 @@
-from shared.mq_connection_handler import MQConnectionHandler
+import glob
 import logging
+import os
+import re
+import struct
 from shared import constants
 import numpy as np
+from shared.batch_schemas import BOOKS_AVG_POLARITY_SCHEMA
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
+from shared.quantile_sketch import QuantileSketch
 
 TITLE_IDX = 0
 AVG_POLARITY_IDX = 1
 
+QUANTILE_MODE_EXACT = "exact"
+QUANTILE_MODE_SKETCH = "sketch"
+QUANTILE_MODES = [QUANTILE_MODE_EXACT, QUANTILE_MODE_SKETCH]
+
+# The books of each client are spilled to a file as the batches are received, each one framed by its length.
+# The state only keeps the amount of spilled bytes, so the batches spilled after the last commit are dropped before spilling again, as they will be redelivered.
+SPILL_FRAME_HEADER = struct.Struct("<I")
+
 class FilterBySentimentQuantile(MonitorableProcess):
     def __init__(self, 
                  input_exchange_name: str, 
@@ -17,13 +30,30 @@ class FilterBySentimentQuantile(MonitorableProcess):
                  quantile: float,
                  batch_size: int,
                  num_of_sentiment_analyzers: int,
-                 controller_name: str):
+                 controller_name: str,
+                 quantile_mode: str = QUANTILE_MODE_EXACT,
+                 sketch_rank_error: float = 0.01):
+        """
+        The books of each client are spilled to disk as they arrive and filtered in a second pass once the polarity at the quantile is known, so receiving a book is O(1) and the state of a client does not grow with its books.
+
+        ## Important parameter details:
+        - quantile_mode: "exact" computes the polarity at the quantile over all the spilled books. "sketch" estimates it with a quantile sketch kept in the state of the client, so the required quantile of the emitted books is only within sketch_rank_error of the requested one.
+        """
         super().__init__(controller_name)
+        if quantile_mode not in QUANTILE_MODES:
+            raise ValueError(f"Unknown quantile mode: {quantile_mode}. Expected one of: {QUANTILE_MODES}")
         self.batch_size = batch_size
         self.quantile = quantile
         self.num_of_sentiment_analyzers = num_of_sentiment_analyzers
+        self.quantile_mode = quantile_mode
+        self.sketch_rank_error = sketch_rank_error
         self.output_queue = output_queue_name
-        self.mq_connection_handler = MQConnectionHandler(
+        # Clients whose spill file was already truncated to the committed amount of bytes in this run
+        self.clients_with_consistent_spill: set[int] = set()
+        # Spill files of the clients that were fully emitted, which are removed once their state is committed
+        self.spill_files_to_remove: list[str] = []
+        self.__remove_stale_spill_files()
+        self.mq_connection_handler = self.create_mq_connection_handler(
             output_exchange_name=output_exchange_name, 
             output_queues_to_bind={output_queue_name: [output_queue_name]}, 
             input_exchange_name=input_exchange_name, 
@@ -34,85 +64,127 @@ class FilterBySentimentQuantile(MonitorableProcess):
             
     def __filter_by_quantile(self, body: SystemMessage):
         if body.type == SystemMessageType.EOF_R:
-            client_eofs_received = self.state.get(body.client_id, {}).get("eofs_received", 0) + 1
-            self.state[body.client_id].update({"eofs_received": client_eofs_received})
+            client_eofs_received = self.increment_state_value(body.client_id, ["eofs_received"])
             if int(client_eofs_received) == int(self.num_of_sentiment_analyzers):
                 logging.info(f"Received all EOFs from [ client_{body.client_id} ].")
                 self.__handle_final_eof(body.client_id)
-                self.state[body.client_id].update({"eofs_received": 0})
+                self.set_state_value(body.client_id, ["eofs_received"], 0)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
+            self.__discard_spill(body.client_id)
         else:
-            batch_of_books_with_avg_polarity = body.get_batch_iter_from_payload()
-            for book in batch_of_books_with_avg_polarity:
-                title = book[TITLE_IDX]
-                avg_polarity = float(book[AVG_POLARITY_IDX])
-                self.__insert_in_sorted_books(body.client_id, title, avg_polarity)
+            batch_of_books_with_avg_polarity = body.get_batch_from_payload(BOOKS_AVG_POLARITY_SCHEMA)
+            if not batch_of_books_with_avg_polarity:
+                return
+            self.__spill_batch(body.client_id, body.payload_view)
+            if self.quantile_mode == QUANTILE_MODE_SKETCH:
+                self.__update_polarity_sketch(body.client_id, batch_of_books_with_avg_polarity.columns[AVG_POLARITY_IDX])
             
         
     def __handle_final_eof(self, client_id):
-        polarity_at_quantile = self.__get_polarity_at_required_quantile(client_id)
+        spilled_batches = self.__read_spilled_batches(client_id)
+        polarity_at_quantile = self.__get_polarity_at_required_quantile(client_id, spilled_batches)
 
         if polarity_at_quantile is not None:
             logging.info(f"([ client_{client_id} ]); [ {polarity_at_quantile} ] is the value of avg polarity for the required [ {self.quantile} ] quantile")
-        
-        sorted_books_by_polarity: list[tuple[str, float]] = self.state[client_id].get("sorted_books_by_polarity", [])
-        remaining_amount_of_books = len(sorted_books_by_polarity)
-        payload_current_size = 0
-        payload_to_send = ""
-        while (remaining_amount_of_books > 0) and (payload_current_size < self.batch_size):
-            book = sorted_books_by_polarity.pop(0)
-            if book[AVG_POLARITY_IDX] >= polarity_at_quantile:
-                payload_to_send += f"{book[TITLE_IDX]},{book[AVG_POLARITY_IDX]}" + "\n"
-                payload_current_size += 1
-                remaining_amount_of_books -= 1
-                if payload_current_size == self.batch_size or remaining_amount_of_books == 0:
-                    seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
-                    self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, payload_to_send).encode_to_str())
-                    self.update_self_seq_number(client_id, seq_num_to_send)
-                    payload_to_send = ""
-                    payload_current_size = 0
-            else:
-                # From this point onwards all books are not suitable as the books are sorted.
-                if payload_to_send:
-                    seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
-                    self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, payload_to_send).encode_to_str())
-                    self.update_self_seq_number(client_id, seq_num_to_send)
-                break
+            # Second pass over the spilled books. The selected books are sent from the highest polarity down, with the books of the same polarity in arrival order.
+            selected_books = [book for batch in spilled_batches for book in batch.rows() if book[AVG_POLARITY_IDX] >= polarity_at_quantile]
+            selected_books.sort(key=lambda book: book[AVG_POLARITY_IDX], reverse=True)
+            for start in range(0, len(selected_books), self.batch_size):
+                batch_to_send = ColumnarBatch(BOOKS_AVG_POLARITY_SCHEMA)
+                for title, avg_polarity in selected_books[start:start + self.batch_size]:
+                    batch_to_send.append_row(title, avg_polarity)
+                seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
+                self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, batch_to_send.encode()))
+                self.update_self_seq_number(client_id, seq_num_to_send)
        
         seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
-        self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, client_id, self.controller_name, seq_num_to_send).encode_to_str())
+        self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, client_id, self.controller_name, seq_num_to_send))
         self.update_self_seq_number(client_id, seq_num_to_send)
-        self.state[client_id].update({"sorted_books_by_polarity": []})
+        self.remove_state_value(client_id, ["spilled_bytes"])
+        self.remove_state_value(client_id, ["polarity_sketch"])
+        self.__discard_spill(client_id)
 
         
         
     # ==============================================================================================================
 
 
-    def __insert_in_sorted_books(self, client_id, title, avg_polarity):
-        sorted_books_by_polarity: list[tuple[str, float]] = self.state[client_id].get("sorted_books_by_polarity", [])
-        if len(sorted_books_by_polarity) == 0:
-            sorted_books_by_polarity.append((title, avg_polarity))
+    def __spill_file_path(self, client_id: int) -> str:
+        return f"{self.controller_name}_client_{client_id}_spilled_books.bin"
+
+    def __spill_batch(self, client_id: int, raw_batch: memoryview):
+        spill_file_path = self.__spill_file_path(client_id)
+        spilled_bytes = self.state[client_id].get("spilled_bytes", 0)
+        with open(spill_file_path, 'ab') as f:
+            if client_id not in self.clients_with_consistent_spill:
+                f.truncate(spilled_bytes)
+                self.clients_with_consistent_spill.add(client_id)
+            f.write(SPILL_FRAME_HEADER.pack(len(raw_batch)))
+            f.write(raw_batch)
+        self.increment_state_value(client_id, ["spilled_bytes"], SPILL_FRAME_HEADER.size + len(raw_batch))
+
+    def __read_spilled_batches(self, client_id: int) -> list[ColumnarBatch]:
+        spilled_bytes = self.state[client_id].get("spilled_bytes", 0)
+        if spilled_bytes == 0:
+            return []
+        with open(self.__spill_file_path(client_id), 'rb') as f:
+            raw_spill = memoryview(f.read(spilled_bytes))
+        batches = []
+        offset = 0
+        while offset < spilled_bytes:
+            (batch_size_in_bytes,) = SPILL_FRAME_HEADER.unpack_from(raw_spill, offset)
+            offset += SPILL_FRAME_HEADER.size
+            batches.append(ColumnarBatch.decode(raw_spill[offset:offset + batch_size_in_bytes], BOOKS_AVG_POLARITY_SCHEMA))
+            offset += batch_size_in_bytes
+        return batches
+
+    def __discard_spill(self, client_id: int):
+        """
+        The spill file is kept until the state without it is committed, so a redelivered EOF can still be handled if the process crashes before
+        """
+        self.clients_with_consistent_spill.discard(client_id)
+        self.spill_files_to_remove.append(self.__spill_file_path(client_id))
+
+    def save_state_file(self):
+        super().save_state_file()
+        for spill_file_path in self.spill_files_to_remove:
+            try:
+                os.remove(spill_file_path)
+            except FileNotFoundError:
+                pass
+        self.spill_files_to_remove = []
+
+    def __remove_stale_spill_files(self):
+        """
+        Removes the spill files of the clients that have no spilled books in the committed state, which were left behind by a crash
+        """
+        spill_file_regex = re.compile(re.escape(self.controller_name) + r"_client_(\d+)_spilled_books\.bin")
+        for spill_file_path in glob.glob(f"{glob.escape(self.controller_name)}_client_*_spilled_books.bin"):
+            match = spill_file_regex.fullmatch(spill_file_path)
+            if match is not None and self.state.get(int(match.group(1)), {}).get("spilled_bytes", 0) == 0:
+                os.remove(spill_file_path)
+
+    def __update_polarity_sketch(self, client_id: int, avg_polarities: list[float]):
+        encoded_sketch = self.state[client_id].get("polarity_sketch")
+        if encoded_sketch is None:
+            sketch = QuantileSketch.with_rank_error(self.sketch_rank_error)
         else:
-            for idx, book in enumerate(sorted_books_by_polarity):
-                if avg_polarity > book[AVG_POLARITY_IDX]:
-                    sorted_books_by_polarity.insert(idx, (title, avg_polarity))
-                    break
-            else:
-                sorted_books_by_polarity.append((title, avg_polarity))
-        self.state[client_id].update({"sorted_books_by_polarity": sorted_books_by_polarity})
-
-    
-    def __get_polarity_at_required_quantile(self, client_id):
-        sorted_books_by_polarity: list[tuple[str, float]] = self.state[client_id].get("sorted_books_by_polarity", [])
-        if len(sorted_books_by_polarity) == 0:
-            return None
+            sketch = QuantileSketch.decode(encoded_sketch)
+        sketch.update_all(avg_polarities)
+        self.set_state_value(client_id, ["polarity_sketch"], sketch.encode())
+
+    def __get_polarity_at_required_quantile(self, client_id, spilled_batches: list[ColumnarBatch]):
+        if self.quantile_mode == QUANTILE_MODE_SKETCH:
+            encoded_sketch = self.state[client_id].get("polarity_sketch")
+            return QuantileSketch.decode(encoded_sketch).quantile(self.quantile) if encoded_sketch is not None else None
 
-        avg_polarities = [book[AVG_POLARITY_IDX] for book in sorted_books_by_polarity]
+        avg_polarities = [avg_polarity for batch in spilled_batches for avg_polarity in batch.columns[AVG_POLARITY_IDX]]
+        if len(avg_polarities) == 0:
+            return None
         polarity_at_quantile = np.quantile(avg_polarities, self.quantile)
         return polarity_at_quantile
 
@@ -1,10 +1,11 @@
-from shared.initializers import init_configs, init_log
+from shared.initializers import init_configs, init_log, init_optional_configs
 from filter import FilterBySentimentQuantile
 import logging
 
 def main():
     config_params = init_configs(["LOGGING_LEVEL", "INPUT_EXCHANGE", "OUTPUT_EXCHANGE", "INPUT_QUEUE_OF_BOOKS", "OUTPUT_QUEUE_OF_BOOKS", "QUANTILE", "BATCH_SIZE", "CONTROLLER_NAME", "NUM_OF_SENTIMENT_ANALYZERS"])
     init_log(config_params["LOGGING_LEVEL"])
+    optional_config_params = init_optional_configs({"QUANTILE_MODE": "exact", "QUANTILE_SKETCH_RANK_ERROR": "0.01"})
     filter = FilterBySentimentQuantile(config_params["INPUT_EXCHANGE"], 
                                        config_params["OUTPUT_EXCHANGE"], 
                                        config_params["INPUT_QUEUE_OF_BOOKS"], 
@@ -12,7 +13,9 @@ def main():
                                        float(config_params["QUANTILE"]),
                                        int(config_params["BATCH_SIZE"]),
                                        int(config_params["NUM_OF_SENTIMENT_ANALYZERS"]),
-                                       config_params["CONTROLLER_NAME"])
+                                       config_params["CONTROLLER_NAME"],
+                                       optional_config_params["QUANTILE_MODE"],
+                                       float(optional_config_params["QUANTILE_SKETCH_RANK_ERROR"]))
     filter.start()
     
 if __name__ == "__main__":
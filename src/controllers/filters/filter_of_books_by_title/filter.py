@@ -1,10 +1,12 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 from shared import constants
 import csv
 import io
+from shared.batch_schemas import FILTERED_BOOKS_SCHEMA
+from shared.fused_pipeline import FusedPipeline
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
+from typing import Optional
 
 
 TITLE_IDX = 0
@@ -20,11 +22,12 @@ class FilterByTitle(MonitorableProcess):
                  input_queue_name: str, 
                  output_queue_name: str, 
                  title_keyword: str,
-                 controller_name: str):
-        super().__init__(controller_name)
+                 controller_name: str,
+                 fused_pipeline: Optional[FusedPipeline] = None):
+        super().__init__(controller_name, fused_pipeline)
         self.output_queue = output_queue_name
         self.title_keyword = title_keyword
-        self.mq_connection_handler = MQConnectionHandler(
+        self.mq_connection_handler = self.create_mq_connection_handler(
             output_exchange_name=output_exchange_name, 
             output_queues_to_bind={output_queue_name: [output_queue_name]}, 
             input_exchange_name=input_exchange_name, 
@@ -36,26 +39,26 @@ class FilterByTitle(MonitorableProcess):
     def __filter_books_by_title(self, body: SystemMessage):
         if body.type == SystemMessageType.EOF_B:
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send))
             self.update_self_seq_number(body.client_id, seq_num_to_send)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}  
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            books = body.get_batch_iter_from_payload()
-            payload_to_send = ""
-            for book in books:
+            books = body.get_batch_from_payload(FILTERED_BOOKS_SCHEMA)
+            batch_to_send = ColumnarBatch(FILTERED_BOOKS_SCHEMA)
+            for book in books.rows():
                 title = book[TITLE_IDX]
                 authors = book[AUTHORS_IDX]
                 publisher = book[PUBLISHER_IDX]
                 year = book[YEAR_IDX]
                 if self.title_keyword.lower() in title.lower():
-                    payload_to_send += f"{title},\"{authors}\",{publisher},{year}" + "\n"
-            if payload_to_send:
+                    batch_to_send.append_row(title, authors, publisher, year)
+            if batch_to_send:
                 seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-                self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, payload_to_send).encode_to_str())
+                self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, batch_to_send.encode()))
                 self.update_self_seq_number(body.client_id, seq_num_to_send)
 
 
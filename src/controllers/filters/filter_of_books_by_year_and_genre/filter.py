@@ -1,10 +1,12 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 from shared import constants
 import csv
 import io
+from shared.batch_schemas import BOOKS_WITH_PUBLISHER_AND_YEAR_SCHEMA, FILTERED_BOOKS_SCHEMA
+from shared.fused_pipeline import FusedPipeline
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
+from typing import Optional
 
 
 TITLE_IDX = 0
@@ -23,13 +25,14 @@ class FilterByGenreAndYear(MonitorableProcess):
                  min_year_to_filter: int, 
                  max_year_to_filter: int,
                  genre_to_filter: str,
-                 controller_name: str):
-        super().__init__(controller_name)
+                 controller_name: str,
+                 fused_pipeline: Optional[FusedPipeline] = None):
+        super().__init__(controller_name, fused_pipeline)
         self.output_queue = output_queue_name
         self.min_year_to_filter = int(min_year_to_filter)
         self.max_year_to_filter = int(max_year_to_filter)
         self.genre_to_filter = genre_to_filter
-        self.mq_connection_handler = MQConnectionHandler(
+        self.mq_connection_handler = self.create_mq_connection_handler(
             output_exchange_name=output_exchange_name, 
             output_queues_to_bind={output_queue_name: [output_queue_name]}, 
             input_exchange_name=input_exchange_name, 
@@ -41,28 +44,28 @@ class FilterByGenreAndYear(MonitorableProcess):
     def __filter_books_by_year_and_genre(self, body: SystemMessage):
         if body.type == SystemMessageType.EOF_B:
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send))
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}       
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            books = body.get_batch_iter_from_payload()
-            payload_to_send = ""
-            for book in books:
+            books = body.get_batch_from_payload(BOOKS_WITH_PUBLISHER_AND_YEAR_SCHEMA)
+            batch_to_send = ColumnarBatch(FILTERED_BOOKS_SCHEMA)
+            for book in books.rows():
                 title = book[TITLE_IDX]
                 authors = book[AUTHORS_IDX]
                 publisher = book[PUBLISHER_IDX]
-                year_str = book[YEAR_IDX]
+                year = book[YEAR_IDX]
                 categories = book[CATEGORIES_IDX]
-                if int(year_str) >= self.min_year_to_filter and \
-                        int(year_str) <= self.max_year_to_filter and \
-                        self.genre_to_filter in categories:
-                    payload_to_send += f"{title},\"{authors}\",{publisher},{year_str}" + "\n"    
-            if payload_to_send:
+                if year >= self.min_year_to_filter and \
+                        year <= self.max_year_to_filter and \
+                        any(self.genre_to_filter in category for category in categories):
+                    batch_to_send.append_row(title, authors, publisher, year)
+            if batch_to_send:
                 seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-                self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, payload_to_send).encode_to_str())
+                self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, batch_to_send.encode()))
                 self.update_self_seq_number(body.client_id, seq_num_to_send)
 
        
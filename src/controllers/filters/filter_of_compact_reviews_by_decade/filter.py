@@ -1,10 +1,10 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 import io
 import csv
 from shared import constants
+from shared.batch_schemas import COMPACT_REVIEWS_SCHEMA
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 
 TITLE_IDX = 0
 AUTHORS_IDX = 1
@@ -29,10 +29,11 @@ class FilterOfCompactReviewsByDecade(MonitorableProcess):
         self.output_queues = {}
         for queue_name in output_queues.values():
             self.output_queues[queue_name] = [queue_name]
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange,
-                                                         output_queues_to_bind=self.output_queues,
-                                                         input_exchange_name=self.input_exchange,
-                                                         input_queues_to_recv_from=[self.input_queue_of_reviews])
+        self.partitioner = self.create_partitioner(list(self.output_queues.keys()))
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange,
+                                                                        output_queues_to_bind=self.output_queues,
+                                                                        input_exchange_name=self.input_exchange,
+                                                                        input_queues_to_recv_from=[self.input_queue_of_reviews])
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue_of_reviews, self.state_handler_callback, self.__filter_reviews)
         
         
@@ -41,51 +42,36 @@ class FilterOfCompactReviewsByDecade(MonitorableProcess):
             
     def __filter_reviews(self, body: SystemMessage):
         """
-        The message should have the following format: title,authors,score,decade
+        The batch should have the following columns: title,authors,score,decade
         """
         if body.type == SystemMessageType.EOF_R:
-            client_eofs_received = self.state.get(body.client_id, {}).get("eofs_received", 0) + 1
-            self.state[body.client_id].update({"eofs_received": client_eofs_received})
+            client_eofs_received = self.increment_state_value(body.client_id, ["eofs_received"])
             if client_eofs_received == self.num_of_input_workers:
                 next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
                 for queue_name in self.output_queues.keys():
-                    self.mq_connection_handler.send_message(queue_name, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num).encode_to_str())
+                    self.mq_connection_handler.send_message(queue_name, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num))
                 logging.info("Received all EOFs. Sending to all output queues.")
                 self.update_self_seq_number(body.client_id, next_seq_num)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             for output_queue in self.output_queues.keys():
                 seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-                self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+                self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            reviews = body.get_batch_iter_from_payload()
-            payload_per_controller = {queue_name: "" for queue_name in self.output_queues.keys()}
-            for row in reviews:
+            reviews = body.get_batch_from_payload(COMPACT_REVIEWS_SCHEMA)
+            batch_per_controller = {queue_name: ColumnarBatch(COMPACT_REVIEWS_SCHEMA) for queue_name in self.output_queues.keys()}
+            for row in reviews.rows():
                 title = row[TITLE_IDX]
-                authors = eval(row[AUTHORS_IDX])
+                authors = row[AUTHORS_IDX]
                 score = row[SCORE_IDX]
                 decade = row[DECADE_IDX]
-                if int(decade) == self.decade_to_filter:
-                    selected_queue_for_review = self.__select_queue(title)
-                    payload_of_selected_queue = payload_per_controller.get(selected_queue_for_review, "")
-                    updated_payload = payload_of_selected_queue + f"{title},\"{authors}\",{score},{decade}" + "\n"
-                    payload_per_controller[selected_queue_for_review] = updated_payload
+                if decade == self.decade_to_filter:
+                    selected_queue_for_review = self.partitioner.select_queue(title)
+                    batch_per_controller[selected_queue_for_review].append_row(title, authors, score, decade)
 
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            for output_queue, payload in payload_per_controller.items():
-                if payload:
-                    self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, payload).encode_to_str())
+            for output_queue, batch in batch_per_controller.items():
+                if batch:
+                    self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, batch.encode()))
             self.update_self_seq_number(body.client_id, next_seq_num)
-  
-            
-                
-    def __select_queue(self, title: str) -> str:
-        """
-        Should return the queue name where the review should be sent to.
-        It uses the hash of the title to select a queue on self.output_queues
-        """
-        
-        hash_value = hash(title)
-        queue_index = hash_value % len(self.output_queues)
-        return list(self.output_queues.keys())[queue_index]    
\ No newline at end of file
@@ -1,7 +1,7 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
+from shared.batch_schemas import FULL_REVIEWS_SCHEMA, REVIEWS_TEXT_SCHEMA
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 
 
 TITLE_IDX = 0
@@ -24,8 +24,9 @@ class FilterReviewByBookGenre(MonitorableProcess):
         self.output_queues = {}
         for queue_name in output_queues.values():
             self.output_queues[queue_name] = [queue_name]
+        self.partitioner = self.create_partitioner(list(self.output_queues.keys()))
 
-        self.mq_connection_handler = MQConnectionHandler(
+        self.mq_connection_handler = self.create_mq_connection_handler(
             output_exchange_name=output_exchange_name, 
             output_queues_to_bind=self.output_queues, 
             input_exchange_name=input_exchange_name, 
@@ -36,51 +37,36 @@ class FilterReviewByBookGenre(MonitorableProcess):
             
     def __filter_reviews_by_book_genre(self, body: SystemMessage):
         if body.type == SystemMessageType.EOF_R:
-            client_eofs_received = self.state.get(body.client_id, {}).get("eofs_received", 0) + 1
-            self.state[body.client_id].update({"eofs_received": client_eofs_received})
+            client_eofs_received = self.increment_state_value(body.client_id, ["eofs_received"])
             if client_eofs_received == self.num_of_input_workers:
                 next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
                 for queue_name in self.output_queues.keys():
-                    self.mq_connection_handler.send_message(queue_name, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num).encode_to_str())
+                    self.mq_connection_handler.send_message(queue_name, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num))
                 logging.info("Received all EOFs. Sending to all output queues.")
                 self.update_self_seq_number(body.client_id, next_seq_num)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
             for output_queue in self.output_queues.keys():
-                self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+                self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            reviews = body.get_batch_iter_from_payload()
-            payload_per_controller = {queue_name: "" for queue_name in self.output_queues.keys()}
-            for row in reviews:
+            reviews = body.get_batch_from_payload(FULL_REVIEWS_SCHEMA)
+            batch_per_controller = {queue_name: ColumnarBatch(REVIEWS_TEXT_SCHEMA) for queue_name in self.output_queues.keys()}
+            for row in reviews.rows():
                 title = row[TITLE_IDX]
                 categories = row[CATEGORIES_IDX]
                 text = row[TEXT_IDX]
-                if self.genre_to_filter in categories.lower():
-                    selected_queue_for_review = self.__select_queue(title)
-                    payload_of_selected_queue = payload_per_controller.get(selected_queue_for_review, "")
-                    updated_payload = payload_of_selected_queue + f"{title},{text}" + "\n"
-                    payload_per_controller[selected_queue_for_review] = updated_payload
+                if any(self.genre_to_filter in category.lower() for category in categories):
+                    selected_queue_for_review = self.partitioner.select_queue(title)
+                    batch_per_controller[selected_queue_for_review].append_row(title, text)
             
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            for output_queue, payload in payload_per_controller.items():
-                if payload:
-                    self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, payload).encode_to_str())
+            for output_queue, batch in batch_per_controller.items():
+                if batch:
+                    self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, batch.encode()))
             self.update_self_seq_number(body.client_id, next_seq_num)
 
-
-    
-    def __select_queue(self, title: str) -> str:
-        """
-        Should return the queue name where the review should be sent to.
-        It uses the hash of the title to select a queue on self.output_queues
-        """
-        
-        hash_value = hash(title)
-        queue_index = hash_value % len(self.output_queues)
-        return list(self.output_queues.keys())[queue_index]
-
        
     def start(self):
         self.mq_connection_handler.channel.start_consuming()
\ No newline at end of file
@@ -1,17 +1,20 @@
-from shared.initializers import init_configs, init_log
+from shared.initializers import init_configs, init_log, init_optional_configs
 import logging
 from sorter import Sorter
 
 def main():
     config_params = init_configs(["LOGGING_LEVEL", "INPUT_EXCHANGE", "OUTPUT_EXCHANGE", "INPUT_QUEUE_OF_BOOKS", "OUTPUT_QUEUE_OF_BOOKS", "TOP_OF_BOOKS", "CONTROLLER_NAME"])
     init_log(config_params["LOGGING_LEVEL"])
+    optional_config_params = init_optional_configs({"NUM_OF_INPUT_WORKERS": "1", "EMIT_LOCAL_TOP": "false"})
     sorter = Sorter(input_exchange=config_params["INPUT_EXCHANGE"],
                     output_exchange=config_params["OUTPUT_EXCHANGE"],
                     input_queue=config_params["INPUT_QUEUE_OF_BOOKS"],
                     output_queue=config_params["OUTPUT_QUEUE_OF_BOOKS"],
                     required_top_of_books=int(config_params["TOP_OF_BOOKS"]),
-                    controller_name=config_params["CONTROLLER_NAME"])
+                    controller_name=config_params["CONTROLLER_NAME"],
+                    num_of_input_workers=int(optional_config_params["NUM_OF_INPUT_WORKERS"]),
+                    emit_local_top=optional_config_params["EMIT_LOCAL_TOP"].lower() == "true")
     sorter.start()
-    
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
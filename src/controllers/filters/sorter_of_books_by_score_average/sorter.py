@@ -1,72 +1,104 @@
-from shared.mq_connection_handler import MQConnectionHandler
 from shared import constants
 import csv
+import heapq
 import io
 import logging
+from shared.batch_schemas import BOOKS_AVG_SCORE_SCHEMA, BOOKS_SCORES_SCHEMA
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 
 TITLE_IDX = 0
-SCORES_IDX = 1
+SCORE_SUM_IDX = 1
+REVIEWS_COUNT_IDX = 2
+
+# Each entry of the heap of best books is [avg_score, title, score_sum, reviews_count], so the heap is ordered by average score
+HEAP_AVG_SCORE_IDX = 0
+HEAP_TITLE_IDX = 1
+HEAP_SCORE_SUM_IDX = 2
+HEAP_REVIEWS_COUNT_IDX = 3
 
 class Sorter(MonitorableProcess):
-    def __init__(self, 
-                 input_exchange: str, 
-                 output_exchange: str, 
-                 input_queue: str, 
-                 output_queue: str, 
+    def __init__(self,
+                 input_exchange: str,
+                 output_exchange: str,
+                 input_queue: str,
+                 output_queue: str,
                  required_top_of_books: int,
-                 controller_name: str):
+                 controller_name: str,
+                 num_of_input_workers: int = 1,
+                 emit_local_top: bool = False):
+        """
+        Keeps the top of books by average score of each client in a bounded min heap, so each book costs O(log K) and the books that are not better than the worst of the top are discarded in O(1).
+
+        The sorter can be sharded: each shard gets a partition of the books and emits its local top with the score sum and reviews count of each book (emit_local_top),
+        and a single sorter that waits for the EOF of every shard (num_of_input_workers) merges the local tops into the global one, as the partitions of the books are disjoint.
+        """
         super().__init__(controller_name)
         self.input_exchange = input_exchange
         self.output_exchange = output_exchange
         self.input_queue = input_queue
         self.output_queue = output_queue
         self.required_top_of_books = required_top_of_books
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange, 
-                                                         output_queues_to_bind={self.output_queue: [self.output_queue]},
-                                                         input_exchange_name=self.input_exchange,
-                                                         input_queues_to_recv_from=[self.input_queue])
-        
+        self.num_of_input_workers = num_of_input_workers
+        self.emit_local_top = emit_local_top
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange,
+                                                                        output_queues_to_bind={self.output_queue: [self.output_queue]},
+                                                                        input_exchange_name=self.input_exchange,
+                                                                        input_queues_to_recv_from=[self.input_queue])
+
     def start(self):
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue, self.state_handler_callback, self.__sort_books)
         self.mq_connection_handler.start_consuming()
-        
+
     def __sort_books(self, body: SystemMessage):
         """
-        The body is a csv line with the following format in the line: "title,[scores]"
+        The body is a batch with the following columns: "title,score_sum,reviews_count"
         """
         if body.type == SystemMessageType.EOF_R:
-            logging.info(f"Received EOF_R from [ client_{body.client_id} ]")
-            next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            best_books = self.state[body.client_id].get("best_books", [])
-            if len(best_books) != 0:
-                self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, f"\"{best_books}\"").encode_to_str())
-                self.update_self_seq_number(body.client_id, next_seq_num)
-                next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num).encode_to_str())
-            self.state[body.client_id]["best_books"] = []
+            client_eofs_received = self.increment_state_value(body.client_id, ["eofs_received"])
+            if client_eofs_received == self.num_of_input_workers:
+                logging.info(f"Received all EOF_R from [ client_{body.client_id} ]")
+                self.__send_best_books(body.client_id)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
-            books = body.get_batch_iter_from_payload()
-            for book in books:
-                scores = eval(book[SCORES_IDX])
-                scores = list(map(int, scores))
-                avg_score = sum(scores) / len(scores)
-                if len(self.state[body.client_id].get("best_books",[])) < self.required_top_of_books:
-                    best_books = self.state[body.client_id].get("best_books", [])
-                    best_books.append((book[TITLE_IDX], avg_score))
-                    best_books.sort(key=lambda x: x[SCORES_IDX], reverse=True)
-                    self.state[body.client_id].update({"best_books": best_books})
+            books = body.get_batch_from_payload(BOOKS_SCORES_SCHEMA)
+            best_books = self.state[body.client_id].get("best_books", [])
+            updated_best_books = None
+            for book in books.rows():
+                avg_score = book[SCORE_SUM_IDX] / book[REVIEWS_COUNT_IDX]
+                if len(best_books) >= self.required_top_of_books and avg_score <= best_books[0][HEAP_AVG_SCORE_IDX]:
+                    continue
+                if updated_best_books is None:
+                    # The heap of the state is only copied once per batch, and persisted once if any book got into the top
+                    updated_best_books = list(best_books)
+                    best_books = updated_best_books
+                heap_entry = [avg_score, book[TITLE_IDX], book[SCORE_SUM_IDX], book[REVIEWS_COUNT_IDX]]
+                if len(best_books) < self.required_top_of_books:
+                    heapq.heappush(best_books, heap_entry)
                 else:
-                    if avg_score > self.state[body.client_id].get("best_books",[])[-1][SCORES_IDX]:
-                        best_books = self.state[body.client_id].get("best_books", [])
-                        best_books.append((book[TITLE_IDX], avg_score))
-                        best_books.sort(key=lambda x: x[SCORES_IDX], reverse=True)
-                        best_books.pop()
-                        self.state[body.client_id].update({"best_books": best_books})
+                    heapq.heapreplace(best_books, heap_entry)
+            if updated_best_books is not None:
+                self.set_state_value(body.client_id, ["best_books"], updated_best_books)
 
+    def __send_best_books(self, client_id: int):
+        next_seq_num = self.get_seq_num_to_send(client_id, self.controller_name)
+        best_books = sorted(self.state[client_id].get("best_books", []), reverse=True)
+        if len(best_books) != 0:
+            if self.emit_local_top:
+                batch_to_send = ColumnarBatch(BOOKS_SCORES_SCHEMA)
+                for book in best_books:
+                    batch_to_send.append_row(book[HEAP_TITLE_IDX], book[HEAP_SCORE_SUM_IDX], book[HEAP_REVIEWS_COUNT_IDX])
+            else:
+                batch_to_send = ColumnarBatch(BOOKS_AVG_SCORE_SCHEMA)
+                for book in best_books:
+                    batch_to_send.append_row(book[HEAP_TITLE_IDX], book[HEAP_AVG_SCORE_IDX])
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, next_seq_num, batch_to_send.encode()))
+            self.update_self_seq_number(client_id, next_seq_num)
+            next_seq_num = self.get_seq_num_to_send(client_id, self.controller_name)
+        self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, client_id, self.controller_name, next_seq_num))
+        self.update_self_seq_number(client_id, next_seq_num)
+        self.set_state_value(client_id, ["best_books"], [])
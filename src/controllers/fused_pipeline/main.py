@@ -0,0 +1,97 @@
+import functools
+from shared.fused_pipeline import FusedPipeline
+from shared.initializers import init_log, init_configs
+from stages.book_sanitizer.book_sanitizer import BookSanitizer
+from stages.year_preprocessor.year_preprocessor import YearPreprocessor
+from stages.filter_of_books_by_year_and_genre.filter import FilterByGenreAndYear
+from stages.filter_of_books_by_title.filter import FilterByTitle
+from stages.query1_result_generator.generator import Generator as Query1Generator
+
+# The configs of each stage are the same environment variables used by its own controller, prefixed by the name of the stage (e.g. FILTER_OF_BOOKS_BY_TITLE__TITLE_KEYWORD).
+# The name of each stage is also used as its controller name, so the seq numbers it sends are the same whether it runs fused or not.
+STAGE_CONFIG_SEPARATOR = "__"
+
+
+def init_stage_configs(stage_name: str, env_vars_to_collect: list[str]):
+    prefix = f"{stage_name.upper()}{STAGE_CONFIG_SEPARATOR}"
+    config_params = init_configs([f"{prefix}{env_var}" for env_var in env_vars_to_collect])
+    return {env_var: config_params[f"{prefix}{env_var}"] for env_var in env_vars_to_collect}
+
+
+def build_book_sanitizer(stage_name: str, pipeline: FusedPipeline):
+    config_params = init_stage_configs(stage_name, ["INPUT_EXCHANGE", "OUTPUT_EXCHANGE", "INPUT_QUEUE_OF_BOOKS", "OUTPUT_QUEUE_OF_BOOKS"])
+    return BookSanitizer(input_exchange=config_params["INPUT_EXCHANGE"],
+                         input_queue=config_params["INPUT_QUEUE_OF_BOOKS"],
+                         output_exchange=config_params["OUTPUT_EXCHANGE"],
+                         output_queue=config_params["OUTPUT_QUEUE_OF_BOOKS"],
+                         controller_name=stage_name,
+                         fused_pipeline=pipeline)
+
+def build_year_preprocessor(stage_name: str, pipeline: FusedPipeline):
+    config_params = init_stage_configs(stage_name, ["INPUT_EXCHANGE", "OUTPUT_EXCHANGE", "INPUT_QUEUE_OF_BOOKS", "OUTPUT_QUEUE_OF_BOOKS_TOWARDS_PREPROC", "OUTPUT_QUEUE_OF_BOOKS_TOWARDS_FILTER"])
+    return YearPreprocessor(input_exchange=config_params["INPUT_EXCHANGE"],
+                            input_queue=config_params["INPUT_QUEUE_OF_BOOKS"],
+                            output_exchange=config_params["OUTPUT_EXCHANGE"],
+                            output_queue_towards_preproc=config_params["OUTPUT_QUEUE_OF_BOOKS_TOWARDS_PREPROC"],
+                            output_queue_towards_filter=config_params["OUTPUT_QUEUE_OF_BOOKS_TOWARDS_FILTER"],
+                            controller_name=stage_name,
+                            fused_pipeline=pipeline)
+
+def build_filter_of_books_by_year_and_genre(stage_name: str, pipeline: FusedPipeline):
+    config_params = init_stage_configs(stage_name, ["INPUT_EXCHANGE", "OUTPUT_EXCHANGE", "INPUT_QUEUE_OF_BOOKS", "OUTPUT_QUEUE_OF_BOOKS", "MIN_YEAR", "MAX_YEAR", "GENRE"])
+    return FilterByGenreAndYear(config_params["INPUT_EXCHANGE"],
+                                config_params["OUTPUT_EXCHANGE"],
+                                config_params["INPUT_QUEUE_OF_BOOKS"],
+                                config_params["OUTPUT_QUEUE_OF_BOOKS"],
+                                config_params["MIN_YEAR"],
+                                config_params["MAX_YEAR"],
+                                config_params["GENRE"],
+                                stage_name,
+                                fused_pipeline=pipeline)
+
+def build_filter_of_books_by_title(stage_name: str, pipeline: FusedPipeline):
+    config_params = init_stage_configs(stage_name, ["INPUT_EXCHANGE", "OUTPUT_EXCHANGE", "INPUT_QUEUE_OF_BOOKS", "OUTPUT_QUEUE_OF_BOOKS", "TITLE_KEYWORD"])
+    return FilterByTitle(config_params["INPUT_EXCHANGE"],
+                         config_params["OUTPUT_EXCHANGE"],
+                         config_params["INPUT_QUEUE_OF_BOOKS"],
+                         config_params["OUTPUT_QUEUE_OF_BOOKS"],
+                         config_params["TITLE_KEYWORD"],
+                         stage_name,
+                         fused_pipeline=pipeline)
+
+def build_query1_result_generator(stage_name: str, pipeline: FusedPipeline):
+    config_params = init_stage_configs(stage_name, ["INPUT_EXCHANGE", "OUTPUT_EXCHANGE", "INPUT_QUEUE_OF_BOOKS", "OUTPUT_QUEUE_OF_QUERY"])
+    return Query1Generator(config_params["INPUT_EXCHANGE"],
+                           config_params["OUTPUT_EXCHANGE"],
+                           config_params["INPUT_QUEUE_OF_BOOKS"],
+                           config_params["OUTPUT_QUEUE_OF_QUERY"],
+                           stage_name,
+                           fused_pipeline=pipeline)
+
+
+STAGE_BUILDERS = {
+    "book_sanitizer": build_book_sanitizer,
+    "year_preprocessor": build_year_preprocessor,
+    "filter_of_books_by_year_and_genre": build_filter_of_books_by_year_and_genre,
+    "filter_of_books_by_title": build_filter_of_books_by_title,
+    "query1_result_generator": build_query1_result_generator,
+}
+
+
+def main():
+    config_params = init_configs(["LOGGING_LEVEL", "FUSED_STAGES", "CONTROLLER_NAME"])
+    init_log(config_params["LOGGING_LEVEL"])
+
+    stage_builders = []
+    for stage_name in config_params["FUSED_STAGES"].split(","):
+        stage_name = stage_name.strip()
+        if stage_name not in STAGE_BUILDERS:
+            raise ValueError(f"Stage {stage_name} can not be fused. Fusable stages: {list(STAGE_BUILDERS)}")
+        stage_builders.append(functools.partial(STAGE_BUILDERS[stage_name], stage_name))
+
+    pipeline = FusedPipeline(config_params["CONTROLLER_NAME"], stage_builders)
+    pipeline.start()
+
+
+if __name__ == "__main__":
+    main()
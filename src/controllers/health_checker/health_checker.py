@@ -8,6 +8,7 @@ import logging
 from multiprocessing import Process
 import time
 from shared.monitorable_process import MonitorableProcess
+from shared.partitioner import stable_hash
 
 # Not an env var due to docker pathing within image
 CONTROLLERS_NAMES_PATH = '/monitorable_controllers.txt'
@@ -51,7 +52,7 @@ class HealthChecker(MonitorableProcess):
             if controller.startswith("health_checker") and controller == self.__get_health_checker_to_monitor():
                 controllers_to_check.append(controller)
             elif not controller.startswith("health_checker"):
-                hash_val = hash(controller) % self.num_of_healthcheckers
+                hash_val = stable_hash(controller) % self.num_of_healthcheckers
                 selected_id = hash_val + 1
                 if selected_id == self.health_checker_id:
                     controllers_to_check.append(controller)
@@ -0,0 +1,189 @@
+import json
+import logging
+import sqlite3
+import sys
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, Optional, TypeAlias
+
+BookTitle_t: TypeAlias = str
+# authors, categories, decade
+IndexedBook_t: TypeAlias = tuple[list[str], list[str], int]
+
+INDEXED_BOOK_AUTHORS_IDX = 0
+INDEXED_BOOK_CATEGORIES_IDX = 1
+INDEXED_BOOK_DECADE_IDX = 2
+
+# title, score, text
+PendingReview_t: TypeAlias = tuple[BookTitle_t, int, str]
+
+# SQLite limits the amount of parameters of a statement, so the titles are looked up in chunks
+MAX_TITLES_PER_LOOKUP = 500
+
+
+class BookIndex:
+    def __init__(self, index_file_path: str, cache_entries: int):
+        """
+        Index of the books of each client, stored in an SQLite table with only the columns that the merge needs, and an LRU cache of the most recently looked up books.
+        The books are inserted incrementally, so the index does not have to be rewritten nor loaded into memory, and restarting only opens the file.
+
+        The index also buffers the reviews that arrive before their book, so they are kept on disk instead of memory until the book arrives or the client has no more books.
+
+        Inserts and removals are only durable after commit, which must be called before the state of the merger is persisted.
+        As the index is committed before the state, the pending reviews consumed by a message are only marked with that message (its producer and seq num), and they are deleted once the state
+        that processed it is committed. If the merger stops in between, the message is redelivered and consumes the same reviews again.
+        """
+        self.connection = sqlite3.connect(index_file_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS books (client_id INTEGER, title TEXT, authors TEXT, categories TEXT, decade INTEGER, PRIMARY KEY (client_id, title)) WITHOUT ROWID")
+        # The pending reviews are keyed by the message and row they came from, so buffering a redelivered message does not duplicate them
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pending_reviews (client_id INTEGER, title TEXT, producer TEXT, seq_num INTEGER, row_idx INTEGER, score INTEGER, text TEXT, consumer TEXT, consumer_seq_num INTEGER, PRIMARY KEY (client_id, title, producer, seq_num, row_idx)) WITHOUT ROWID")
+        self.__migrate_pending_reviews_table()
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pending_reviews_by_message ON pending_reviews (client_id, producer, seq_num)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pending_reviews_by_consumer ON pending_reviews (client_id, consumer, consumer_seq_num) WHERE consumer IS NOT NULL")
+        self.connection.commit()
+        # Messages that consumed pending reviews since the last commit of the state
+        self.consumers_to_delete: set[tuple[int, str, int]] = set()
+        # Messages that consumed pending reviews before a restart without their state being committed, so they are redelivered
+        self.uncommitted_consumers: set[tuple[int, str, int]] = set()
+        self.cache_entries = cache_entries
+        # Books that are not in the index are cached as None, as reviews of unknown books are common
+        self.cache: OrderedDict[tuple[int, BookTitle_t], Optional[IndexedBook_t]] = OrderedDict()
+
+    def insert_books(self, client_id: int, books: Iterable[tuple[BookTitle_t, list[str], list[str], int]]):
+        rows = []
+        for title, authors, categories, decade in books:
+            rows.append((client_id, title, json.dumps(authors), json.dumps(categories), decade))
+            self.cache.pop((client_id, title), None)
+        self.connection.executemany("INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?)", rows)
+
+    def get_books(self, client_id: int, titles: Iterable[BookTitle_t]) -> dict[BookTitle_t, IndexedBook_t]:
+        """
+        Returns the indexed books with the given titles. The titles that are not in the cache are looked up in the index with a single query per chunk.
+        """
+        books: dict[BookTitle_t, IndexedBook_t] = {}
+        missing_titles = []
+        for title in set(titles):
+            key = (client_id, title)
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                book = self.cache[key]
+                if book is not None:
+                    books[title] = book
+            else:
+                missing_titles.append(title)
+
+        for start in range(0, len(missing_titles), MAX_TITLES_PER_LOOKUP):
+            chunk = missing_titles[start:start + MAX_TITLES_PER_LOOKUP]
+            placeholders = ",".join("?" * len(chunk))
+            found_books = {}
+            for title, authors, categories, decade in self.connection.execute(f"SELECT title, authors, categories, decade FROM books WHERE client_id = ? AND title IN ({placeholders})", (client_id, *chunk)):
+                found_books[title] = ([sys.intern(author) for author in json.loads(authors)], [sys.intern(category) for category in json.loads(categories)], decade)
+            for title in chunk:
+                book = found_books.get(title)
+                self.__cache(client_id, title, book)
+                if book is not None:
+                    books[title] = book
+        return books
+
+    def __cache(self, client_id: int, title: BookTitle_t, book: Optional[IndexedBook_t]):
+        self.cache[(client_id, title)] = book
+        if len(self.cache) > self.cache_entries:
+            self.cache.popitem(last=False)
+
+    def get_titles(self, client_id: int) -> Iterator[BookTitle_t]:
+        return (title for (title,) in self.connection.execute("SELECT title FROM books WHERE client_id = ?", (client_id,)))
+
+    def buffer_pending_reviews(self, client_id: int, producer: str, seq_num: int, reviews: Iterable[tuple[int, BookTitle_t, int, str]]):
+        """
+        :param reviews: (row index in the message, title, score, text) of each review
+        """
+        self.connection.executemany("INSERT OR IGNORE INTO pending_reviews (client_id, title, producer, seq_num, row_idx, score, text) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    [(client_id, title, producer, seq_num, row_idx, score, text) for row_idx, title, score, text in reviews])
+
+    def get_buffered_rows(self, client_id: int, producer: str, seq_num: int) -> set[int]:
+        """
+        Returns the row indexes of a message whose reviews were already buffered, because the message is a redelivery of one that was processed before a restart
+        """
+        return {row_idx for (row_idx,) in self.connection.execute("SELECT row_idx FROM pending_reviews WHERE client_id = ? AND producer = ? AND seq_num = ?", (client_id, producer, seq_num))}
+
+    def is_uncommitted_consumer(self, client_id: int, consumer: str, consumer_seq_num: int) -> bool:
+        return (client_id, consumer, consumer_seq_num) in self.uncommitted_consumers
+
+    def consume_pending_reviews(self, client_id: int, titles: Iterable[BookTitle_t], consumer: str, consumer_seq_num: int) -> list[PendingReview_t]:
+        """
+        Returns the pending reviews of the given titles, in arrival order for each title, and marks them as consumed by the given message.
+        The reviews that this same message consumed before a restart are returned again. They are deleted by delete_consumed_pending_reviews once the state is committed.
+        """
+        pending_reviews = []
+        titles = list(set(titles))
+        for start in range(0, len(titles), MAX_TITLES_PER_LOOKUP):
+            chunk = titles[start:start + MAX_TITLES_PER_LOOKUP]
+            placeholders = ",".join("?" * len(chunk))
+            not_consumed_by_others = "(consumer IS NULL OR (consumer = ? AND consumer_seq_num = ?))"
+            pending_reviews_of_chunk = self.connection.execute(f"SELECT title, score, text FROM pending_reviews WHERE client_id = ? AND title IN ({placeholders}) AND {not_consumed_by_others} ORDER BY title, producer, seq_num, row_idx", (client_id, *chunk, consumer, consumer_seq_num)).fetchall()
+            if pending_reviews_of_chunk:
+                pending_reviews.extend(pending_reviews_of_chunk)
+                self.connection.execute(f"UPDATE pending_reviews SET consumer = ?, consumer_seq_num = ? WHERE client_id = ? AND title IN ({placeholders}) AND consumer IS NULL", (consumer, consumer_seq_num, client_id, *chunk))
+                self.consumers_to_delete.add((client_id, consumer, consumer_seq_num))
+        self.uncommitted_consumers.discard((client_id, consumer, consumer_seq_num))
+        return pending_reviews
+
+    def delete_consumed_pending_reviews(self):
+        """
+        Deletes the pending reviews consumed since the last call. It must only be called once the state that processed their consumers is committed.
+        """
+        for client_id, consumer, consumer_seq_num in self.consumers_to_delete:
+            self.connection.execute("DELETE FROM pending_reviews WHERE client_id = ? AND consumer = ? AND consumer_seq_num = ?", (client_id, consumer, consumer_seq_num))
+        self.consumers_to_delete = set()
+
+    def recover_consumed_pending_reviews(self, was_processed: Callable[[int, str, int], bool]):
+        """
+        Deletes the pending reviews whose consumer was committed before a restart, and keeps the rest for their consumers, which are redelivered.
+
+        :param was_processed: tells whether a message (client id, producer, seq num) was processed by the committed state
+        """
+        consumers = self.connection.execute("SELECT DISTINCT client_id, consumer, consumer_seq_num FROM pending_reviews WHERE consumer IS NOT NULL").fetchall()
+        for client_id, consumer, consumer_seq_num in consumers:
+            if was_processed(client_id, consumer, consumer_seq_num):
+                self.connection.execute("DELETE FROM pending_reviews WHERE client_id = ? AND consumer = ? AND consumer_seq_num = ?", (client_id, consumer, consumer_seq_num))
+            else:
+                self.uncommitted_consumers.add((client_id, consumer, consumer_seq_num))
+        self.commit()
+        if self.uncommitted_consumers:
+            logging.info(f"[BOOK INDEX]: {len(self.uncommitted_consumers)} messages consumed pending reviews without being committed. Keeping their reviews until they are redelivered")
+
+    def discard_pending_reviews(self, client_id: int) -> int:
+        """
+        Removes the pending reviews of the client, whose books never arrived, and returns how many they were
+        """
+        return self.connection.execute("DELETE FROM pending_reviews WHERE client_id = ? AND consumer IS NULL", (client_id,)).rowcount
+
+    def __migrate_pending_reviews_table(self):
+        """
+        Pending reviews tables created before the consumed reviews were marked have no consumer columns
+        """
+        columns = {column_name for _, column_name, *_ in self.connection.execute("PRAGMA table_info(pending_reviews)")}
+        if "consumer" not in columns:
+            self.connection.execute("ALTER TABLE pending_reviews ADD COLUMN consumer TEXT")
+            self.connection.execute("ALTER TABLE pending_reviews ADD COLUMN consumer_seq_num INTEGER")
+
+    def remove_client(self, client_id: int):
+        """
+        The cached books of the client are not removed, they are evicted as they are never looked up again
+        """
+        self.connection.execute("DELETE FROM books WHERE client_id = ?", (client_id,))
+        self.connection.execute("DELETE FROM pending_reviews WHERE client_id = ?", (client_id,))
+        self.consumers_to_delete = {consumer for consumer in self.consumers_to_delete if consumer[0] != client_id}
+        self.uncommitted_consumers = {consumer for consumer in self.uncommitted_consumers if consumer[0] != client_id}
+
+    def remove_clients_except(self, client_ids: set[int]):
+        indexed_client_ids = [client_id for (client_id,) in self.connection.execute("SELECT client_id FROM books UNION SELECT client_id FROM pending_reviews")]
+        for client_id in indexed_client_ids:
+            if client_id not in client_ids:
+                logging.info(f"[BOOK INDEX]: removing the stale books of client_{client_id}")
+                self.remove_client(client_id)
+        self.commit()
+
+    def commit(self):
+        self.connection.commit()
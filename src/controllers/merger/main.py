@@ -1,10 +1,11 @@
-from shared.initializers import init_log, init_configs
+from shared.initializers import init_log, init_configs, init_optional_configs
 import logging
 from merger import Merger
 
 def main():
     config_params = init_configs(["LOGGING_LEVEL", "INPUT_EXCHANGE_OF_REVIEWS", "INPUT_EXCHANGE_OF_BOOKS", "OUTPUT_EXCHANGE", "INPUT_QUEUE_OF_REVIEWS", "INPUT_QUEUE_OF_BOOKS","OUTPUT_QUEUE_OF_COMPACT_REVIEWS", "OUTPUT_QUEUE_OF_FULL_REVIEWS", "OUTPUT_QUEUE_OF_BOOKS_CONFIRMS", "CONTROLLER_NAME"])
     init_log(config_params["LOGGING_LEVEL"])
+    optional_config_params = init_optional_configs({"BOOK_INDEX_CACHE_ENTRIES": "100000", "PUSHDOWN_DECADE_OF_COMPACT_REVIEWS": "", "PUSHDOWN_GENRE_OF_FULL_REVIEWS": "", "OUTPUT_QUEUE_OF_TITLES_FILTERS": "", "TITLES_FILTER_FP_RATE": "0.01"})
     merger = Merger(config_params["INPUT_EXCHANGE_OF_REVIEWS"], 
                     config_params["INPUT_EXCHANGE_OF_BOOKS"], 
                     config_params["OUTPUT_EXCHANGE"],
@@ -13,7 +14,12 @@ def main():
                     config_params["OUTPUT_QUEUE_OF_COMPACT_REVIEWS"],
                     config_params["OUTPUT_QUEUE_OF_FULL_REVIEWS"],
                     config_params["OUTPUT_QUEUE_OF_BOOKS_CONFIRMS"],
-                    config_params["CONTROLLER_NAME"])
+                    config_params["CONTROLLER_NAME"],
+                    int(optional_config_params["BOOK_INDEX_CACHE_ENTRIES"]),
+                    int(optional_config_params["PUSHDOWN_DECADE_OF_COMPACT_REVIEWS"]) if optional_config_params["PUSHDOWN_DECADE_OF_COMPACT_REVIEWS"] else None,
+                    optional_config_params["PUSHDOWN_GENRE_OF_FULL_REVIEWS"] or None,
+                    optional_config_params["OUTPUT_QUEUE_OF_TITLES_FILTERS"] or None,
+                    float(optional_config_params["TITLES_FILTER_FP_RATE"]))
     merger.start()
 
 
@@ -1,26 +1,27 @@
-import json
-from shared.atomic_writer import AtomicWriter
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
+import os
+import re
+from typing import Optional
+from shared.batch_schemas import BOOKS_WITH_DECADE_SCHEMA, COMPACT_REVIEWS_SCHEMA, FULL_REVIEWS_SCHEMA, SANITIZED_REVIEWS_SCHEMA, TITLES_FILTER_SCHEMA
+from shared.bloom_filter import BITS_COUNT_IDX, BITS_IDX, HASHES_COUNT_IDX, BloomFilter
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
-
-from typing import TypeAlias
-
-from shared.monitorable_process import ClientID_t
-BookTitle_t: TypeAlias = str
-BookData_t: TypeAlias = list[str, str, str, str]
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
+from shared.state_store import SnapshotStateStore
+from book_index import INDEXED_BOOK_AUTHORS_IDX, INDEXED_BOOK_CATEGORIES_IDX, INDEXED_BOOK_DECADE_IDX, BookIndex, IndexedBook_t
 
 BOOK_TITLE_IDX = 0
 BOOK_AUTHORS_IDX = 1
 BOOK_CATEGORIES_IDX = 2
 BOOK_DECADE_IDX = 3
 
-
 REVIEW_TITLE_IDX = 0
 REVIEW_SCORE_IDX = 1
 REVIEW_TEXT_IDX = 2
 
+# Before the book index, the books were saved apart in this file
+LEGACY_BOOKS_STATE_FILE_PATH = "books_state.json"
+LEGACY_LIST_ELEMENTS_SEPARATOR_REGEX = re.compile(r"',\s*'")
+
 class Merger(MonitorableProcess):
     def __init__(self, input_exchange_name_reviews: str,
                  input_exchange_name_books: str,
@@ -30,10 +31,25 @@ class Merger(MonitorableProcess):
                  output_queue_of_compact_reviews: str,
                  output_queue_of_full_reviews: str,
                  output_queue_of_books_confirms: str,
-                 controller_name: str):
+                 controller_name: str,
+                 book_index_cache_entries: int = 100000,
+                 pushdown_decade_of_compact_reviews: Optional[int] = None,
+                 pushdown_genre_of_full_reviews: Optional[str] = None,
+                 output_queue_of_titles_filters: Optional[str] = None,
+                 titles_filter_false_positive_rate: float = 0.01):
+        """
+        The books of each client are kept in a BookIndex on disk instead of the state. The state only counts the indexed books of each client, and the index is committed right before the state.
+        Pending reviews are only deleted from the index once the state that consumed them is committed, so a window that is redelivered after a restart sends the same reviews again.
+
+        Books and reviews are joined symmetrically, so the reviews of a client may arrive before its books are complete: the reviews whose book is not known yet are buffered in the index
+        and merged when their book arrives, or discarded at EOF_B. The EOF_R of a client is only forwarded once both its EOF_B and its EOF_R were received.
+
+        ## Important parameter details:
+        - pushdown_decade_of_compact_reviews: When given, only the compact reviews of books of this decade are sent, as the filter that consumes them would discard the rest.
+        - pushdown_genre_of_full_reviews: When given, only the full reviews of books with a category that contains this genre are sent, as the filter that consumes them would discard the rest.
+        - output_queue_of_titles_filters: When given, a Bloom filter of the titles of each client is sent to this queue on its EOF_B, with a false positive rate of titles_filter_false_positive_rate, so the review sanitizer can drop the reviews of books that this merger does not know instead of sending them here.
+        """
         super().__init__(controller_name)
-        self.books_state_file_path = "books_state.json"
-        self.books_state: dict[ClientID_t, dict[BookTitle_t, BookData_t]] = self.__load_books_state_file()
 
         self.input_exchange_name_reviews = input_exchange_name_reviews
         self.input_exchange_name_books = input_exchange_name_books
@@ -43,17 +59,31 @@ class Merger(MonitorableProcess):
         self.output_queue_of_compact_reviews = output_queue_of_compact_reviews
         self.output_queue_of_full_reviews = output_queue_of_full_reviews
         self.output_queue_of_books_confirms = output_queue_of_books_confirms
+        self.pushdown_decade_of_compact_reviews = pushdown_decade_of_compact_reviews
+        self.pushdown_genre_of_full_reviews = pushdown_genre_of_full_reviews.lower() if pushdown_genre_of_full_reviews is not None else None
+        self.output_queue_of_titles_filters = output_queue_of_titles_filters
+        self.titles_filter_false_positive_rate = titles_filter_false_positive_rate
+        # Rows and bytes of each client that were not published thanks to the pushdown, per output queue. They are only kept in memory to log them at the end of each client.
+        self.pushdown_savings: dict[int, dict[str, list[int]]] = {}
         self.mq_connection_handler = None
+        self.book_index = BookIndex(f"{controller_name}_books.sqlite", book_index_cache_entries)
+        # Clients whose books are removed from the index once the state without them is committed, so the books are still there if their last messages are redelivered
+        self.clients_to_remove_from_index: list[int] = []
+        self.__migrate_legacy_books_state_file()
+        self.book_index.remove_clients_except({client_id for client_id, client_state in self.state.items() if "indexed_books" in client_state or "pending_reviews" in client_state})
+        self.book_index.recover_consumed_pending_reviews(self.was_processed)
         
     def start(self):
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange_name,
-                                                         output_queues_to_bind={
-                                                             self.output_queue_of_compact_reviews: [self.output_queue_of_compact_reviews],
-                                                             self.output_queue_of_full_reviews: [self.output_queue_of_full_reviews],
-                                                             self.output_queue_of_books_confirms: [self.output_queue_of_books_confirms]},
-                                                         input_exchange_name=self.input_exchange_name_reviews,
-                                                         input_queues_to_recv_from=[self.input_queue_of_reviews, self.input_queue_of_books],
-                                                         aux_input_exchange_name=self.input_exchange_name_books)
+        output_queues_to_bind = {self.output_queue_of_compact_reviews: [self.output_queue_of_compact_reviews],
+                                 self.output_queue_of_full_reviews: [self.output_queue_of_full_reviews],
+                                 self.output_queue_of_books_confirms: [self.output_queue_of_books_confirms]}
+        if self.output_queue_of_titles_filters is not None:
+            output_queues_to_bind[self.output_queue_of_titles_filters] = [self.output_queue_of_titles_filters]
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange_name,
+                                                                        output_queues_to_bind=output_queues_to_bind,
+                                                                        input_exchange_name=self.input_exchange_name_reviews,
+                                                                        input_queues_to_recv_from=[self.input_queue_of_reviews, self.input_queue_of_books],
+                                                                        aux_input_exchange_name=self.input_exchange_name_books)
         
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue_of_books, self.state_handler_callback, self.__handle_books_preprocessors_msgs) 
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue_of_reviews, self.state_handler_callback, self.__handle_review_preprocessor_msgs)
@@ -69,26 +99,52 @@ class Merger(MonitorableProcess):
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_of_compact_reviews, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.mq_connection_handler.send_message(self.output_queue_of_full_reviews, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue_of_compact_reviews, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.mq_connection_handler.send_message(self.output_queue_of_full_reviews, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
+            self.clients_to_remove_from_index.append(body.client_id)
         else:
             self.__handle_incoming_books_data(body)
 
     def __handle_incoming_books_data(self, body: SystemMessage):
-        books_batch = body.get_batch_iter_from_payload()
-        for book in books_batch:
-            if book: 
-                title = book[BOOK_TITLE_IDX]
-                self.__update_books_data_state(body.client_id, title, book)
-        self.__save_books_state_file()
+        books_batch = body.get_batch_from_payload(BOOKS_WITH_DECADE_SCHEMA)
+        self.book_index.insert_books(body.client_id, books_batch.rows())
+        self.increment_state_value(body.client_id, ["indexed_books"], len(books_batch))
+        # A redelivered message must consume again the reviews it consumed before a restart, even if the reviews were buffered by messages that were not committed either
+        if self.state[body.client_id].get("pending_reviews", 0) > 0 or self.book_index.is_uncommitted_consumer(body.client_id, body.controller_name, body.controller_seq_num):
+            books_of_batch: dict[str, IndexedBook_t] = {book[BOOK_TITLE_IDX]: (book[BOOK_AUTHORS_IDX], book[BOOK_CATEGORIES_IDX], book[BOOK_DECADE_IDX]) for book in books_batch.rows()}
+            pending_reviews = self.book_index.consume_pending_reviews(body.client_id, books_of_batch.keys(), body.controller_name, body.controller_seq_num)
+            if pending_reviews:
+                self.increment_state_value(body.client_id, ["pending_reviews"], -len(pending_reviews))
+                self.__send_merged_reviews(body.client_id, [(title, books_of_batch[title], score, text) for title, score, text in pending_reviews])
         
 
     def __handdle_eof_books(self, client_id):
         logging.info(f"Received EOF_B from [ client_{client_id} ]. Sending confirmation to server.")
-        msg_for_server = SystemMessage(SystemMessageType.EOF_B, client_id, self.controller_name, 1).encode_to_str()
+        msg_for_server = SystemMessage(SystemMessageType.EOF_B, client_id, self.controller_name, 1)
         self.mq_connection_handler.send_message(self.output_queue_of_books_confirms, msg_for_server)
         logging.info("Sent EOF_B confirmation to server")
+        self.set_state_value(client_id, ["books_completed"], True)
+        if self.output_queue_of_titles_filters is not None:
+            self.__send_titles_filter(client_id)
+        if self.state[client_id].get("pending_reviews", 0) > 0:
+            discarded_reviews = self.book_index.discard_pending_reviews(client_id)
+            logging.info(f"Discarded [ {discarded_reviews} ] pending reviews of unknown books of [ client_{client_id} ]")
+        self.remove_state_value(client_id, ["pending_reviews"])
+        if self.state[client_id].get("reviews_completed", False):
+            self.__finish_client(client_id)
+
+    
+    def __send_titles_filter(self, client_id):
+        titles_filter = BloomFilter.with_false_positive_rate(self.state[client_id].get("indexed_books", 0), self.titles_filter_false_positive_rate)
+        titles_filter.add_all(self.book_index.get_titles(client_id))
+        encoded_filter = titles_filter.encode()
+        filter_batch = ColumnarBatch(TITLES_FILTER_SCHEMA)
+        filter_batch.append_row(self.input_queue_of_reviews, encoded_filter[BITS_COUNT_IDX], encoded_filter[HASHES_COUNT_IDX], encoded_filter[BITS_IDX])
+        seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
+        self.mq_connection_handler.send_message(self.output_queue_of_titles_filters, SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, filter_batch.encode()))
+        self.update_self_seq_number(client_id, seq_num_to_send)
+        logging.info(f"Sent the titles filter of [ client_{client_id} ] ({titles_filter.size_in_bytes() / 1024:.1f} KiB)")
 
     
     # ==============================================================================================================
@@ -100,79 +156,133 @@ class Merger(MonitorableProcess):
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_of_compact_reviews, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.mq_connection_handler.send_message(self.output_queue_of_full_reviews, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue_of_compact_reviews, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.mq_connection_handler.send_message(self.output_queue_of_full_reviews, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
+            self.clients_to_remove_from_index.append(body.client_id)
         else:
             self.__handle_incoming_reviews_data(body)
 
     def __handle_eof_reviews(self, client_id):
+        if not self.state[client_id].get("books_completed", False):
+            logging.info(f"Received EOF_R from [ client_{client_id} ] before its EOF_B. Waiting for the rest of its books.")
+            self.set_state_value(client_id, ["reviews_completed"], True)
+            return
+        self.__finish_client(client_id)
+
+    def __finish_client(self, client_id):
         seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
 
-        msg_to_send = SystemMessage(SystemMessageType.EOF_R, client_id, self.controller_name, seq_num_to_send).encode_to_str()
+        msg_to_send = SystemMessage(SystemMessageType.EOF_R, client_id, self.controller_name, seq_num_to_send)
         self.mq_connection_handler.send_message(self.output_queue_of_compact_reviews, msg_to_send)
         logging.info("Sent EOF_R message to compact reviews queue")
 
-        msg_to_send = SystemMessage(SystemMessageType.EOF_R, client_id, self.controller_name, seq_num_to_send).encode_to_str()
+        msg_to_send = SystemMessage(SystemMessageType.EOF_R, client_id, self.controller_name, seq_num_to_send)
         self.mq_connection_handler.send_message(self.output_queue_of_full_reviews, msg_to_send)
         logging.info("Sent EOF_R message to full reviews queue")
 
         self.update_self_seq_number(client_id, seq_num_to_send)
-        self.__update_books_data_state(client_id, None, None, reset_for_client=True)
-        self.__save_books_state_file()
+        self.__log_pushdown_savings(client_id)
+        self.remove_state_value(client_id, ["indexed_books"])
+        self.remove_state_value(client_id, ["books_completed"])
+        self.remove_state_value(client_id, ["reviews_completed"])
+        self.clients_to_remove_from_index.append(client_id)
 
     def __handle_incoming_reviews_data(self, body: SystemMessage):
-        compact_output_payload = ""
-        full_output_payload = ""
-        reviews_batch = body.get_batch_iter_from_payload()
-        for review in reviews_batch:
+        reviews_batch = body.get_batch_from_payload(SANITIZED_REVIEWS_SCHEMA)
+        books_data_of_client = self.book_index.get_books(body.client_id, reviews_batch.columns[REVIEW_TITLE_IDX])
+        books_completed = self.state[body.client_id].get("books_completed", False)
+        # The rows that a redelivered message buffered before a restart stay pending, even if their book was indexed since then, so they are sent by the message that consumed them
+        buffered_rows = self.book_index.get_buffered_rows(body.client_id, body.controller_name, body.controller_seq_num) if not books_completed else set()
+        merged_reviews = []
+        pending_reviews = []
+        for row_idx, review in enumerate(reviews_batch.rows()):
             title = review[REVIEW_TITLE_IDX]
-            score = review[REVIEW_SCORE_IDX]
-            text = review[REVIEW_TEXT_IDX]
-            books_data_of_client = self.books_state.get(body.client_id, {})
-            if title in books_data_of_client:
-                compact_review, full_review = self.__merge_review_with_book(title, score, text, books_data_of_client[title])
-                compact_output_payload += compact_review 
-                full_output_payload += full_review 
-        if compact_output_payload:
-            seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            msg_to_send = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, compact_output_payload).encode_to_str()
+            if row_idx in buffered_rows:
+                pending_reviews.append((row_idx, title, review[REVIEW_SCORE_IDX], review[REVIEW_TEXT_IDX]))
+            elif title in books_data_of_client:
+                merged_reviews.append((title, books_data_of_client[title], review[REVIEW_SCORE_IDX], review[REVIEW_TEXT_IDX]))
+            elif not books_completed:
+                pending_reviews.append((row_idx, title, review[REVIEW_SCORE_IDX], review[REVIEW_TEXT_IDX]))
+        if pending_reviews:
+            self.book_index.buffer_pending_reviews(body.client_id, body.controller_name, body.controller_seq_num, pending_reviews)
+            self.increment_state_value(body.client_id, ["pending_reviews"], len(pending_reviews))
+        self.__send_merged_reviews(body.client_id, merged_reviews)
+
+    def __send_merged_reviews(self, client_id: int, merged_reviews: list[tuple[str, IndexedBook_t, int, str]]):
+        compact_output_batch = ColumnarBatch(COMPACT_REVIEWS_SCHEMA)
+        full_output_batch = ColumnarBatch(FULL_REVIEWS_SCHEMA)
+        for title, book_data, score, text in merged_reviews:
+            compact_review = (title, book_data[INDEXED_BOOK_AUTHORS_IDX], score, book_data[INDEXED_BOOK_DECADE_IDX])
+            if self.pushdown_decade_of_compact_reviews is None or book_data[INDEXED_BOOK_DECADE_IDX] == self.pushdown_decade_of_compact_reviews:
+                compact_output_batch.append_row(*compact_review)
+            else:
+                self.__count_pushdown_saving(client_id, self.output_queue_of_compact_reviews, COMPACT_REVIEWS_SCHEMA, compact_review)
+            full_review = (title, book_data[INDEXED_BOOK_CATEGORIES_IDX], text)
+            if self.pushdown_genre_of_full_reviews is None or any(self.pushdown_genre_of_full_reviews in category.lower() for category in book_data[INDEXED_BOOK_CATEGORIES_IDX]):
+                full_output_batch.append_row(*full_review)
+            else:
+                self.__count_pushdown_saving(client_id, self.output_queue_of_full_reviews, FULL_REVIEWS_SCHEMA, full_review)
+        if compact_output_batch:
+            seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
+            msg_to_send = SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, compact_output_batch.encode())
             self.mq_connection_handler.send_message(self.output_queue_of_compact_reviews, msg_to_send)
-            self.update_self_seq_number(body.client_id, seq_num_to_send)
-        if full_output_payload:
-            seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            msg_to_send = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, full_output_payload).encode_to_str()
+            self.update_self_seq_number(client_id, seq_num_to_send)
+        if full_output_batch:
+            seq_num_to_send = self.get_seq_num_to_send(client_id, self.controller_name)
+            msg_to_send = SystemMessage(SystemMessageType.DATA, client_id, self.controller_name, seq_num_to_send, full_output_batch.encode())
             self.mq_connection_handler.send_message(self.output_queue_of_full_reviews, msg_to_send)
-            self.update_self_seq_number(body.client_id, seq_num_to_send)
-
-    def __merge_review_with_book(self, title, score, text, book_data):
-        authors = book_data[BOOK_AUTHORS_IDX]
-        categories = book_data[BOOK_CATEGORIES_IDX]
-        decade = book_data[BOOK_DECADE_IDX]
-        compact_review = f"{title},\"{authors}\",{score},{decade}" + "\n"
-        full_review = f"{title},\"{categories}\",{text}" + "\n"
-        return compact_review, full_review
-    
-      
+            self.update_self_seq_number(client_id, seq_num_to_send)
+
+
+    def __count_pushdown_saving(self, client_id: int, output_queue: str, schema: tuple, row: tuple):
+        savings = self.pushdown_savings.setdefault(client_id, {}).setdefault(output_queue, [0, 0])
+        savings[0] += 1
+        savings[1] += ColumnarBatch.encoded_row_size(schema, row)
+
+    def __log_pushdown_savings(self, client_id: int):
+        for output_queue, (rows, saved_bytes) in self.pushdown_savings.pop(client_id, {}).items():
+            logging.info(f"[PUSHDOWN]: [ client_{client_id} ] {rows} rows ({saved_bytes / (1024 * 1024):.2f} MiB) were not published to {output_queue}")
+
+
     # ==============================================================================================================
 
 
-    def __update_books_data_state(self, client_id, title, book_data, reset_for_client=False):
-        if reset_for_client:
-            self.books_state[client_id] = {}
-        if client_id in self.books_state:
-            self.books_state[client_id][title] = book_data
-        else:
-            self.books_state[client_id] = {title: book_data}
+    def save_state_file(self):
+        """
+        The index is committed before the state, so the books and pending reviews of the window are durable once the state says that their messages were processed.
+        The pending reviews consumed in the window and the removed clients are only deleted from the index after the state is committed, so they are still there if the window is redelivered.
+        """
+        self.book_index.commit()
+        super().save_state_file()
+        if self.book_index.consumers_to_delete or self.clients_to_remove_from_index:
+            self.book_index.delete_consumed_pending_reviews()
+            for client_id in self.clients_to_remove_from_index:
+                self.book_index.remove_client(client_id)
+            self.book_index.commit()
+            self.clients_to_remove_from_index = []
 
-    def __save_books_state_file(self):
-        writer = AtomicWriter(self.books_state_file_path)
-        writer.write(json.dumps(self.books_state))
-    
-    def __load_books_state_file(self) -> dict:
-        try:
-            with open(self.books_state_file_path, 'r') as f:
-                state_json = json.load(f)
-                return {int(k): v for k, v in state_json.items()}
-        except FileNotFoundError:
-            return {}
\ No newline at end of file
+    def __migrate_legacy_books_state_file(self):
+        """
+        Before the book index, the books of each client were saved apart in the legacy books file, as rows of strings with the authors and categories as a list literal (e.g. "['a', 'b']").
+        The books are moved to the index and the file is deleted once the state that counts them is committed, so a restart in between migrates them again.
+        The legacy merger never buffered reviews, as the reviews of a client were only sent once its books were complete, so the migrated clients are taken as having their books completed.
+        """
+        if not os.path.exists(LEGACY_BOOKS_STATE_FILE_PATH):
+            return
+        legacy_books_state = SnapshotStateStore(LEGACY_BOOKS_STATE_FILE_PATH).load()
+        for client_id, books in legacy_books_state.items():
+            if not books or "indexed_books" in self.state.get(client_id, {}):
+                continue
+            self.book_index.insert_books(client_id, [(book[BOOK_TITLE_IDX],
+                                                      self.__split_legacy_list(book[BOOK_AUTHORS_IDX]),
+                                                      self.__split_legacy_list(book[BOOK_CATEGORIES_IDX]),
+                                                      int(book[BOOK_DECADE_IDX])) for book in books.values()])
+            self.set_state_value(client_id, ["indexed_books"], len(books))
+            self.set_state_value(client_id, ["books_completed"], True)
+        self.save_state_file()
+        os.remove(LEGACY_BOOKS_STATE_FILE_PATH)
+        logging.info(f"[BOOK INDEX]: the books of {len(legacy_books_state)} clients were moved from {LEGACY_BOOKS_STATE_FILE_PATH} to the index")
+
+    def __split_legacy_list(self, list_as_str: str) -> list[str]:
+        return LEGACY_LIST_ELEMENTS_SEPARATOR_REGEX.split(list_as_str[2:-2])
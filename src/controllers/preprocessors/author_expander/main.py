@@ -1,4 +1,4 @@
-from shared.initializers import init_log, init_configs
+from shared.initializers import init_log, init_configs, init_optional_configs
 from expander import AuthorExpander
 import logging
 
@@ -9,12 +9,14 @@ def main():
         output_queues.append(f"OUTPUT_QUEUE_OF_AUTHORS_{i}")
     config_params_output_queues = init_configs(output_queues)
     init_log(config_params["LOGGING_LEVEL"])
+    optional_config_params = init_optional_configs({"COMBINER_SIZE_MB": "0"})
     
     expander = AuthorExpander(input_exchange=config_params["INPUT_EXCHANGE"],
                               output_exchange=config_params["OUTPUT_EXCHANGE"],
                               input_queue_of_books=config_params["INPUT_QUEUE_OF_BOOKS"],
                               output_queues=config_params_output_queues,
-                              controller_name=config_params["CONTROLLER_NAME"])
+                              controller_name=config_params["CONTROLLER_NAME"],
+                              combiner_size_mb=int(optional_config_params["COMBINER_SIZE_MB"]))
     expander.start()
     
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import logging
+from collections import OrderedDict
+
+# Approximate memory used by each entry: the key tuple, the decade and the node of the ordered dict. The author strings are shared with the received batches.
+ESTIMATED_BYTES_PER_ENTRY = 200
+
+
+class SeenPairsCombiner:
+    def __init__(self, max_size_in_bytes: int):
+        """
+        Map-side combiner of the (author, decade) pairs of each client. The counters only keep the set of decades of each author, so a pair that was already forwarded can be dropped.
+
+        The pairs are kept in an LRU set bounded by max_size_in_bytes, shared by all the clients. Evicting a pair is always safe: it is just forwarded again if it is seen afterwards,
+        and so is every pair after a restart, as the set is only kept in memory. The pairs of the clients that already finished are never looked up again, so they are the first to be evicted.
+        """
+        self.max_entries = max(1, max_size_in_bytes // ESTIMATED_BYTES_PER_ENTRY)
+        self.seen_pairs: OrderedDict[tuple[int, str, int], None] = OrderedDict()
+        self.lookups_per_client: dict[int, int] = {}
+        self.hits_per_client: dict[int, int] = {}
+        self.evictions = 0
+
+    def is_new_pair(self, client_id: int, author: str, decade: int) -> bool:
+        """
+        Returns True if the pair was not seen for the client, and marks it as seen
+        """
+        key = (client_id, author, decade)
+        self.lookups_per_client[client_id] = self.lookups_per_client.get(client_id, 0) + 1
+        if key in self.seen_pairs:
+            self.seen_pairs.move_to_end(key)
+            self.hits_per_client[client_id] = self.hits_per_client.get(client_id, 0) + 1
+            return False
+        self.seen_pairs[key] = None
+        if len(self.seen_pairs) > self.max_entries:
+            self.seen_pairs.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def log_stats(self, client_id: int):
+        """
+        Logs the hit rate of the client and forgets its counters
+        """
+        lookups = self.lookups_per_client.pop(client_id, 0)
+        hits = self.hits_per_client.pop(client_id, 0)
+        hit_rate = hits / lookups if lookups else 0.0
+        logging.info(f"[PAIRS COMBINER]: client_{client_id} hit rate {hit_rate:.1%} ({hits}/{lookups} pairs dropped), {len(self.seen_pairs)}/{self.max_entries} entries, {self.evictions} evictions")
+
+    def forget_client(self, client_id: int):
+        """
+        Drops the pairs and the counters of an aborted client, as its pairs must be forwarded again if its id is used afterwards
+        """
+        client_pairs = [key for key in self.seen_pairs if key[0] == client_id]
+        for key in client_pairs:
+            del self.seen_pairs[key]
+        self.lookups_per_client.pop(client_id, None)
+        self.hits_per_client.pop(client_id, None)
+        logging.info(f"[PAIRS COMBINER]: client_{client_id} aborted, {len(client_pairs)} pairs forgotten")
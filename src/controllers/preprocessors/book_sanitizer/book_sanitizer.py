@@ -1,10 +1,13 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 import csv
 import io
+import re
 from shared import constants
+from shared.batch_schemas import SANITIZED_BOOKS_SCHEMA
+from shared.fused_pipeline import FusedPipeline
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
+from typing import Optional
 
 TITLE_IDX = 0
 AUTHORS_IDX = 2
@@ -13,6 +16,8 @@ PUBLISHED_DATE_IDX = 6
 CATEGORIES_IDX = 8
 REQUIRED_SIZE_OF_ROW = 10
 
+LIST_ELEMENTS_SEPARATOR_REGEX = re.compile(r"',\s*'")
+
 class BookSanitizer(MonitorableProcess):
 
     def __init__(self, 
@@ -20,14 +25,15 @@ class BookSanitizer(MonitorableProcess):
                  input_queue: str, 
                  output_exchange: str, 
                  output_queue: str, 
-                 controller_name: str):
-        super().__init__(controller_name)
+                 controller_name: str,
+                 fused_pipeline: Optional[FusedPipeline] = None):
+        super().__init__(controller_name, fused_pipeline)
 
         self.output_queue = output_queue
-        self.mq_connection_handler = MQConnectionHandler(output_exchange, 
-                                                         {output_queue: [output_queue]},
-                                                         input_exchange,
-                                                         [input_queue])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange, 
+                                                                        {output_queue: [output_queue]},
+                                                                        input_exchange,
+                                                                        [input_queue])
         
         self.mq_connection_handler.setup_callbacks_for_input_queue(input_queue, self.state_handler_callback, self.__process_msg_from_sv)
 
@@ -38,8 +44,8 @@ class BookSanitizer(MonitorableProcess):
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         elif body.type == SystemMessageType.DATA:
             self.__sanitize_books_and_send(body)
 
@@ -47,13 +53,13 @@ class BookSanitizer(MonitorableProcess):
     def __handle_eof(self, body: SystemMessage):
         logging.info(f"Received EOF_B from [ client_{body.client_id} ]")
         seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-        msg_to_send = SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send).encode_to_str()
+        msg_to_send = SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send)
         self.mq_connection_handler.send_message(self.output_queue, msg_to_send)
         self.update_self_seq_number(body.client_id, seq_num_to_send)
 
     def __sanitize_books_and_send(self, body: SystemMessage):
         books_batch = body.get_batch_iter_from_payload()
-        payload_to_send = ""
+        batch_to_send = ColumnarBatch(SANITIZED_BOOKS_SCHEMA)
         for book in books_batch:
             if len(book) < REQUIRED_SIZE_OF_ROW:
                     continue
@@ -70,11 +76,11 @@ class BookSanitizer(MonitorableProcess):
             publisher = self.__fix_publisher_format(publisher)
             categories = self.__fix_categories_format(categories)
 
-            payload_to_send += self.__format_sanitized_book(title, authors, publisher, published_date, categories)
+            batch_to_send.append_row(title, authors, publisher, published_date, categories)
         
-        if payload_to_send:
+        if batch_to_send:
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            msg_to_send = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, payload_to_send).encode_to_str()
+            msg_to_send = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, batch_to_send.encode())
             self.mq_connection_handler.send_message(self.output_queue, msg_to_send)
             self.update_self_seq_number(body.client_id, seq_num_to_send)
     
@@ -83,13 +89,13 @@ class BookSanitizer(MonitorableProcess):
         return title.replace("\n", " ").replace("\r", "").replace(",", ";").replace('"', "`").replace("'", "`")
 
     def __fix_authors_format(self, authors):
-        return self.__make_list_format_consisent(authors)
+        return self.__split_list_elements(self.__make_list_format_consisent(authors))
 
     def __fix_publisher_format(self, publisher):
         return publisher.replace(",", ";")
     
     def __fix_categories_format(self, categories):
-        return self.__make_list_format_consisent(categories)
+        return self.__split_list_elements(self.__make_list_format_consisent(categories))
     
     def __make_list_format_consisent(self, list_as_str):
         list_as_str = list_as_str.replace('"', "").replace("'","")
@@ -111,8 +117,11 @@ class BookSanitizer(MonitorableProcess):
         fixed_list = fixed_list.replace("',' ", "', '")  # restore original spacing
         return fixed_list
 
-    def __format_sanitized_book(self, title, authors, publisher, published_date, categories):
-        return f"{title},\"{authors}\",{publisher},{published_date},\"{categories}\"" + "\n"
+    def __split_list_elements(self, list_as_str):
+        """
+        Turns a list with the consistent format (e.g. "['a', 'b']") into a list of its elements, so no stage has to parse it again.
+        """
+        return LIST_ELEMENTS_SEPARATOR_REGEX.split(list_as_str[2:-2])
 
 
     def start(self):
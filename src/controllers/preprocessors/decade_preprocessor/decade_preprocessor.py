@@ -1,14 +1,13 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
+from shared.batch_schemas import AUTHORS_WITH_DECADE_SCHEMA, BOOKS_WITH_DECADE_SCHEMA, BOOKS_WITH_YEAR_SCHEMA
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 
 
 TITLE_IDX = 0
 AUTHORS_IDX = 1
 YEAR_IDX = 2
 CATEGORIES_IDX = 3
-REQUIRED_SIZE_OF_ROW = 4
 
 class DecadePreprocessor(MonitorableProcess):
     def __init__(self, 
@@ -22,15 +21,16 @@ class DecadePreprocessor(MonitorableProcess):
 
         self.output_queue_towards_expander = output_queue_towards_expander
         self.output_queues_towards_mergers = output_queues_towards_mergers
+        self.merger_partitioner = self.create_partitioner(output_queues_towards_mergers)
         
         output_queues_to_bind = {output_queue_towards_expander: [output_queue_towards_expander]}
         for output_queue_towards_merger in output_queues_towards_mergers:
             output_queues_to_bind[output_queue_towards_merger] = [output_queue_towards_merger]
 
-        self.mq_connection_handler = MQConnectionHandler(output_exchange, 
-                                                         output_queues_to_bind,
-                                                         input_exchange,
-                                                         [input_queue])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange, 
+                                                                        output_queues_to_bind,
+                                                                        input_exchange,
+                                                                        [input_queue])
         
         self.mq_connection_handler.setup_callbacks_for_input_queue(input_queue, self.state_handler_callback, self.__process_msg_from_prev_preprocessor)
 
@@ -41,10 +41,10 @@ class DecadePreprocessor(MonitorableProcess):
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_towards_expander, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue_towards_expander, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
             for output_queue_towards_merger in self.output_queues_towards_mergers:
-                self.mq_connection_handler.send_message(output_queue_towards_merger, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+                self.mq_connection_handler.send_message(output_queue_towards_merger, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
             self.__apply_preprocessing_to_batch_and_send(body)
 
@@ -52,7 +52,7 @@ class DecadePreprocessor(MonitorableProcess):
     def __handle_eof(self, body: SystemMessage):
         logging.info(f"Received EOF_B from [ client_{body.client_id} ]")
         seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-        msg_to_send = SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send).encode_to_str()
+        msg_to_send = SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send)
         for output_queue in self.output_queues_towards_mergers:
             self.mq_connection_handler.send_message(output_queue, msg_to_send)
         self.mq_connection_handler.send_message(self.output_queue_towards_expander, msg_to_send)
@@ -60,55 +60,36 @@ class DecadePreprocessor(MonitorableProcess):
 
 
     def __apply_preprocessing_to_batch_and_send(self, body: SystemMessage):
-        books_batch = body.get_batch_iter_from_payload()
-        payload_to_send_towards_expander = ""
-        payload_to_send_towards_mergers = {output_queue: "" for output_queue in self.output_queues_towards_mergers}
-        for book in books_batch:
-            if len(book) != REQUIRED_SIZE_OF_ROW:
-                continue
+        books_batch = body.get_batch_from_payload(BOOKS_WITH_YEAR_SCHEMA)
+        batch_to_send_towards_expander = ColumnarBatch(AUTHORS_WITH_DECADE_SCHEMA)
+        batches_to_send_towards_mergers = {output_queue: ColumnarBatch(BOOKS_WITH_DECADE_SCHEMA) for output_queue in self.output_queues_towards_mergers}
+        for book in books_batch.rows():
             title = book[TITLE_IDX]
             authors = book[AUTHORS_IDX]
             year = book[YEAR_IDX]
             categories = book[CATEGORIES_IDX]
             decade = self.__extract_decade(year)
 
-            payload_to_send_towards_expander += self.__format_authors_for_expander(authors, decade)
-            selected_merger_queue = self.__select_merger_queue(title)
-            payload_to_send_towards_mergers[selected_merger_queue] += self.__format_book_for_merger(title, authors, categories, decade)
+            batch_to_send_towards_expander.append_row(authors, decade)
+            selected_merger_queue = self.merger_partitioner.select_queue(title)
+            batches_to_send_towards_mergers[selected_merger_queue].append_row(title, authors, categories, decade)
             
         seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-        if payload_to_send_towards_expander:
-            msg_for_expander = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, payload_to_send_towards_expander).encode_to_str()
+        if batch_to_send_towards_expander:
+            msg_for_expander = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, batch_to_send_towards_expander.encode())
             self.mq_connection_handler.send_message(self.output_queue_towards_expander, msg_for_expander)
             
         for output_queue in self.output_queues_towards_mergers:
-            if payload_to_send_towards_mergers[output_queue]:
-                msg_for_merger = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, payload_to_send_towards_mergers[output_queue]).encode_to_str()
+            if batches_to_send_towards_mergers[output_queue]:
+                msg_for_merger = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, batches_to_send_towards_mergers[output_queue].encode())
                 self.mq_connection_handler.send_message(output_queue, msg_for_merger)
         self.update_self_seq_number(body.client_id, seq_num_to_send)
         
 
 
-    def __format_authors_for_expander(self, authors: str, decade: int) -> str:
-        return f"\"{authors}\",{decade}" + "\n"
-
-    def __format_book_for_merger(self, title: str, authors: str, categories: str, decade: int) -> str:
-        return f"{title},\"{authors}\",\"{categories}\",{decade}" + "\n"
-
-    def __extract_decade(self, year: str) -> int:
-        year = int(year)
+    def __extract_decade(self, year: int) -> int:
         decade = year - (year % 10)
         return decade
 
-    def __select_merger_queue(self, title: str) -> str:
-        """
-        Should return the queue name where the review should be sent to.
-        It uses the hash of the title to select a queue on self.output_queue_towards_mergers
-        """
-        hash_value = hash(title)
-        queue_index = hash_value % len(self.output_queues_towards_mergers)
-        return self.output_queues_towards_mergers[queue_index]
-    
-
     def start(self):
         self.mq_connection_handler.start_consuming()
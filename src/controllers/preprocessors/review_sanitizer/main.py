@@ -1,6 +1,6 @@
 import logging
 from review_sanitizer import ReviewSanitizer
-from shared.initializers import init_log, init_configs
+from shared.initializers import init_log, init_configs, init_optional_configs
 
 def main():
     config_params = init_configs(["LOGGING_LEVEL", 
@@ -17,12 +17,15 @@ def main():
     dyn_output_queues = [config_params_dyn_output_queues[queue_name_env_key] for queue_name_env_key in dyn_output_queues_env]
 
     init_log(config_params["LOGGING_LEVEL"])
+    optional_config_params = init_optional_configs({"INPUT_EXCHANGE_OF_TITLES_FILTERS": "", "INPUT_QUEUE_OF_TITLES_FILTERS": ""})
 
     review_sanitizer = ReviewSanitizer(input_exchange=config_params["INPUT_EXCHANGE"], 
                                        input_queue=config_params["INPUT_QUEUE_OF_REVIEWS"],
                                        output_exchange=config_params["OUTPUT_EXCHANGE"],
                                        output_queues=dyn_output_queues,
-                                       controller_name=config_params["CONTROLLER_NAME"])
+                                       controller_name=config_params["CONTROLLER_NAME"],
+                                       input_exchange_of_titles_filters=optional_config_params["INPUT_EXCHANGE_OF_TITLES_FILTERS"] or None,
+                                       input_queue_of_titles_filters=optional_config_params["INPUT_QUEUE_OF_TITLES_FILTERS"] or None)
     review_sanitizer.start()
 
 
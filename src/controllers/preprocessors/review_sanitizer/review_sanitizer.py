@@ -1,10 +1,12 @@
 import io
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 import csv
 from shared import constants
+from typing import Optional
+from shared.batch_schemas import SANITIZED_REVIEWS_SCHEMA, TITLES_FILTER_SCHEMA
+from shared.bloom_filter import BloomFilter
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
 
 
 TITLE_IDX = 1
@@ -13,6 +15,11 @@ REVIEW_SUMMARY_IDX = 8
 REVIEW_TEXT_IDX = 9
 REQUIRED_SIZE_OF_ROW = 10
 
+FILTER_REVIEWS_QUEUE_IDX = 0
+FILTER_BITS_COUNT_IDX = 1
+FILTER_HASHES_COUNT_IDX = 2
+FILTER_BITS_IDX = 3
+
 
 class ReviewSanitizer(MonitorableProcess):
     def __init__(self, 
@@ -20,16 +27,32 @@ class ReviewSanitizer(MonitorableProcess):
                  input_queue: str, 
                  output_exchange: str, 
                  output_queues: list[str],
-                 controller_name: str):
+                 controller_name: str,
+                 input_exchange_of_titles_filters: Optional[str] = None,
+                 input_queue_of_titles_filters: Optional[str] = None):
+        """
+        ## Important parameter details:
+        - input_queue_of_titles_filters: When given, the Bloom filters of the titles that each merger sends on the EOF_B of a client are consumed from this queue, bound to the input_exchange_of_titles_filters exchange.
+        Once the filter of a merger arrives, the reviews routed to that merger whose title is not in the filter are dropped, as the merger would discard them anyway. The reviews received before the filter are sent as usual.
+        """
         super().__init__(controller_name)
 
         self.output_queues = output_queues
-        self.mq_connection_handler = MQConnectionHandler(output_exchange, 
-                                                         {output_queue: [output_queue] for output_queue in output_queues},
-                                                         input_exchange,
-                                                         [input_queue])
+        self.partitioner = self.create_partitioner(output_queues)
+        input_queues = [input_queue] if input_queue_of_titles_filters is None else [input_queue, input_queue_of_titles_filters]
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange, 
+                                                                        {output_queue: [output_queue] for output_queue in output_queues},
+                                                                        input_exchange,
+                                                                        input_queues,
+                                                                        aux_input_exchange_name=input_exchange_of_titles_filters)
+        # Decoded filters of the state, per client and output queue
+        self.titles_filters: dict[int, dict[str, BloomFilter]] = {}
+        # Dropped and received reviews of each client. They are only kept in memory to log them at the end of each client.
+        self.titles_filters_stats: dict[int, list[int]] = {}
         
         self.mq_connection_handler.setup_callbacks_for_input_queue(input_queue, self.state_handler_callback, self.__process_msg_from_sv)
+        if input_queue_of_titles_filters is not None:
+            self.mq_connection_handler.setup_callbacks_for_input_queue(input_queue_of_titles_filters, self.state_handler_callback, self.__process_msg_from_mergers)
 
 
     def __process_msg_from_sv(self, body: SystemMessage):
@@ -39,23 +62,53 @@ class ReviewSanitizer(MonitorableProcess):
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
             for output_queue in self.output_queues:
-                self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+                self.mq_connection_handler.send_message(output_queue, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
+            self.titles_filters.pop(body.client_id, None)
+            self.titles_filters_stats.pop(body.client_id, None)
         elif body.type == SystemMessageType.DATA:
             self.__sanitize_reviews_and_send(body)
 
 
+    def __process_msg_from_mergers(self, body: SystemMessage):
+        if body.type != SystemMessageType.DATA or self.state[body.client_id].get("reviews_completed", False):
+            return
+        for titles_filter in body.get_batch_from_payload(TITLES_FILTER_SCHEMA).rows():
+            reviews_queue = titles_filter[FILTER_REVIEWS_QUEUE_IDX]
+            if reviews_queue not in self.output_queues:
+                continue
+            logging.info(f"Received the titles filter of {reviews_queue} for [ client_{body.client_id} ]")
+            encoded_filter = [titles_filter[FILTER_BITS_COUNT_IDX], titles_filter[FILTER_HASHES_COUNT_IDX], titles_filter[FILTER_BITS_IDX]]
+            self.set_state_value(body.client_id, ["titles_filters", reviews_queue], encoded_filter)
+            self.titles_filters.setdefault(body.client_id, {})[reviews_queue] = BloomFilter.decode(encoded_filter)
+
+    def __get_titles_filters(self, client_id: int) -> dict[str, BloomFilter]:
+        if client_id not in self.titles_filters:
+            encoded_filters = self.state[client_id].get("titles_filters", {})
+            self.titles_filters[client_id] = {reviews_queue: BloomFilter.decode(encoded_filter) for reviews_queue, encoded_filter in encoded_filters.items()}
+        return self.titles_filters[client_id]
+
+
     def __handle_eof(self, body: SystemMessage):
         logging.info(f"Received EOF_R from [ client_{body.client_id} ]")
         seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-        msg_to_send = SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, seq_num_to_send).encode_to_str()
+        msg_to_send = SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, seq_num_to_send)
         for output_queue in self.output_queues:
             self.mq_connection_handler.send_message(output_queue, msg_to_send)
         self.update_self_seq_number(body.client_id, seq_num_to_send)
+        # Filters that arrive after the last review of the client are not needed
+        self.set_state_value(body.client_id, ["reviews_completed"], True)
+        self.remove_state_value(body.client_id, ["titles_filters"])
+        self.titles_filters.pop(body.client_id, None)
+        dropped_reviews, received_reviews = self.titles_filters_stats.pop(body.client_id, [0, 0])
+        if dropped_reviews:
+            logging.info(f"[TITLES FILTERS]: [ client_{body.client_id} ] {dropped_reviews} of {received_reviews} reviews were dropped as their book is unknown to its merger")
 
     def __sanitize_reviews_and_send(self, body: SystemMessage):
         reviews_batch = body.get_batch_iter_from_payload()
-        payloads_to_send_towards_mergers = {output_queue: "" for output_queue in self.output_queues}
+        batches_to_send_towards_mergers = {output_queue: ColumnarBatch(SANITIZED_REVIEWS_SCHEMA) for output_queue in self.output_queues}
+        titles_filters = self.__get_titles_filters(body.client_id)
+        stats = self.titles_filters_stats.setdefault(body.client_id, [0, 0])
         for review in reviews_batch:
             if len(review) != REQUIRED_SIZE_OF_ROW:
                 continue
@@ -68,13 +121,17 @@ class ReviewSanitizer(MonitorableProcess):
             title = self.__fix_title_format(title)
             review_text = self.__fix_review_text_format(review_text)
 
-            selected_queue = self.__select_queue(title)
-            payloads_to_send_towards_mergers[selected_queue] += self.__format_sanitized_review(title, review_score, review_text)
+            selected_queue = self.partitioner.select_queue(title)
+            stats[1] += 1
+            if selected_queue in titles_filters and title not in titles_filters[selected_queue]:
+                stats[0] += 1
+                continue
+            batches_to_send_towards_mergers[selected_queue].append_row(title, round(float(review_score)), review_text)
 
         seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
         for output_queue in self.output_queues:
-            if payloads_to_send_towards_mergers[output_queue]:
-                msg_to_send = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, payloads_to_send_towards_mergers[output_queue]).encode_to_str()
+            if batches_to_send_towards_mergers[output_queue]:
+                msg_to_send = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, batches_to_send_towards_mergers[output_queue].encode())
                 self.mq_connection_handler.send_message(output_queue, msg_to_send)
                 self.update_self_seq_number(body.client_id, seq_num_to_send)    
 
@@ -85,18 +142,5 @@ class ReviewSanitizer(MonitorableProcess):
     def __fix_review_text_format(self, review_text):
         return review_text.replace("\n", " ").replace("\r", "").replace(",", ";").replace('"', "'").replace("&quot;", "'")
 
-    def __select_queue(self, title: str) -> str:
-        """
-        Should return the queue name where the review should be sent to.
-        It uses the hash of the title to select a queue on self.output_queues
-        """
-        hash_value = hash(title)
-        queue_index = hash_value % len(self.output_queues)
-        return self.output_queues[queue_index]
-
-    def __format_sanitized_review(self, title: str, review_score: str, review_text: str) -> str:
-        return f"{title},{round(float(review_score))},{review_text}" + "\n"
-
-
     def start(self):
         self.mq_connection_handler.start_consuming()
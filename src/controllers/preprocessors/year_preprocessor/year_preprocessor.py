@@ -1,18 +1,19 @@
 import io
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 import csv
 from shared import constants
 import re
+from shared.batch_schemas import BOOKS_WITH_PUBLISHER_AND_YEAR_SCHEMA, BOOKS_WITH_YEAR_SCHEMA, SANITIZED_BOOKS_SCHEMA
+from shared.fused_pipeline import FusedPipeline
 from shared.monitorable_process import MonitorableProcess
-from shared.protocol_messages import SystemMessage, SystemMessageType
+from shared.protocol_messages import ColumnarBatch, SystemMessage, SystemMessageType
+from typing import Optional
 
 TITLE_IDX = 0
 AUTHORS_IDX = 1
 PUBLISHER_IDX = 2
 PUBLISHED_DATE_IDX = 3
 CATEGORIES_IDX = 4
-REQUIRED_SIZE_OF_ROW = 5
 
 
 class YearPreprocessor(MonitorableProcess):
@@ -22,16 +23,17 @@ class YearPreprocessor(MonitorableProcess):
                  output_exchange: str, 
                  output_queue_towards_preproc: str, 
                  output_queue_towards_filter: str,
-                 controller_name: str):
-        super().__init__(controller_name)
+                 controller_name: str,
+                 fused_pipeline: Optional[FusedPipeline] = None):
+        super().__init__(controller_name, fused_pipeline)
 
         self.output_queue_towards_preproc = output_queue_towards_preproc
         self.output_queue_towards_filter = output_queue_towards_filter
-        self.mq_connection_handler = MQConnectionHandler(output_exchange, 
-                                                         {output_queue_towards_preproc: [output_queue_towards_preproc],
-                                                          output_queue_towards_filter: [output_queue_towards_filter]},
-                                                         input_exchange,
-                                                         [input_queue])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange, 
+                                                                        {output_queue_towards_preproc: [output_queue_towards_preproc],
+                                                                         output_queue_towards_filter: [output_queue_towards_filter]},
+                                                                        input_exchange,
+                                                                        [input_queue])
         
         self.mq_connection_handler.setup_callbacks_for_input_queue(input_queue, self.state_handler_callback, self.__process_msg_from_sanitizer)
 
@@ -41,9 +43,9 @@ class YearPreprocessor(MonitorableProcess):
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_towards_preproc, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.mq_connection_handler.send_message(self.output_queue_towards_filter, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send).encode_to_str())
-            self.state[body.client_id] = {}
+            self.mq_connection_handler.send_message(self.output_queue_towards_preproc, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.mq_connection_handler.send_message(self.output_queue_towards_filter, SystemMessage(SystemMessageType.ABORT, body.client_id, self.controller_name, seq_num_to_send))
+            self.reset_client_state(body.client_id)
         else:
             self.__apply_preprocessing_to_batch_and_send(body)
 
@@ -51,19 +53,17 @@ class YearPreprocessor(MonitorableProcess):
     def __handle_eof(self, body: SystemMessage):
         logging.info(f"Received EOF_B from [ client_{body.client_id} ]")
         seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-        msg_to_send = SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send).encode_to_str()
+        msg_to_send = SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, seq_num_to_send)
         self.mq_connection_handler.send_message(self.output_queue_towards_preproc, msg_to_send)
         self.mq_connection_handler.send_message(self.output_queue_towards_filter, msg_to_send)
         self.update_self_seq_number(body.client_id, seq_num_to_send)
 
 
     def __apply_preprocessing_to_batch_and_send(self, body: SystemMessage):
-        books_batch = body.get_batch_iter_from_payload()
-        payload_to_send_towards_preproc = ""
-        payload_to_send_towards_filter = ""
-        for book in books_batch:
-            if len(book) != REQUIRED_SIZE_OF_ROW:
-                continue
+        books_batch = body.get_batch_from_payload(SANITIZED_BOOKS_SCHEMA)
+        batch_to_send_towards_preproc = ColumnarBatch(BOOKS_WITH_YEAR_SCHEMA)
+        batch_to_send_towards_filter = ColumnarBatch(BOOKS_WITH_PUBLISHER_AND_YEAR_SCHEMA)
+        for book in books_batch.rows():
             title = book[TITLE_IDX]
             authors = book[AUTHORS_IDX]
             publisher = book[PUBLISHER_IDX]
@@ -73,24 +73,17 @@ class YearPreprocessor(MonitorableProcess):
             if year is None:
                 continue
 
-            payload_to_send_towards_preproc += self.__format_book_for_preproc(title, authors, year, categories)
-            payload_to_send_towards_filter += self.__format_book_for_filter(title, authors, publisher, year, categories)
+            batch_to_send_towards_preproc.append_row(title, authors, year, categories)
+            batch_to_send_towards_filter.append_row(title, authors, publisher, year, categories)
         
-        if payload_to_send_towards_preproc and payload_to_send_towards_filter:
+        if batch_to_send_towards_preproc and batch_to_send_towards_filter:
             seq_num_to_send = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            msg_for_preproc = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, payload_to_send_towards_preproc).encode_to_str()
-            msg_for_filter = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, payload_to_send_towards_filter).encode_to_str()
+            msg_for_preproc = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, batch_to_send_towards_preproc.encode())
+            msg_for_filter = SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, seq_num_to_send, batch_to_send_towards_filter.encode())
             self.mq_connection_handler.send_message(self.output_queue_towards_preproc, msg_for_preproc)
             self.mq_connection_handler.send_message(self.output_queue_towards_filter, msg_for_filter)
             self.update_self_seq_number(body.client_id, seq_num_to_send)
 
-    def __format_book_for_preproc(self, title, authors, year, categories):
-        return f"{title},\"{authors}\",{year},\"{categories}\"" + "\n"
-    
-    def __format_book_for_filter(self, title, authors, publisher, year, categories):
-        return f"{title},\"{authors}\",{publisher},{year},\"{categories}\"" + "\n"
-
-
     def __extract_year(self, date):        
         if date:
             year_regex = re.compile('[^\d]*(\d{4})[^\d]*')
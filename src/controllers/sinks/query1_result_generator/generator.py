@@ -1,8 +1,10 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 from shared import constants
+from shared.batch_schemas import FILTERED_BOOKS_SCHEMA
+from shared.fused_pipeline import FusedPipeline
 from shared.monitorable_process import MonitorableProcess
 from shared.protocol_messages import SystemMessage, SystemMessageType
+from typing import Optional
 
 class Generator(MonitorableProcess):
     def __init__(self, 
@@ -10,14 +12,15 @@ class Generator(MonitorableProcess):
                  output_exchange_name: str, 
                  input_queue_name: str, 
                  output_queue_name: str,
-                 controller_name: str):
-        super().__init__(controller_name)
+                 controller_name: str,
+                 fused_pipeline: Optional[FusedPipeline] = None):
+        super().__init__(controller_name, fused_pipeline)
         self.output_queue = output_queue_name
         self.response_payload = constants.PAYLOAD_HEADER_Q1
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=output_exchange_name, 
-                                                         output_queues_to_bind={self.output_queue: [self.output_queue]}, 
-                                                         input_exchange_name=input_exchange_name, 
-                                                         input_queues_to_recv_from=[input_queue_name])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=output_exchange_name, 
+                                                                        output_queues_to_bind={self.output_queue: [self.output_queue]}, 
+                                                                        input_exchange_name=input_exchange_name, 
+                                                                        input_queues_to_recv_from=[input_queue_name])
         self.mq_connection_handler.setup_callbacks_for_input_queue(input_queue_name, self.state_handler_callback, self.__get_results)
         
     def start(self):
@@ -27,15 +30,16 @@ class Generator(MonitorableProcess):
         if body.type == SystemMessageType.EOF_B:
             logging.info(f"Received EOF from [ client_{body.client_id} ]")
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, next_seq_num).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, next_seq_num))
             self.update_self_seq_number(body.client_id, next_seq_num)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
-            self.state[body.client_id] = {}  
+            self.reset_client_state(body.client_id)
         else: 
-            self.response_payload += body.payload
+            for title, authors, publisher, year in body.get_batch_from_payload(FILTERED_BOOKS_SCHEMA).rows():
+                self.response_payload += f"{title},\"{authors}\",{publisher},{year}\n"
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload))
             self.update_self_seq_number(body.client_id, next_seq_num)
             self.response_payload = constants.PAYLOAD_HEADER_Q1
         
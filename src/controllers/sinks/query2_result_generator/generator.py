@@ -1,6 +1,6 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 from shared import constants
+from shared.batch_schemas import AUTHOR_DECADES_COUNT_SCHEMA
 from shared.monitorable_process import MonitorableProcess
 from shared.protocol_messages import SystemMessage, SystemMessageType
 
@@ -23,30 +23,30 @@ class Generator(MonitorableProcess):
         self.mq_connection_handler = None
         
     def start(self):
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange_name, 
-                                                         output_queues_to_bind={self.output_queue_name: [self.output_queue_name]}, 
-                                                         input_exchange_name=self.input_exchange_name, 
-                                                         input_queues_to_recv_from=[self.input_queue_name])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange_name, 
+                                                                        output_queues_to_bind={self.output_queue_name: [self.output_queue_name]}, 
+                                                                        input_exchange_name=self.input_exchange_name, 
+                                                                        input_queues_to_recv_from=[self.input_queue_name])
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue_name, self.state_handler_callback, self.__get_results)
         self.mq_connection_handler.start_consuming()
         
     def __get_results(self, body: SystemMessage):
         if body.type == SystemMessageType.EOF_B:
-            client_eofs_received = self.state.get(body.client_id, {}).get("eofs_received", 0) + 1
-            self.state[body.client_id].update({"eofs_received": client_eofs_received})
+            client_eofs_received = self.increment_state_value(body.client_id, ["eofs_received"])
             if int(client_eofs_received) == int(self.filters_quantity):
                 logging.info(f"Received all EOFs from [ client_{body.client_id} ].")
                 next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-                self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, next_seq_num).encode_to_str())
+                self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.EOF_B, body.client_id, self.controller_name, next_seq_num))
                 self.update_self_seq_number(body.client_id, next_seq_num)
-                self.state[body.client_id].update({"eofs_received": 0})
+                self.set_state_value(body.client_id, ["eofs_received"], 0)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
-            self.state[body.client_id] = {}  
+            self.reset_client_state(body.client_id)
         else:
-            self.response_payload += body.payload
+            for author, decades in body.get_batch_from_payload(AUTHOR_DECADES_COUNT_SCHEMA).rows():
+                self.response_payload += f"{author},{decades}\n"
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue_name, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload))
             self.update_self_seq_number(body.client_id, next_seq_num)
             self.response_payload = constants.PAYLOAD_HEADER_Q2
 
@@ -1,8 +1,8 @@
-from shared.mq_connection_handler import MQConnectionHandler
 from shared import constants
 import logging
 import csv
 import io
+from shared.batch_schemas import BOOKS_REVIEWS_COUNT_SCHEMA
 from shared.monitorable_process import MonitorableProcess
 from shared.protocol_messages import SystemMessage, SystemMessageType
 
@@ -19,10 +19,10 @@ class Generator(MonitorableProcess):
         self.output_exchange = output_exchange
         self.input_queue = input_queue
         self.output_queue = output_queue
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange, 
-                                                         output_queues_to_bind={self.output_queue: self.output_queue},
-                                                         input_exchange_name=self.input_exchange,
-                                                         input_queues_to_recv_from=[self.input_queue])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange, 
+                                                                        output_queues_to_bind={self.output_queue: self.output_queue},
+                                                                        input_exchange_name=self.input_exchange,
+                                                                        input_queues_to_recv_from=[self.input_queue])
         self.response_payload = constants.PAYLOAD_HEADER_Q3
         
     def start(self):
@@ -36,14 +36,15 @@ class Generator(MonitorableProcess):
         if body.type == SystemMessageType.EOF_R:
             logging.info(f"Received EOF_R from [ client_{body.client_id} ]")
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num))
             self.update_self_seq_number(body.client_id, next_seq_num)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
-            self.state[body.client_id] = {}  
+            self.reset_client_state(body.client_id)
         else:
-            self.response_payload += body.payload
+            for title, reviews_count, authors in body.get_batch_from_payload(BOOKS_REVIEWS_COUNT_SCHEMA).rows():
+                self.response_payload += f"{title},{reviews_count},\"{authors}\"\n"
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload))
             self.update_self_seq_number(body.client_id, next_seq_num)
             self.response_payload = constants.PAYLOAD_HEADER_Q3
\ No newline at end of file
@@ -1,6 +1,6 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 from shared import constants
+from shared.batch_schemas import BOOKS_AVG_SCORE_SCHEMA
 from shared.monitorable_process import MonitorableProcess
 from shared.protocol_messages import SystemMessage, SystemMessageType
 
@@ -20,10 +20,10 @@ class Generator(MonitorableProcess):
         self.input_queue = input_queue
         self.output_queue = output_queue
         self.response_payload = constants.PAYLOAD_HEADER_Q4
-        self.mq_connection_handler = MQConnectionHandler(output_exchange_name=self.output_exchange, 
-                                                         output_queues_to_bind={self.output_queue: [self.output_queue]},
-                                                         input_exchange_name=self.input_exchange,
-                                                         input_queues_to_recv_from=[self.input_queue])
+        self.mq_connection_handler = self.create_mq_connection_handler(output_exchange_name=self.output_exchange, 
+                                                                        output_queues_to_bind={self.output_queue: [self.output_queue]},
+                                                                        input_exchange_name=self.input_exchange,
+                                                                        input_queues_to_recv_from=[self.input_queue])
         
     def start(self):
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue, self.state_handler_callback, self.__generate)
@@ -31,23 +31,23 @@ class Generator(MonitorableProcess):
         
     def __generate(self, body: SystemMessage):
         """
-        The body is a csv list with the following: "[(title,review_score)]" 
+        The body is a columnar batch with the following columns: title, average score
         The generator should send the result to the output queue.
         """
         if body.type == SystemMessageType.EOF_R:
             logging.info(f"Received EOF_R from [ client_{body.client_id} ]")
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num))
             self.update_self_seq_number(body.client_id, next_seq_num)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
-            self.state[body.client_id] = {}  
+            self.reset_client_state(body.client_id)
         else:
-            books = eval(body.payload.replace("\"",""))
-            for book in books:
+            books = body.get_batch_from_payload(BOOKS_AVG_SCORE_SCHEMA)
+            for book in books.rows():
                 self.response_payload += f"{book[TITLE_IDX]},{book[AVG_SCORE_IDX]}" + "\n"
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload))
             self.update_self_seq_number(body.client_id, next_seq_num)
             self.response_payload = constants.PAYLOAD_HEADER_Q4
 
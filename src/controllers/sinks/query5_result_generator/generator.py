@@ -1,6 +1,6 @@
-from shared.mq_connection_handler import MQConnectionHandler
 import logging
 from shared import constants
+from shared.batch_schemas import BOOKS_AVG_POLARITY_SCHEMA
 from shared.monitorable_process import MonitorableProcess
 from shared.protocol_messages import SystemMessage, SystemMessageType
 
@@ -17,7 +17,7 @@ class Generator(MonitorableProcess):
         super().__init__(controller_name)
         self.output_queue = output_queue_name
         self.response_payload = constants.PAYLOAD_HEADER_Q5
-        self.mq_connection_handler = MQConnectionHandler(
+        self.mq_connection_handler = self.create_mq_connection_handler(
             output_exchange_name=output_exchange_name, 
             output_queues_to_bind={output_queue_name: [output_queue_name]}, 
             input_exchange_name=input_exchange_name, 
@@ -30,15 +30,16 @@ class Generator(MonitorableProcess):
         if body.type == SystemMessageType.EOF_R:
             logging.info(f"Received EOF_R from [ client_{body.client_id} ]")
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.EOF_R, body.client_id, self.controller_name, next_seq_num))
             self.update_self_seq_number(body.client_id, next_seq_num)
         elif body.type == SystemMessageType.ABORT:
             logging.info(f"[ABORT RECEIVED]: client: {body.client_id}")
-            self.state[body.client_id] = {}  
+            self.reset_client_state(body.client_id)
         else:
-            self.response_payload += body.payload
+            for title, avg_polarity in body.get_batch_from_payload(BOOKS_AVG_POLARITY_SCHEMA).rows():
+                self.response_payload += f"{title},{avg_polarity}\n"
             next_seq_num = self.get_seq_num_to_send(body.client_id, self.controller_name)
-            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload).encode_to_str())
+            self.mq_connection_handler.send_message(self.output_queue, SystemMessage(SystemMessageType.DATA, body.client_id, self.controller_name, next_seq_num, self.response_payload))
             self.update_self_seq_number(body.client_id, next_seq_num)
             self.response_payload = constants.PAYLOAD_HEADER_Q5
 
@@ -1,11 +1,12 @@
 import logging
-from shared.initializers import init_log, init_configs
+from shared.initializers import init_log, init_configs, init_optional_configs
 from server import Server
 
 
 def main():
     config_params = init_configs(["LOGGING_LEVEL", "SERVER_PORT", "INPUT_EXCHANGE_OF_QUERY_RESULTS", "INPUT_EXCHANGE_OF_MERGERS_CONFIRMS","INPUT_QUEUE_OF_QUERY_RESULTS", "INPUT_QUEUE_OF_MERGERS_CONFIRMS", "OUTPUT_EXCHANGE_OF_DATA", "OUTPUT_QUEUE_OF_REVIEWS", "OUTPUT_QUEUE_OF_BOOKS", "MERGERS_QUANTITY"])
     init_log(config_params["LOGGING_LEVEL"])
+    optional_config_params = init_optional_configs({"CONCURRENT_UPLOADS": "false", "PUBLISHING_CHANNELS": "4", "UPLOAD_WINDOW": "0", "MAX_QUEUED_MSGS": "0"})
 
     server = Server(server_port=int(config_params["SERVER_PORT"]),
                     input_exchange_of_query_results=config_params["INPUT_EXCHANGE_OF_QUERY_RESULTS"],
@@ -15,7 +16,11 @@ def main():
                     output_exchange_of_data=config_params["OUTPUT_EXCHANGE_OF_DATA"],
                     output_queue_of_reviews=config_params["OUTPUT_QUEUE_OF_REVIEWS"],
                     output_queue_of_books=config_params["OUTPUT_QUEUE_OF_BOOKS"],
-                    mergers_quantity=int(config_params["MERGERS_QUANTITY"]))
+                    mergers_quantity=int(config_params["MERGERS_QUANTITY"]),
+                    concurrent_uploads=optional_config_params["CONCURRENT_UPLOADS"].lower() == "true",
+                    publishing_channels=int(optional_config_params["PUBLISHING_CHANNELS"]),
+                    upload_window=int(optional_config_params["UPLOAD_WINDOW"]),
+                    max_queued_msgs=int(optional_config_params["MAX_QUEUED_MSGS"]))
     server.run()
     
 
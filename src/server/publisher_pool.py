@@ -0,0 +1,43 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from shared.mq_connection_handler import MQConnectionHandler
+from shared.protocol_messages import SystemMessage
+
+
+class PublisherPool:
+    def __init__(self, size: int, output_exchange_name: str, output_queues_to_bind: dict[str, list[str]]):
+        """
+        Fixed pool of broker channels shared by every client connection of the server. Each thread of the pool owns its own MQConnectionHandler, as pika connections are not thread safe,
+        and publishes with broker confirms, so the event loop is never blocked by the broker.
+
+        A publish only returns once the message is confirmed, so the messages of a client that awaits each publish before the next one keep their order even if they go through different channels.
+        """
+        self.output_exchange_name = output_exchange_name
+        self.output_queues_to_bind = output_queues_to_bind
+        self.handlers: list[MQConnectionHandler] = []
+        self.handlers_lock = threading.Lock()
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, size), thread_name_prefix="publisher", initializer=self.__create_handler)
+
+    def __create_handler(self):
+        self.local.handler = MQConnectionHandler(self.output_exchange_name, self.output_queues_to_bind, None, None)
+        with self.handlers_lock:
+            self.handlers.append(self.local.handler)
+
+    def __send_message(self, routing_key: str, msg_body: str | bytes | SystemMessage):
+        self.local.handler.send_message(routing_key, msg_body)
+
+    async def send_message(self, routing_key: str, msg_body: str | bytes | SystemMessage):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.__send_message, routing_key, msg_body)
+
+    def __get_queue_length(self, queue_name: str) -> int:
+        return self.local.handler.get_queue_length(queue_name)
+
+    async def get_queue_length(self, queue_name: str) -> int:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.__get_queue_length, queue_name)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for handler in self.handlers:
+            handler.close_connection()
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from typing import Optional
+from shared.protocol_messages import QueryMessage, QueryMessageType
+from shared.socket_connection_handler import SocketConnectionHandler
+
+ACK_TIMEOUT = 10
+# Time between the attempts to reach a client whose results stream broke
+RETRY_INTERVAL = 1
+# A client that cannot be reached for this long is considered disconnected, so its results are discarded
+CLIENT_DISCONNECTION_TIMEOUT = 60
+
+
+class ResultStream:
+    def __init__(self, client_id: int, host: str, port: int, pending_chunks: Optional[list[tuple[int, str]]] = None, finished: bool = False):
+        """
+        Long lived connection through which the results of a client are sent, instead of a connection per result message.
+
+        Each result message is a chunk with a seq number, which must be kept in the state of the server so that a redelivered result gets its original seq number.
+        The chunks are buffered and flushed together with a single write, and the client acknowledges the last chunk it received after each flush.
+        The flushes run outside the thread that adds the chunks, so a client that does not answer only delays its own results. The chunks that are not acknowledged yet must be kept in the state of the server,
+        so the stream can be created again with them after a restart. The client discards the ones it already received.
+        """
+        self.client_id = client_id
+        self.host = host
+        self.port = port
+        self.connection: Optional[SocketConnectionHandler] = None
+        self.pending_chunks: list[tuple[int, str]] = list(pending_chunks or [])
+        self.lock = threading.Lock()
+        self.flushing = False
+        self.finished = finished
+        self.unreachable_since: Optional[float] = None
+        self.disconnected = False
+
+    def add(self, chunk_seq_num: int, result_msg: QueryMessage):
+        with self.lock:
+            if result_msg.type == QueryMessageType.SV_FINISHED:
+                self.finished = True
+            if not self.disconnected:
+                self.pending_chunks.append((chunk_seq_num, QueryMessage.result_chunk(chunk_seq_num, result_msg).encode_to_str()))
+
+    def get_pending_chunks(self) -> list[tuple[int, str]]:
+        with self.lock:
+            return list(self.pending_chunks)
+
+    def start_flush(self) -> bool:
+        """
+        Returns True if the stream has chunks to flush and no flush in progress, in which case the caller must run flush.
+        """
+        with self.lock:
+            if self.flushing or not self.pending_chunks:
+                return False
+            self.flushing = True
+            return True
+
+    def is_done(self) -> bool:
+        with self.lock:
+            return self.finished and not self.flushing and not self.pending_chunks
+
+    def flush(self):
+        """
+        Sends the pending chunks until the client acknowledges all of them, including the ones added meanwhile. If the client cannot be reached, it is retried every RETRY_INTERVAL seconds.
+        Once the client was unreachable for CLIENT_DISCONNECTION_TIMEOUT seconds it is considered disconnected: its pending and future chunks are discarded.
+        """
+        flush_msg = QueryMessage(QueryMessageType.RESULTS_FLUSH, self.client_id).encode_to_str()
+        while True:
+            with self.lock:
+                if not self.pending_chunks:
+                    self.flushing = False
+                    return
+                chunks = [chunk for _, chunk in self.pending_chunks]
+            try:
+                if self.connection is None:
+                    self.connection = SocketConnectionHandler.connect_and_create(self.host, self.port, ACK_TIMEOUT)
+                self.connection.send_messages(chunks + [flush_msg])
+                last_acked_chunk = int(QueryMessage.decode_from_str(self.connection.read_message()).payload)
+            except (OSError, ValueError) as e:
+                self.close()
+                self.__handle_unreachable_client(e)
+                continue
+            self.unreachable_since = None
+            with self.lock:
+                self.pending_chunks = [(chunk_seq_num, chunk) for chunk_seq_num, chunk in self.pending_chunks if chunk_seq_num > last_acked_chunk]
+
+    def __handle_unreachable_client(self, error: Exception):
+        now = time.monotonic()
+        if self.unreachable_since is None:
+            self.unreachable_since = now
+        if now - self.unreachable_since < CLIENT_DISCONNECTION_TIMEOUT:
+            logging.info(f"Results stream of [ client_{self.client_id} ] broke ({error}). Retrying in {RETRY_INTERVAL} seconds")
+            time.sleep(RETRY_INTERVAL)
+            return
+        with self.lock:
+            logging.info(f"Client [ client_{self.client_id} ] was disconnected. Discarding {len(self.pending_chunks)} result chunks")
+            self.pending_chunks = []
+            self.disconnected = True
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
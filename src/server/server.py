@@ -1,15 +1,26 @@
+import asyncio
 import logging
 import multiprocessing
-from shared.monitorable_process import MonitorableProcess
+from concurrent.futures import ThreadPoolExecutor
+from shared.group_commit import GroupCommitWindow
+from shared.initializers import init_optional_configs
+from shared.monitorable_process import DEFAULT_DEDUP_WINDOW_SIZE, DEFAULT_GROUP_COMMIT_SIZE, DEFAULT_GROUP_COMMIT_TIMEOUT, DEFAULT_SYSTEM_MSG_WIRE_FORMAT, MonitorableProcess
 from shared.protocol_messages import QueryMessage, QueryMessageType, SystemMessage, SystemMessageType
-from shared.socket_connection_handler import SocketConnectionHandler
+from shared.async_socket_connection_handler import AsyncSocketConnectionHandler
+from shared.state_store import SnapshotStateStore
 import socket
 from shared.mq_connection_handler import MQConnectionHandler
 from shared import constants
 import signal
+from typing import Optional
+from publisher_pool import PublisherPool
+from result_stream import ResultStream
 
 
 AMOUNT_OF_QUERY_RESULTS = 5
+CREDIT_GRANTS_PER_WINDOW = 4
+QUEUES_LENGTH_CHECK_INTERVAL = 1
+MAX_CONCURRENT_RESULTS_FLUSHES = 32
 class Server(MonitorableProcess):
     def __init__(self,server_port, 
                  input_exchange_of_query_results, 
@@ -19,21 +30,54 @@ class Server(MonitorableProcess):
                  output_exchange_of_data, 
                  output_queue_of_reviews, 
                  output_queue_of_books,
-                 mergers_quantity):
+                 mergers_quantity,
+                 concurrent_uploads: bool = False,
+                 publishing_channels: int = 4,
+                 upload_window: int = 0,
+                 max_queued_msgs: int = 0):
+        """
+        The connections of the clients are served by an asyncio event loop in a single process, and their messages are published through a PublisherPool shared by all of them.
+        The seq numbers of the system messages are kept per client, as the controllers detect duplicates per client and producer.
+        The results of each client are sent through a ResultStream, which is flushed in the background when the group commit window of the system queues is committed.
+
+        ## Important parameter details:
+        - concurrent_uploads: When True, the clients may upload their reviews while their books are still being uploaded, as the mergers join them symmetrically. The EOF_B of a client is acknowledged right away instead of waiting for the confirmation of every merger.
+        - publishing_channels: Amount of broker channels of the PublisherPool, which bounds the amount of publishes in flight of all the clients together.
+        - upload_window: When greater than 0, the clients upload their messages without waiting for the response to each one of them. The server grants credit for upload_window messages beyond the ones it already published, and acknowledges them cumulatively with CREDIT messages.
+        The clients must be deployed with an upload window too.
+        - max_queued_msgs: When greater than 0, the output queues are checked periodically and no more credit is granted while any of them has more than max_queued_msgs messages, until they drop below half of it.
+        """
         self.controller_name_for_system_msgs = "server"
-        self.state = {}
-        self.clients_ip_mapping = {}
         self.state_file_path = f"{self.controller_name_for_system_msgs}_state.json"
-        self.seq_num_for_system_msgs = 1
+        self.state_store = SnapshotStateStore(self.state_file_path)
+        # The seq numbers of the result chunks of each client are in the state, so they must survive a restart for the clients to tell the redelivered chunks apart from the new ones
+        self.state = self.state_store.load()
+        self.seq_num_for_system_msgs_per_client: dict[int, int] = {}
+        group_commit_configs = init_optional_configs({"GROUP_COMMIT_SIZE": DEFAULT_GROUP_COMMIT_SIZE, 
+                                                      "GROUP_COMMIT_TIMEOUT": DEFAULT_GROUP_COMMIT_TIMEOUT})
+        self.group_commit = GroupCommitWindow(int(group_commit_configs["GROUP_COMMIT_SIZE"]), 
+                                              float(group_commit_configs["GROUP_COMMIT_TIMEOUT"]))
+        self.dedup_window_size = int(init_optional_configs({"DEDUP_WINDOW_SIZE": DEFAULT_DEDUP_WINDOW_SIZE})["DEDUP_WINDOW_SIZE"])
+        self.dedup_window_slides: dict[tuple[int, str], list[int]] = {}
+        self.result_streams: dict[int, ResultStream] = {}
+        self.results_flush_executor: Optional[ThreadPoolExecutor] = None
+        SystemMessage.set_wire_format(init_optional_configs({"SYSTEM_MSG_WIRE_FORMAT": DEFAULT_SYSTEM_MSG_WIRE_FORMAT})["SYSTEM_MSG_WIRE_FORMAT"])
 
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind(('', server_port))
         self.server_socket.listen()
-        self.client_sock = None
         self.server_is_running = True     
-        self.finished_with_client_data = False
         self.mq_connection_handler = None
+        self.publisher_pool = None
+        self.clients_server = None
         self.required_merger_confirms = mergers_quantity
+        self.concurrent_uploads = concurrent_uploads
+        self.publishing_channels = publishing_channels
+        self.upload_window = upload_window
+        # Grants are only sent once they extend the credit of the client by a fraction of the window, so there is not a CREDIT message per upload message
+        self.min_credit_to_grant = max(1, upload_window // CREDIT_GRANTS_PER_WINDOW)
+        self.max_queued_msgs = max_queued_msgs
+        self.downstream_ready: Optional[asyncio.Event] = None
 
         self.input_exchange_of_query_results = input_exchange_of_query_results
         self.input_exchange_of_mergers_confirms = input_exchange_of_mergers_confirms
@@ -49,44 +93,77 @@ class Server(MonitorableProcess):
         logging.info("Shutting down server")
         self.server_is_running = False
         self.server_socket.close()
-        if self.client_sock:
-            self.client_sock.close()
         if self.mq_connection_handler:
             self.mq_connection_handler.close_connection()
+
+
+    def __handle_shutdown_of_clients_server(self):
+        logging.info("Shutting down server")
+        self.server_is_running = False
+        if self.clients_server:
+            self.clients_server.close()
     
     
     def run(self):
         incoming_sys_msgs_handler_process = multiprocessing.Process(target=self.__handle_incoming_sys_queues)
         incoming_sys_msgs_handler_process.start()
         
-        self.__listen_to_clients()
+        asyncio.run(self.__listen_to_clients())
         incoming_sys_msgs_handler_process.join()
 
 
-    def __listen_to_clients(self):
-        joinable_processes = []
-        while self.server_is_running:
-            self.client_sock, _ = self.server_socket.accept()
-            if self.client_sock is not None:
-                p = multiprocessing.Process(target=self.__handle_client_incoming_connection)
-                joinable_processes.append(p)
-                p.start()
-                self.client_sock = None
+    async def __listen_to_clients(self):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.__handle_shutdown_of_clients_server)
+        self.publisher_pool = PublisherPool(self.publishing_channels,
+                                            self.output_exchange_of_data,
+                                            {self.output_queue_of_reviews: [self.output_queue_of_reviews], 
+                                             self.output_queue_of_books: [self.output_queue_of_books]})
+        self.downstream_ready = asyncio.Event()
+        self.downstream_ready.set()
+        queues_monitor = asyncio.create_task(self.__monitor_output_queues()) if self.upload_window and self.max_queued_msgs else None
+        try:
+            self.clients_server = await asyncio.start_server(self.__handle_client_incoming_connection, sock=self.server_socket)
+            async with self.clients_server:
+                await self.clients_server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if queues_monitor is not None:
+                queues_monitor.cancel()
+            self.publisher_pool.close()
 
-        for p in joinable_processes:
-            p.join()
-            joinable_processes.remove(p)
+
+    async def __monitor_output_queues(self):
+        while self.server_is_running:
+            try:
+                queued_msgs = max([await self.publisher_pool.get_queue_length(queue_name) for queue_name in (self.output_queue_of_books, self.output_queue_of_reviews)])
+            except Exception as e:
+                logging.error(f"Could not get the length of the output queues: {e}")
+                queued_msgs = 0
+            if self.downstream_ready.is_set() and queued_msgs > self.max_queued_msgs:
+                logging.info(f"[FLOW CONTROL]: {queued_msgs} messages in the output queues. Holding the credit of the clients.")
+                self.downstream_ready.clear()
+            elif not self.downstream_ready.is_set() and queued_msgs < self.max_queued_msgs // 2:
+                logging.info(f"[FLOW CONTROL]: {queued_msgs} messages in the output queues. Granting credit to the clients again.")
+                self.downstream_ready.set()
+            await asyncio.sleep(QUEUES_LENGTH_CHECK_INTERVAL)
 
 
     # ==============================================================================================================
 
 
     def __handle_incoming_sys_queues(self):
+        self.results_flush_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_RESULTS_FLUSHES, thread_name_prefix="results_flush")
+        self.__restore_result_streams()
+        for result_stream in self.result_streams.values():
+            if result_stream.start_flush():
+                self.results_flush_executor.submit(result_stream.flush)
         self.mq_connection_handler = MQConnectionHandler(None,
                                                          None,
                                                          self.input_exchange_of_query_results,
                                                          [self.input_queue_of_query_results, self.input_queue_of_mergers_confirms],
-                                                         self.input_exchange_of_mergers_confirms)
+                                                         self.input_exchange_of_mergers_confirms,
+                                                         prefetch_count=self.group_commit.max_size)
         
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue_of_query_results, self.state_handler_callback, self.__process_msgs_from_sinks)
         self.mq_connection_handler.setup_callbacks_for_input_queue(self.input_queue_of_mergers_confirms, self.state_handler_callback, self.__process_mergers_confirms)
@@ -95,16 +172,15 @@ class Server(MonitorableProcess):
 
     def __process_msgs_from_sinks(self, body: SystemMessage):
         if body.type == SystemMessageType.DATA:
-            msg_for_client = QueryMessage(QueryMessageType.SV_RESULT, body.client_id, body.payload).encode_to_str()
+            msg_for_client = QueryMessage(QueryMessageType.SV_RESULT, body.client_id, body.payload)
             self.__send_direct_msg_to_client(body.client_id, msg_for_client)
         elif body.type == SystemMessageType.EOF_B or body.type == SystemMessageType.EOF_R:
             logging.info(f"Received EOF from [ {body.controller_name} ] for [ client_{body.client_id} ]")
-            results_received_from_sinks = self.state[body.client_id].get("results_sent_to_client", 0) + 1
-            self.state[body.client_id].update({"results_sent_to_client": results_received_from_sinks})
+            results_received_from_sinks = self.increment_state_value(body.client_id, ["results_sent_to_client"])
             logging.info(f"[ {results_received_from_sinks} ] results fully sent to [ client_{body.client_id} ]")
             if results_received_from_sinks == AMOUNT_OF_QUERY_RESULTS:
                 logging.info(f"Sent all results for [ client_{body.client_id} ]. Sending SV_FINISHED message.\n")
-                msg_for_client = QueryMessage(QueryMessageType.SV_FINISHED, body.client_id).encode_to_str()
+                msg_for_client = QueryMessage(QueryMessageType.SV_FINISHED, body.client_id)
                 self.__send_direct_msg_to_client(body.client_id, msg_for_client)
 
 
@@ -113,80 +189,134 @@ class Server(MonitorableProcess):
             logging.info(f"Received EOF_B confirmation from [ {body.controller_name} ] for [ client_{body.client_id} ]")
             received_confirms = self.state[body.client_id].get("received_mergers_confirms", 1)
             logging
-            should_send_continue_msg = (received_confirms == self.required_merger_confirms)
+            should_send_continue_msg = (received_confirms == self.required_merger_confirms) and not self.concurrent_uploads
             if should_send_continue_msg:
                 logging.info(f"Sending CONTINUE message to [ client_{body.client_id} ]")
-                msg_for_client = QueryMessage(QueryMessageType.CONTINUE, body.client_id).encode_to_str()
+                msg_for_client = QueryMessage(QueryMessageType.CONTINUE, body.client_id)
                 self.__send_direct_msg_to_client(body.client_id, msg_for_client)
-            self.state[body.client_id].update({"received_mergers_confirms": received_confirms + 1})
+            self.set_state_value(body.client_id, ["received_mergers_confirms"], received_confirms + 1)
 
 
-    def __send_direct_msg_to_client(self, client_id, msg_for_client):
-        client_name = f"client_{client_id}"
-        try:
-            client_responses_sock = SocketConnectionHandler.connect_and_create(client_name, constants.CLIENT_RESULTS_PORT)
-            client_responses_sock.send_message(msg_for_client)
-        except Exception as e:
-            logging.info(f"Client [ {client_name} ] was disconnected")
+    def __send_direct_msg_to_client(self, client_id, msg_for_client: QueryMessage):
+        """
+        The message is buffered in the results stream of the client until the window is committed
+        """
+        chunk_seq_num = self.increment_state_value(client_id, ["result_chunks_sent"])
+        if client_id not in self.result_streams:
+            self.result_streams[client_id] = ResultStream(client_id, f"client_{client_id}", constants.CLIENT_RESULTS_PORT)
+        self.result_streams[client_id].add(chunk_seq_num, msg_for_client)
+
+
+    def __restore_result_streams(self):
+        """
+        Creates again the results streams with the chunks that were not acknowledged by their clients before the server stopped
+        """
+        for client_id, client_state in self.state.items():
+            pending_chunks = [(chunk_seq_num, chunk) for chunk_seq_num, chunk in client_state.get("pending_result_chunks", [])]
+            if pending_chunks:
+                finished = client_state.get("results_sent_to_client", 0) == AMOUNT_OF_QUERY_RESULTS
+                self.result_streams[client_id] = ResultStream(client_id, f"client_{client_id}", constants.CLIENT_RESULTS_PORT, pending_chunks, finished)
+
+
+    def deliver_window_outputs(self):
+        """
+        The results of the window are handed to the flushes of their streams, which run in the results_flush_executor. The window is committed without waiting for them,
+        so a client that does not answer does not hold back the results of the rest. The chunks that are not acknowledged yet are kept in the state instead, to send them again after a restart.
+        """
+        for client_id, result_stream in list(self.result_streams.items()):
+            if result_stream.is_done():
+                result_stream.close()
+                del self.result_streams[client_id]
+            elif result_stream.start_flush():
+                self.results_flush_executor.submit(result_stream.flush)
+            pending_chunks = [list(chunk) for chunk in result_stream.get_pending_chunks()]
+            if self.state.get(client_id, {}).get("pending_result_chunks", []) != pending_chunks:
+                self.set_state_value(client_id, ["pending_result_chunks"], pending_chunks)
+                self.group_commit.has_state_changes = True
     
     # ==============================================================================================================
 
    
 
-    def __handle_client_incoming_connection(self):
-        output_queues_handler = MQConnectionHandler(self.output_exchange_of_data,
-                                                    {self.output_queue_of_reviews: [self.output_queue_of_reviews], 
-                                                     self.output_queue_of_books: [self.output_queue_of_books]},
-                                                    None,
-                                                    None)
+    async def __handle_client_incoming_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection_handler = AsyncSocketConnectionHandler(reader, writer)
         try:
-            connection_handler = SocketConnectionHandler.create_from_socket(self.client_sock)
-            self.clients_ip_mapping[connection_handler.host] = None
-            self.__handle_client_msgs(connection_handler, output_queues_handler)
+            await self.__handle_client_msgs(connection_handler)
         except Exception as e:
             logging.error("Error handling client connection: {}".format(str(e)))
         finally:
-            connection_handler.close()
-            output_queues_handler.close_connection()
-            self.client_sock.close()
+            await connection_handler.close()
+
+
+    async def __grant_credit(self, client_connection_handler: AsyncSocketConnectionHandler, client_id: int, acked_msgs: int, granted_msgs: int, is_eof: bool) -> int:
+        """
+        Acknowledges the messages of the client published so far and extends its credit up to upload_window messages beyond them, unless the output queues are backed up. Returns the granted amount of messages.
+        A client that used all its credit while the output queues are backed up waits here until they drain, as it cannot send anything else.
+        """
+        if acked_msgs == granted_msgs and not self.downstream_ready.is_set():
+            logging.info(f"[FLOW CONTROL]: [ client_{client_id} ] used all its credit. Waiting for the output queues to drain.")
+            await self.downstream_ready.wait()
+        new_granted_msgs = acked_msgs + self.upload_window if self.downstream_ready.is_set() else granted_msgs
+        # The EOFs are always acknowledged, as the client waits for every message to be acknowledged before finishing
+        if is_eof or new_granted_msgs - granted_msgs >= self.min_credit_to_grant:
+            await client_connection_handler.send_message(QueryMessage.credit(client_id, acked_msgs, new_granted_msgs).encode_to_str())
+            return new_granted_msgs
+        return granted_msgs
+
+
+    def __next_seq_num_for_system_msgs(self, client_id: int) -> int:
+        seq_num = self.seq_num_for_system_msgs_per_client.get(client_id, 0) + 1
+        self.seq_num_for_system_msgs_per_client[client_id] = seq_num
+        return seq_num
             
             
-    def __handle_client_msgs(self, 
-                             client_connection_handler: SocketConnectionHandler, 
-                             output_queues_handler: MQConnectionHandler):
+    async def __handle_client_msgs(self, client_connection_handler: AsyncSocketConnectionHandler):
+        # The id of the client is only known once its first message is received
+        client_id = None
+        finished_with_client_data = False
         try:           
-            self.finished_with_client_data = False
-            while not self.finished_with_client_data:
-                client_msg = QueryMessage.decode_from_str(client_connection_handler.read_message())
-                self.clients_ip_mapping[client_connection_handler.host] = client_msg.client_id
+            received_eof_of_books = False
+            received_eof_of_reviews = False
+            received_msgs = 0
+            granted_msgs = self.upload_window
+            if self.upload_window:
+                await client_connection_handler.send_message(QueryMessage.credit(0, received_msgs, granted_msgs).encode_to_str())
+            while not finished_with_client_data:
+                client_msg = QueryMessage.decode_from_str(await client_connection_handler.read_message())
+                client_id = client_msg.client_id
+                received_msgs += 1
+                seq_num_for_system_msg = self.__next_seq_num_for_system_msgs(client_msg.client_id)
                 response_for_client = QueryMessage(QueryMessageType.DATA_ACK, client_msg.client_id).encode_to_str()
                 if client_msg.type == QueryMessageType.EOF_B:
-                    response_for_client = QueryMessage(QueryMessageType.WAIT_FOR_SV, client_msg.client_id).encode_to_str()
-                    sys_msg = SystemMessage(SystemMessageType.EOF_B, client_msg.client_id, self.controller_name_for_system_msgs, self.seq_num_for_system_msgs).encode_to_str()
-                    output_queues_handler.send_message(self.output_queue_of_books, sys_msg)
-                    client_connection_handler.send_message(response_for_client)
+                    if not self.concurrent_uploads:
+                        response_for_client = QueryMessage(QueryMessageType.WAIT_FOR_SV, client_msg.client_id).encode_to_str()
+                    sys_msg = SystemMessage(SystemMessageType.EOF_B, client_msg.client_id, self.controller_name_for_system_msgs, seq_num_for_system_msg)
+                    await self.publisher_pool.send_message(self.output_queue_of_books, sys_msg)
+                    received_eof_of_books = True
+                    finished_with_client_data = received_eof_of_reviews
                 elif client_msg.type == QueryMessageType.EOF_R:
-                    sys_msg = SystemMessage(SystemMessageType.EOF_R, client_msg.client_id, self.controller_name_for_system_msgs, self.seq_num_for_system_msgs).encode_to_str()
-                    output_queues_handler.send_message(self.output_queue_of_reviews, sys_msg)
-                    client_connection_handler.send_message(response_for_client)
-                    self.finished_with_client_data = True
+                    sys_msg = SystemMessage(SystemMessageType.EOF_R, client_msg.client_id, self.controller_name_for_system_msgs, seq_num_for_system_msg)
+                    await self.publisher_pool.send_message(self.output_queue_of_reviews, sys_msg)
+                    received_eof_of_reviews = True
+                    finished_with_client_data = received_eof_of_books
                 elif client_msg.type == QueryMessageType.DATA_B:
-                    sys_msg = SystemMessage(SystemMessageType.DATA, client_msg.client_id, self.controller_name_for_system_msgs, self.seq_num_for_system_msgs, client_msg.payload).encode_to_str()
-                    output_queues_handler.send_message(self.output_queue_of_books, sys_msg)
-                    client_connection_handler.send_message(response_for_client)
+                    sys_msg = SystemMessage(SystemMessageType.DATA, client_msg.client_id, self.controller_name_for_system_msgs, seq_num_for_system_msg, client_msg.payload)
+                    await self.publisher_pool.send_message(self.output_queue_of_books, sys_msg)
                 elif client_msg.type == QueryMessageType.DATA_R:
-                    sys_msg = SystemMessage(SystemMessageType.DATA, client_msg.client_id, self.controller_name_for_system_msgs, self.seq_num_for_system_msgs, client_msg.payload).encode_to_str()
-                    output_queues_handler.send_message(self.output_queue_of_reviews, sys_msg)
-                    client_connection_handler.send_message(response_for_client)
+                    sys_msg = SystemMessage(SystemMessageType.DATA, client_msg.client_id, self.controller_name_for_system_msgs, seq_num_for_system_msg, client_msg.payload)
+                    await self.publisher_pool.send_message(self.output_queue_of_reviews, sys_msg)
 
-                self.seq_num_for_system_msgs += 1
+                if self.upload_window:
+                    is_eof = client_msg.type in (QueryMessageType.EOF_B, QueryMessageType.EOF_R)
+                    granted_msgs = await self.__grant_credit(client_connection_handler, client_id, received_msgs, granted_msgs, is_eof)
+                else:
+                    await client_connection_handler.send_message(response_for_client)
         except Exception as e:
-            if self.clients_ip_mapping[client_connection_handler.host]:
-                client_id = self.clients_ip_mapping[client_connection_handler.host]
+            if client_id:
                 logging.info(f"Client disconnected: client_{client_id}") 
-                if not self.finished_with_client_data:
-                    self.seq_num_for_system_msgs += 1
-                    output_queues_handler.send_message(self.output_queue_of_books, SystemMessage(SystemMessageType.ABORT, client_id, self.controller_name_for_system_msgs, self.seq_num_for_system_msgs).encode_to_str())
-                    output_queues_handler.send_message(self.output_queue_of_reviews, SystemMessage(SystemMessageType.ABORT, client_id, self.controller_name_for_system_msgs, self.seq_num_for_system_msgs).encode_to_str())
+                if not finished_with_client_data:
+                    seq_num_for_system_msg = self.__next_seq_num_for_system_msgs(client_id)
+                    await self.publisher_pool.send_message(self.output_queue_of_books, SystemMessage(SystemMessageType.ABORT, client_id, self.controller_name_for_system_msgs, seq_num_for_system_msg))
+                    await self.publisher_pool.send_message(self.output_queue_of_reviews, SystemMessage(SystemMessageType.ABORT, client_id, self.controller_name_for_system_msgs, seq_num_for_system_msg))
 
 
@@ -0,0 +1,129 @@
+import functools
+import logging
+import threading
+from typing import Optional
+import pika
+
+
+class PublishNotConfirmedError(Exception):
+    pass
+
+
+class AsyncPublisher:
+    def __init__(self, host: str, exchange_name: str, max_publishes_in_flight: int):
+        """
+        Publishes messages through its own connection, which is driven by a background thread, keeping many publishes in flight at the same time instead of waiting for the broker confirm of each one of them.
+
+        Broker confirms are tracked by delivery tag. The owner of the publisher must call wait_for_pending_publishes before acknowledging the input messages that originated the publishes, so that an input is only acknowledged once all of its outputs are confirmed.
+
+        ## Important parameter details:
+        - max_publishes_in_flight: Amount of unconfirmed publishes after which publish blocks until the broker confirms some of them.
+        """
+        self.exchange_name = exchange_name
+        self.max_publishes_in_flight = max(1, max_publishes_in_flight)
+        self.condition = threading.Condition()
+        self.pending_publishes = 0
+        self.unconfirmed_delivery_tags: set[int] = set()
+        self.last_delivery_tag = 0
+        self.error: Optional[str] = None
+        self.closing = False
+
+        self.channel = None
+        self.channel_ready = threading.Event()
+        self.connection = pika.SelectConnection(pika.ConnectionParameters(host=host, heartbeat=3600),
+                                                on_open_callback=self.__on_connection_open,
+                                                on_open_error_callback=self.__on_connection_open_error,
+                                                on_close_callback=self.__on_connection_closed)
+        self.ioloop_thread = threading.Thread(target=self.connection.ioloop.start, daemon=True)
+        self.ioloop_thread.start()
+        self.channel_ready.wait()
+        self.__raise_if_failed()
+
+
+    # ==============================================================================================================
+    # The following callbacks run in the ioloop thread
+
+
+    def __on_connection_open(self, connection):
+        connection.channel(on_open_callback=self.__on_channel_open)
+
+    def __on_connection_open_error(self, connection, error):
+        self.__fail(f"Could not open the publishing connection: {error}")
+        self.channel_ready.set()
+        connection.ioloop.stop()
+
+    def __on_connection_closed(self, connection, reason):
+        # Any publish after the connection closed would never be confirmed, so the publisher fails even if it was idle, waking up the owner if it was waiting for the channel or a confirm
+        if self.closing:
+            with self.condition:
+                self.error = self.error or f"Publishing connection closed: {reason}"
+                self.condition.notify_all()
+        else:
+            self.__fail(f"Publishing connection closed with {self.pending_publishes} unconfirmed publishes: {reason}")
+        self.channel_ready.set()
+        connection.ioloop.stop()
+
+    def __on_channel_open(self, channel):
+        self.channel = channel
+        self.channel.add_on_return_callback(self.__on_message_returned)
+        self.channel.confirm_delivery(ack_nack_callback=self.__on_delivery_confirmation, callback=lambda _: self.channel_ready.set())
+
+    def __on_delivery_confirmation(self, frame):
+        delivery_tag = frame.method.delivery_tag
+        multiple = frame.method.multiple
+        if multiple:
+            confirmed_delivery_tags = {tag for tag in self.unconfirmed_delivery_tags if tag <= delivery_tag}
+        else:
+            confirmed_delivery_tags = {delivery_tag} & self.unconfirmed_delivery_tags
+        self.unconfirmed_delivery_tags -= confirmed_delivery_tags
+
+        with self.condition:
+            if isinstance(frame.method, pika.spec.Basic.Nack):
+                self.error = f"Broker rejected the publishes up to delivery tag {delivery_tag}"
+            self.pending_publishes -= len(confirmed_delivery_tags)
+            self.condition.notify_all()
+
+    def __on_message_returned(self, channel, method, properties, body):
+        self.__fail(f"Message returned by the broker as unroutable. Routing key: {method.routing_key}")
+
+    def __publish(self, routing_key: str, msg_body: str | bytes):
+        self.channel.basic_publish(exchange=self.exchange_name, routing_key=routing_key, body=msg_body, properties=pika.BasicProperties(delivery_mode=pika.DeliveryMode.Persistent), mandatory=True)
+        self.last_delivery_tag += 1
+        self.unconfirmed_delivery_tags.add(self.last_delivery_tag)
+
+
+    # ==============================================================================================================
+
+
+    def publish(self, routing_key: str, msg_body: str | bytes):
+        with self.condition:
+            while self.pending_publishes >= self.max_publishes_in_flight and self.error is None:
+                self.condition.wait()
+            self.__raise_if_failed()
+            self.pending_publishes += 1
+        self.connection.ioloop.add_callback_threadsafe(functools.partial(self.__publish, routing_key, msg_body))
+
+    def wait_for_pending_publishes(self):
+        """
+        Blocks until the broker has confirmed every publish made so far.
+        """
+        with self.condition:
+            while self.pending_publishes > 0 and self.error is None:
+                self.condition.wait()
+            self.__raise_if_failed()
+
+    def close(self):
+        self.closing = True
+        if self.connection.is_open:
+            self.connection.ioloop.add_callback_threadsafe(self.connection.close)
+        self.ioloop_thread.join()
+
+    def __fail(self, error: str):
+        logging.error(f"[PUBLISH FAILED]: {error}")
+        with self.condition:
+            self.error = error
+            self.condition.notify_all()
+
+    def __raise_if_failed(self):
+        if self.error is not None:
+            raise PublishNotConfirmedError(self.error)
@@ -0,0 +1,39 @@
+import asyncio
+import logging
+
+class AsyncSocketConnectionHandler:
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Counterpart of SocketConnectionHandler for connections served by an asyncio event loop. The messages are framed the same way, so both ends may use either of them.
+        """
+        self._reader = reader
+        self._writer = writer
+        self.host, _ = writer.get_extra_info('peername')
+
+    async def send_message(self, message: str):
+        """
+        Sends a message to the client stream. With the length of the message in the first 4 bytes.
+        """
+        message = message.encode('utf-8')
+        self._writer.writelines([len(message).to_bytes(4, byteorder='big'), message])
+        await self._writer.drain()
+
+    async def read_message(self):
+        """
+        Reads a message from the client stream and decodes it.
+        """
+        try:
+            size_of_message = int.from_bytes(await self._reader.readexactly(4), byteorder='big')
+            message = await self._reader.readexactly(size_of_message)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logging.error(f"action: read_message_size | result: fail | error: {e}")
+            raise OSError("Socket connection broken")
+        return message.decode('utf-8')
+
+    async def close(self):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
@@ -1,13 +1,15 @@
 import os
 
 class AtomicWriter:
-    def __init__(self, path):
+    def __init__(self, path, fsync: bool = False):
         self.path = path
         self.tmp_path = path + '.tmp'
+        self.fsync = fsync
 
     def write(self, data):
         with open(self.tmp_path, 'w+') as f:
             f.write(data)
             f.flush()
-            # os.fsync(f.fileno())
+            if self.fsync:
+                os.fsync(f.fileno())
         os.rename(self.tmp_path, self.path)
\ No newline at end of file
@@ -0,0 +1,56 @@
+from shared.protocol_messages import ColumnType
+
+# Schemas of the columnar batches exchanged on each edge of the pipeline.
+# The column order must match the index constants used by the producer and the consumer of each edge.
+
+STR = ColumnType.STR
+INT = ColumnType.INT
+FLOAT = ColumnType.FLOAT
+STR_LIST = ColumnType.STR_LIST
+INT_LIST = ColumnType.INT_LIST
+
+
+# ==============================================================================================================
+# Books
+
+# title, authors, publisher, published_date, categories
+SANITIZED_BOOKS_SCHEMA = (STR, STR_LIST, STR, STR, STR_LIST)
+# title, authors, year, categories
+BOOKS_WITH_YEAR_SCHEMA = (STR, STR_LIST, INT, STR_LIST)
+# title, authors, publisher, year, categories
+BOOKS_WITH_PUBLISHER_AND_YEAR_SCHEMA = (STR, STR_LIST, STR, INT, STR_LIST)
+# title, authors, publisher, year
+FILTERED_BOOKS_SCHEMA = (STR, STR_LIST, STR, INT)
+# authors, decade
+AUTHORS_WITH_DECADE_SCHEMA = (STR_LIST, INT)
+# title, authors, categories, decade
+BOOKS_WITH_DECADE_SCHEMA = (STR, STR_LIST, STR_LIST, INT)
+# author, decade
+AUTHOR_DECADE_SCHEMA = (STR, INT)
+# author, decades count
+AUTHOR_DECADES_COUNT_SCHEMA = (STR, INT)
+
+
+# ==============================================================================================================
+# Reviews
+
+# title, score, text
+SANITIZED_REVIEWS_SCHEMA = (STR, INT, STR)
+# title, authors, score, decade
+COMPACT_REVIEWS_SCHEMA = (STR, STR_LIST, INT, INT)
+# title, categories, text
+FULL_REVIEWS_SCHEMA = (STR, STR_LIST, STR)
+# title, authors, score sum, decade, reviews count
+BOOKS_REVIEWS_SCHEMA = (STR, STR_LIST, INT, INT, INT)
+# title, reviews count, authors
+BOOKS_REVIEWS_COUNT_SCHEMA = (STR, INT, STR_LIST)
+# title, score sum, reviews count
+BOOKS_SCORES_SCHEMA = (STR, INT, INT)
+# title, average score
+BOOKS_AVG_SCORE_SCHEMA = (STR, FLOAT)
+# title, text
+REVIEWS_TEXT_SCHEMA = (STR, STR)
+# title, average polarity
+BOOKS_AVG_POLARITY_SCHEMA = (STR, FLOAT)
+# reviews queue of the merger, bits count, hashes count, bits (base64) of the filter of the titles of the merger
+TITLES_FILTER_SCHEMA = (STR, INT, INT, STR)
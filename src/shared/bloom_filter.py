@@ -0,0 +1,59 @@
+import base64
+import hashlib
+import math
+from typing import Iterable
+
+MIN_BITS = 64
+
+# A filter is encoded as [bits count, hashes count, base64 of the bits] so it can be sent in a batch and persisted with the rest of the state
+BITS_COUNT_IDX = 0
+HASHES_COUNT_IDX = 1
+BITS_IDX = 2
+
+
+class BloomFilter:
+    def __init__(self, bits_count: int, hashes_count: int, bits: bytearray | None = None):
+        """
+        Set of keys with no false negatives: a key that was added is always reported as contained, and a key that was not added is only reported as contained with the false positive rate the filter was sized for.
+        """
+        self.bits_count = bits_count
+        self.hashes_count = hashes_count
+        self.bits = bits if bits is not None else bytearray((bits_count + 7) // 8)
+
+    @classmethod
+    def with_false_positive_rate(cls, expected_keys: int, false_positive_rate: float):
+        """
+        Filter with the optimal amount of bits and hashes to hold expected_keys with the given false positive rate (e.g. about 9.6 bits per key for a rate of 0.01)
+        """
+        expected_keys = max(1, expected_keys)
+        bits_count = max(MIN_BITS, math.ceil(-expected_keys * math.log(false_positive_rate) / math.log(2) ** 2))
+        hashes_count = max(1, round(bits_count / expected_keys * math.log(2)))
+        return cls(bits_count, hashes_count)
+
+    def encode(self) -> list:
+        return [self.bits_count, self.hashes_count, base64.b64encode(self.bits).decode('ascii')]
+
+    @classmethod
+    def decode(cls, encoded_filter: list):
+        return cls(encoded_filter[BITS_COUNT_IDX], encoded_filter[HASHES_COUNT_IDX], bytearray(base64.b64decode(encoded_filter[BITS_IDX])))
+
+    def __positions(self, key: str) -> Iterable[int]:
+        # Double hashing: the positions of the key are derived from two independent 64 bit hashes
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], 'little')
+        second_hash = int.from_bytes(digest[8:], 'little') | 1
+        return ((first_hash + i * second_hash) % self.bits_count for i in range(self.hashes_count))
+
+    def add(self, key: str):
+        for position in self.__positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def add_all(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(key))
+
+    def size_in_bytes(self) -> int:
+        return len(self.bits)
@@ -0,0 +1,95 @@
+import bisect
+import logging
+
+# A dedup window is encoded as [low_watermark, seen_bitmap, skipped_ranges] so it can be persisted with the rest of the state.
+# Every seq num up to the low watermark was already seen, except the ones in the skipped ranges, and bit i of the bitmap is set if seq num low_watermark + 1 + i was seen.
+# The skipped ranges are sorted [first, last] ranges of seq nums that were not seen yet when the window slid over them.
+LOW_WATERMARK_IDX = 0
+SEEN_BITMAP_IDX = 1
+SKIPPED_RANGES_IDX = 2
+
+
+def new_dedup_window(low_watermark: int = 0) -> list:
+    return [low_watermark, 0, []]
+
+
+def get_skipped_ranges(dedup_window: list) -> list[list[int]]:
+    # Windows saved before the skipped ranges were kept have no skipped ranges
+    return dedup_window[SKIPPED_RANGES_IDX] if len(dedup_window) > SKIPPED_RANGES_IDX else []
+
+
+def find_skipped_range(skipped_ranges: list[list[int]], seq_num: int) -> int:
+    """
+    Returns the index of the skipped range that contains the seq num, or -1 if there is none
+    """
+    idx = bisect.bisect_right(skipped_ranges, seq_num, key=lambda skipped_range: skipped_range[0]) - 1
+    if idx >= 0 and skipped_ranges[idx][1] >= seq_num:
+        return idx
+    return -1
+
+
+def is_duplicate(dedup_window: list, seq_num: int) -> bool:
+    low_watermark, seen_bitmap = dedup_window[LOW_WATERMARK_IDX], dedup_window[SEEN_BITMAP_IDX]
+    if seq_num <= low_watermark:
+        return find_skipped_range(get_skipped_ranges(dedup_window), seq_num) < 0
+    return bool((seen_bitmap >> (seq_num - low_watermark - 1)) & 1)
+
+
+def mark_as_seen(dedup_window: list, seq_num: int, window_size: int) -> tuple[list, int]:
+    """
+    Returns the dedup window after marking the seq num as seen, and the amount of unseen seq nums that had to be skipped to make room for it.
+
+    The low watermark is advanced over every seq num seen in order. Seq nums that never arrive, such as the ones that the producer sent to other shards or that were consumed by another replica, would stop the low watermark forever, so once the seen seq nums span more than window_size the low watermark is moved up.
+    The older seq nums that were not seen are kept as skipped ranges, so they are still accepted if they are delivered later. A window that slides often keeps many of them, so it should span the seq nums that the producer sends to all of its consumers.
+    """
+    low_watermark, seen_bitmap = dedup_window[LOW_WATERMARK_IDX], dedup_window[SEEN_BITMAP_IDX]
+    skipped_ranges = [list(skipped_range) for skipped_range in get_skipped_ranges(dedup_window)]
+    if seq_num <= low_watermark:
+        remove_from_skipped_ranges(skipped_ranges, seq_num)
+        return [low_watermark, seen_bitmap, skipped_ranges], 0
+
+    seen_bitmap |= 1 << (seq_num - low_watermark - 1)
+
+    in_order_seq_nums = (~seen_bitmap & (seen_bitmap + 1)).bit_length() - 1
+    low_watermark += in_order_seq_nums
+    seen_bitmap >>= in_order_seq_nums
+
+    skipped_seq_nums = 0
+    overflow = seen_bitmap.bit_length() - window_size
+    if overflow > 0:
+        skipped_seq_nums = add_skipped_ranges(skipped_ranges, low_watermark, ~seen_bitmap & ((1 << overflow) - 1))
+        logging.debug(f"[DEDUP WINDOW SLID]: {skipped_seq_nums} unseen seq nums up to {low_watermark + overflow} are kept as skipped")
+        low_watermark += overflow
+        seen_bitmap >>= overflow
+        in_order_seq_nums = (~seen_bitmap & (seen_bitmap + 1)).bit_length() - 1
+        low_watermark += in_order_seq_nums
+        seen_bitmap >>= in_order_seq_nums
+
+    return [low_watermark, seen_bitmap, skipped_ranges], skipped_seq_nums
+
+
+def add_skipped_ranges(skipped_ranges: list[list[int]], low_watermark: int, unseen_bitmap: int) -> int:
+    """
+    Appends the runs of set bits of the unseen bitmap as skipped ranges, where bit i stands for seq num low_watermark + 1 + i. Returns the amount of skipped seq nums.
+    """
+    skipped_seq_nums = unseen_bitmap.bit_count()
+    while unseen_bitmap:
+        first_bit = (unseen_bitmap & -unseen_bitmap).bit_length() - 1
+        run_length = (~(unseen_bitmap >> first_bit) & ((unseen_bitmap >> first_bit) + 1)).bit_length() - 1
+        first_seq_num = low_watermark + 1 + first_bit
+        last_seq_num = first_seq_num + run_length - 1
+        if skipped_ranges and skipped_ranges[-1][1] == first_seq_num - 1:
+            skipped_ranges[-1][1] = last_seq_num
+        else:
+            skipped_ranges.append([first_seq_num, last_seq_num])
+        unseen_bitmap &= ~(((1 << run_length) - 1) << first_bit)
+    return skipped_seq_nums
+
+
+def remove_from_skipped_ranges(skipped_ranges: list[list[int]], seq_num: int):
+    idx = find_skipped_range(skipped_ranges, seq_num)
+    if idx < 0:
+        return
+    first_seq_num, last_seq_num = skipped_ranges[idx]
+    remaining_ranges = [[first, last] for first, last in ((first_seq_num, seq_num - 1), (seq_num + 1, last_seq_num)) if first <= last]
+    skipped_ranges[idx:idx + 1] = remaining_ranges
@@ -0,0 +1,147 @@
+import functools
+import logging
+from typing import Callable, Optional
+from shared.monitorable_process import MonitorableProcess
+from shared.mq_connection_handler import MQConnectionHandler
+from shared.protocol_messages import SystemMessage, SystemMessageType
+
+
+class FusedConnectionHandler:
+    def __init__(self):
+        """
+        Connection handler shared by all the stages of a FusedPipeline. It exposes the same interface as MQConnectionHandler so the stages do not need to know whether they run fused or not.
+
+        Messages sent to a queue that is consumed by another stage of the pipeline are handed off in memory, as SystemMessage objects, to the inner processor of that stage. The rest of the messages are encoded and go through the broker.
+        The flows declared by the stages are only recorded until connect is called, once every stage of the pipeline was built.
+        """
+        self.stage_processors: dict[str, Callable] = {}
+        self.input_exchange_of_queue: dict[str, str] = {}
+        self.output_exchange_of_queue: dict[str, str] = {}
+        self.binding_keys_of_queue: dict[str, list[str]] = {}
+
+        self.input_handler: Optional[MQConnectionHandler] = None
+        self.output_handlers: list[MQConnectionHandler] = []
+        self.output_handler_of_routing_key: dict[str, MQConnectionHandler] = {}
+        self.local_processor_of_routing_key: dict[str, Callable] = {}
+
+    def declare_stage_flows(self,
+                            output_exchange_name: str | None,
+                            output_queues_to_bind: dict[str,list[str]] | None,
+                            input_exchange_name: str | None,
+                            input_queues_to_recv_from: list[str] | None):
+        for queue_name in (input_queues_to_recv_from or []):
+            self.input_exchange_of_queue[queue_name] = input_exchange_name
+        for queue_name, binding_keys in (output_queues_to_bind or {}).items():
+            self.output_exchange_of_queue[queue_name] = output_exchange_name
+            self.binding_keys_of_queue[queue_name] = binding_keys
+
+    def external_input_queues(self) -> list[str]:
+        """
+        Input queues of the stages that are not fed by another stage of the pipeline
+        """
+        return [queue_name for queue_name in self.input_exchange_of_queue if queue_name not in self.output_exchange_of_queue]
+
+    def connect(self, create_mq_connection_handler: Callable[..., MQConnectionHandler]):
+        """
+        Creates the broker connections of the pipeline: one to consume from the external input queues and one per exchange that the stages publish to outside the pipeline.
+        """
+        external_input_queues = self.external_input_queues()
+        input_exchanges = {self.input_exchange_of_queue[queue_name] for queue_name in external_input_queues}
+        if len(input_exchanges) != 1:
+            raise ValueError(f"A fused pipeline must consume from exactly one input exchange. Found: {input_exchanges}")
+        self.input_handler = create_mq_connection_handler(None, None, input_exchanges.pop(), external_input_queues)
+
+        external_output_queues_per_exchange: dict[str, dict[str, list[str]]] = {}
+        for queue_name, exchange_name in self.output_exchange_of_queue.items():
+            binding_keys = self.binding_keys_of_queue[queue_name]
+            if queue_name in self.stage_processors:
+                for binding_key in binding_keys:
+                    self.local_processor_of_routing_key[binding_key] = self.stage_processors[queue_name]
+            else:
+                external_output_queues_per_exchange.setdefault(exchange_name, {})[queue_name] = binding_keys
+
+        for exchange_name, output_queues_to_bind in external_output_queues_per_exchange.items():
+            output_handler = create_mq_connection_handler(exchange_name, output_queues_to_bind, None, None)
+            self.output_handlers.append(output_handler)
+            for binding_keys in output_queues_to_bind.values():
+                for binding_key in binding_keys:
+                    self.output_handler_of_routing_key[binding_key] = output_handler
+
+    def setup_callbacks_for_input_queue(self,
+                                        queue_name: str,
+                                        main_callback: Callable,
+                                        inner_processor: Optional[Callable] = None):
+        """
+        Before connecting, it registers the inner processor of a stage. The main callback of the stage is ignored as duplicates are only filtered at the input boundary of the pipeline.
+        Once connected, it sets up the callbacks of an external input queue.
+        """
+        if self.input_handler is None:
+            self.stage_processors[queue_name] = inner_processor
+        else:
+            self.input_handler.setup_callbacks_for_input_queue(queue_name, main_callback, inner_processor)
+
+    @property
+    def channel(self):
+        return self.input_handler.channel
+
+    def start_consuming(self):
+        self.input_handler.start_consuming()
+
+    def send_message(self, routing_key: str, msg_body: str | bytes | SystemMessage):
+        """
+        A SystemMessage sent to another stage is handed off as is, so it is only encoded when it leaves the pipeline.
+        """
+        local_processor = self.local_processor_of_routing_key.get(routing_key)
+        if local_processor is None:
+            self.output_handler_of_routing_key[routing_key].send_message(routing_key, msg_body)
+            return
+        if isinstance(msg_body, SystemMessage):
+            local_processor(msg_body)
+            return
+        if isinstance(msg_body, str):
+            msg_body = msg_body.encode('utf-8')
+        local_processor(SystemMessage.decode_from_bytes(msg_body))
+
+    def wait_for_pending_publishes(self):
+        for output_handler in self.output_handlers:
+            output_handler.wait_for_pending_publishes()
+
+    def close_connection(self):
+        for output_handler in self.output_handlers:
+            output_handler.close_connection()
+        if self.input_handler is not None:
+            self.input_handler.close_connection()
+
+
+class FusedPipeline(MonitorableProcess):
+    def __init__(self, controller_name: str, stage_builders: list[Callable[["FusedPipeline"], MonitorableProcess]]):
+        """
+        Runs a chain of stateless controllers (stages) in a single process. Each stage is built by its builder with the pipeline as its fused_pipeline, so it shares the state and the connection handler of the pipeline.
+
+        Stages hand off their outputs to the next stage in memory, without going through the broker. Duplicates are only filtered at the input of the pipeline and the state of every stage, including the seq numbers that each one sends, is persisted once per group commit of the pipeline.
+        This is only valid for stages whose state is limited to their seq numbers, as an abort resets the whole client state of the pipeline once it went through all the stages.
+        """
+        super().__init__(controller_name)
+        self.mq_connection_handler = FusedConnectionHandler()
+        self.stages = [build_stage(self) for build_stage in stage_builders]
+        self.mq_connection_handler.connect(self.create_mq_connection_handler)
+        for queue_name in self.mq_connection_handler.external_input_queues():
+            stage_processor = self.mq_connection_handler.stage_processors[queue_name]
+            self.mq_connection_handler.setup_callbacks_for_input_queue(queue_name, self.state_handler_callback, functools.partial(self.__process_msg_of_pipeline, stage_processor=stage_processor))
+        logging.info(f"[FUSED PIPELINE]: stages {[stage.controller_name for stage in self.stages]} consuming from {self.mq_connection_handler.external_input_queues()}")
+
+    def create_stage_connection_handler(self,
+                                        output_exchange_name: str | None,
+                                        output_queues_to_bind: dict[str,list[str]] | None,
+                                        input_exchange_name: str | None,
+                                        input_queues_to_recv_from: list[str] | None) -> FusedConnectionHandler:
+        self.mq_connection_handler.declare_stage_flows(output_exchange_name, output_queues_to_bind, input_exchange_name, input_queues_to_recv_from)
+        return self.mq_connection_handler
+
+    def __process_msg_of_pipeline(self, body: SystemMessage, stage_processor: Callable):
+        stage_processor(body)
+        if body.type == SystemMessageType.ABORT:
+            self.reset_client_state(body.client_id)
+
+    def start(self):
+        self.mq_connection_handler.start_consuming()
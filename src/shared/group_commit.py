@@ -0,0 +1,35 @@
+from typing import Any, Optional
+
+
+class GroupCommitWindow:
+    """
+    Keeps track of the deliveries that were already applied to the in-memory state of a controller but that are still pending to be persisted and acknowledged.
+
+    A window is committed either when it reaches max_size deliveries or when max_delay seconds have passed since its first delivery, whichever happens first.
+    """
+    def __init__(self, max_size: int, max_delay: float):
+        self.max_size = max(1, max_size)
+        self.max_delay = max_delay
+        self.channel: Optional[Any] = None
+        self.last_delivery_tag: Optional[int] = None
+        self.pending_deliveries = 0
+        self.has_state_changes = False
+        self.timeout_id: Optional[Any] = None
+
+    def add(self, channel, delivery_tag: int, changed_state: bool):
+        self.channel = channel
+        self.last_delivery_tag = delivery_tag
+        self.pending_deliveries += 1
+        self.has_state_changes = self.has_state_changes or changed_state
+
+    def is_empty(self) -> bool:
+        return self.pending_deliveries == 0
+
+    def is_full(self) -> bool:
+        return self.pending_deliveries >= self.max_size
+
+    def reset(self):
+        self.last_delivery_tag = None
+        self.pending_deliveries = 0
+        self.has_state_changes = False
+        self.timeout_id = None
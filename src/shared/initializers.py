@@ -33,3 +33,12 @@ def init_configs(env_vars_to_collect: list[str]):
     except ValueError as e:
         raise ValueError("Key could not be parsed. Error: {}".format(e))
     return config_params
+
+def init_optional_configs(env_vars_with_defaults: dict[str, str]):
+    """
+    Collects optional environment variables and returns them in a dictionary
+
+    :param env_vars_with_defaults: dictionary with the environment variables to collect and the default value to use for each one if it is not set
+    :return: dictionary with the collected environment variables
+    """
+    return {env_var: os.environ.get(env_var, default) for env_var, default in env_vars_with_defaults.items()}
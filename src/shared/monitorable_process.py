@@ -6,12 +6,31 @@ from shared.socket_connection_handler import SocketConnectionHandler
 import logging
 from multiprocessing import Process
 from shared.mq_connection_handler import MQConnectionHandler
-from typing import Any, Optional, TypeAlias
-import json
-from shared.atomic_writer import AtomicWriter
+from typing import TYPE_CHECKING, Any, Optional, TypeAlias
+from shared.dedup_window import is_duplicate, mark_as_seen, new_dedup_window
+from shared.group_commit import GroupCommitWindow
+from shared.initializers import init_optional_configs
+from shared.partitioner import create_partitioner
+from shared.state_store import (ADD_TO_SET_OP, APPEND_OP, BIT_OR_OP, DELETE_OP, INCREMENT_OP, INSERT_OP, SET_OP, 
+                                apply_state_delta, create_state_store)
+
+if TYPE_CHECKING:
+    from shared.fused_pipeline import FusedPipeline
 
 
 HEALTH_CHECK_PORT = 5000
+DEFAULT_GROUP_COMMIT_SIZE = "1"
+DEFAULT_GROUP_COMMIT_TIMEOUT = "0.5"
+DEFAULT_ASYNC_PUBLISHING = "false"
+DEFAULT_MAX_PUBLISHES_IN_FLIGHT = "1000"
+DEFAULT_SYSTEM_MSG_WIRE_FORMAT = "text"
+DEFAULT_STATE_STORE = "snapshot"
+DEFAULT_STATE_FSYNC_POLICY = "never"
+DEFAULT_STATE_FSYNC_INTERVAL = "1"
+DEFAULT_STATE_SNAPSHOT_THRESHOLD = str(8 * 1024 * 1024)
+DEFAULT_PARTITIONING_MODE = "modulo"
+DEFAULT_PARTITIONING_VIRTUAL_NODES = "64"
+DEFAULT_DEDUP_WINDOW_SIZE = "256"
 
 ClientID_t: TypeAlias = int
 BufferName_t: TypeAlias = str
@@ -20,13 +39,47 @@ ControllerSeqNum_t: TypeAlias = int
 BufferContent_t: TypeAlias = dict[ControllerName_t, ControllerSeqNum_t] | Any
 
 class MonitorableProcess:
-    def __init__(self, controller_name: str):
+    def __init__(self, controller_name: str, fused_pipeline: Optional["FusedPipeline"] = None):
+        """
+        ## Important parameter details:
+        - fused_pipeline: When given, the controller runs as a stage of that pipeline. It shares the state and the connection handler of the pipeline, and has neither its own health checks nor its own group commit.
+        """
         self.controller_name = controller_name
+        self.fused_pipeline = fused_pipeline
         self.health_check_connection_handler: Optional[SocketConnectionHandler] = None
         self.mq_connection_handler: Optional[MQConnectionHandler] = None
         self.joinable_processes: list[Process] = []
+        # Forced slides of the dedup window of each (client, producer): [slides, unseen seq nums skipped]. Only kept to be logged, so they are not part of the state
+        self.dedup_window_slides: dict[tuple[int, str], list[int]] = {}
+        partitioning_configs = init_optional_configs({"PARTITIONING_MODE": DEFAULT_PARTITIONING_MODE,
+                                                      "PARTITIONING_VIRTUAL_NODES": DEFAULT_PARTITIONING_VIRTUAL_NODES})
+        self.partitioning_mode = partitioning_configs["PARTITIONING_MODE"]
+        self.partitioning_virtual_nodes = int(partitioning_configs["PARTITIONING_VIRTUAL_NODES"])
+        if fused_pipeline is not None:
+            self.state_store = fused_pipeline.state_store
+            self.state = fused_pipeline.state
+            return
         self.state_file_path = f"{controller_name}_state.json"
-        self.state: dict[ClientID_t, dict[BufferName_t, BufferContent_t]] = self.__load_state_file()
+        state_store_configs = init_optional_configs({"STATE_STORE": DEFAULT_STATE_STORE,
+                                                     "STATE_FSYNC_POLICY": DEFAULT_STATE_FSYNC_POLICY,
+                                                     "STATE_FSYNC_INTERVAL": DEFAULT_STATE_FSYNC_INTERVAL,
+                                                     "STATE_SNAPSHOT_THRESHOLD": DEFAULT_STATE_SNAPSHOT_THRESHOLD})
+        self.state_store = create_state_store(self.state_file_path,
+                                              state_store_configs["STATE_STORE"],
+                                              state_store_configs["STATE_FSYNC_POLICY"],
+                                              float(state_store_configs["STATE_FSYNC_INTERVAL"]),
+                                              int(state_store_configs["STATE_SNAPSHOT_THRESHOLD"]))
+        self.state: dict[ClientID_t, dict[BufferName_t, BufferContent_t]] = self.state_store.load()
+        group_commit_configs = init_optional_configs({"GROUP_COMMIT_SIZE": DEFAULT_GROUP_COMMIT_SIZE, 
+                                                      "GROUP_COMMIT_TIMEOUT": DEFAULT_GROUP_COMMIT_TIMEOUT})
+        self.group_commit = GroupCommitWindow(int(group_commit_configs["GROUP_COMMIT_SIZE"]), 
+                                              float(group_commit_configs["GROUP_COMMIT_TIMEOUT"]))
+        publishing_configs = init_optional_configs({"ASYNC_PUBLISHING": DEFAULT_ASYNC_PUBLISHING,
+                                                    "MAX_PUBLISHES_IN_FLIGHT": DEFAULT_MAX_PUBLISHES_IN_FLIGHT})
+        self.async_publishing = publishing_configs["ASYNC_PUBLISHING"].lower() == "true"
+        self.dedup_window_size = int(init_optional_configs({"DEDUP_WINDOW_SIZE": DEFAULT_DEDUP_WINDOW_SIZE})["DEDUP_WINDOW_SIZE"])
+        self.max_publishes_in_flight = int(publishing_configs["MAX_PUBLISHES_IN_FLIGHT"])
+        SystemMessage.set_wire_format(init_optional_configs({"SYSTEM_MSG_WIRE_FORMAT": DEFAULT_SYSTEM_MSG_WIRE_FORMAT})["SYSTEM_MSG_WIRE_FORMAT"])
         p = Process(target=self.__accept_incoming_health_checks)
         self.joinable_processes.append(p)
         p.start()
@@ -58,42 +111,126 @@ class MonitorableProcess:
             self.health_check_connection_handler.close()
             
 
-    def __load_state_file(self) -> dict:
-        try:
-            with open(self.state_file_path, 'r') as f:
-                state_json = json.load(f)
-                return {int(k): v for k, v in state_json.items()}
-        except FileNotFoundError:
-            return {}
-        
     def save_state_file(self):
-        writer = AtomicWriter(self.state_file_path)
-        writer.write(json.dumps(self.state, default=self.__serialize_sets))
+        self.state_store.commit(self.state)
+
+    def deliver_window_outputs(self):
+        """
+        Hands the outputs of the current window that do not go through the broker to their destination, right before the window is committed.
+        Any of them that could not be delivered yet must be kept in the state, as the window is acknowledged anyway.
+        """
+        pass
+
+
+    def create_mq_connection_handler(self, 
+                                     output_exchange_name: str | None, 
+                                     output_queues_to_bind: dict[str,list[str]] | None, 
+                                     input_exchange_name: str | None, 
+                                     input_queues_to_recv_from: list[str] | None,
+                                     aux_input_exchange_name: str | None = None) -> MQConnectionHandler:
+        """
+        Creates the MQConnectionHandler of the controller. The prefetch count is set to the group commit window size so that a whole window can be consumed before it is committed.
+        When async publishing is enabled, the outputs of a window are confirmed by the broker when the window is committed.
+        Stages of a fused pipeline get the connection handler of the pipeline instead.
+        """
+        if self.fused_pipeline is not None:
+            return self.fused_pipeline.create_stage_connection_handler(output_exchange_name, output_queues_to_bind, input_exchange_name, input_queues_to_recv_from)
+        return MQConnectionHandler(output_exchange_name, 
+                                   output_queues_to_bind, 
+                                   input_exchange_name, 
+                                   input_queues_to_recv_from, 
+                                   aux_input_exchange_name, 
+                                   prefetch_count=self.group_commit.max_size,
+                                   async_publishing=self.async_publishing,
+                                   max_publishes_in_flight=self.max_publishes_in_flight)
+        
+    def create_partitioner(self, output_queues: list[str]):
+        """
+        Creates the partitioner that routes keys to the given shard queues, which must be ordered by shard index, with the partitioning mode of the deployment.
+        """
+        return create_partitioner(output_queues, self.partitioning_mode, self.partitioning_virtual_nodes)
         
     def state_handler_callback(self, ch, method, properties, body, inner_processor):
         """
-        IMPORTANT: The state of any buffer apart from the latest_message_per_controller should be handled by the inner callback if needed as it is specific to each controller. This applies, for example, to the LOCAL seq number to send.
+        IMPORTANT: The state of any buffer apart from the dedup_windows should be handled by the inner callback if needed as it is specific to each controller. This applies, for example, to the LOCAL seq number to send.
 
-        The inner callback should not ack messages as it is handled here
+        The inner callback should not ack messages as it is handled here. Deliveries are grouped in a commit window: the state is persisted once per window and the whole window is acknowledged at once.
+
+        Duplicates are detected with a dedup window per producer instead of only the latest seq num received, so deliveries may arrive out of order (e.g. redeliveries or several consumers on the same queue) without being taken as duplicates.
         """
         received_msg = SystemMessage.decode_from_bytes(body)
         if received_msg.client_id not in self.state:
             self.state[received_msg.client_id] = {}
-
-        latest_seq_num_from_controller = self.state.get(received_msg.client_id, {}).get("latest_message_per_controller", {}).get(received_msg.controller_name, 0)
             
-        if received_msg.controller_seq_num <= latest_seq_num_from_controller:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+        if is_duplicate(self.__get_dedup_window(received_msg.client_id, received_msg.controller_name), received_msg.controller_seq_num):
+            changed_state = False
             if received_msg.type != SystemMessageType.ABORT:
                 logging.info(f"[DUPLICATE DETECTED]: client: {received_msg.client_id} controller: {received_msg.controller_name} seq num: {received_msg.controller_seq_num}")
         else:
             inner_processor(received_msg)
             logging.debug(f"[PROCESSED MESSAGE]: type {received_msg.type} from client {received_msg.client_id} with received seq num {received_msg.controller_seq_num}")
-            self.__update_seq_num_state(received_msg.client_id, received_msg.controller_name, received_msg.controller_seq_num)
+            self.__mark_as_seen(received_msg.client_id, received_msg.controller_name, received_msg.controller_seq_num)
+            if received_msg.type in (SystemMessageType.EOF_B, SystemMessageType.EOF_R, SystemMessageType.ABORT):
+                self.__log_dedup_window_slides(received_msg.client_id, received_msg.controller_name)
+            changed_state = True
+
+        self.group_commit.add(ch, method.delivery_tag, changed_state)
+        if self.group_commit.is_full():
+            self.__commit_group()
+        elif self.group_commit.timeout_id is None:
+            self.group_commit.timeout_id = ch.connection.call_later(self.group_commit.max_delay, self.__commit_group_on_timeout)
+
+    def __get_dedup_window(self, client_id: int, controller_name: str) -> list[int]:
+        dedup_window = self.state.get(client_id, {}).get("dedup_windows", {}).get(controller_name)
+        if dedup_window is None:
+            # States saved before the dedup windows only kept the latest seq num received from each controller
+            return new_dedup_window(self.state.get(client_id, {}).get("latest_message_per_controller", {}).get(controller_name, 0))
+        return dedup_window
+
+    def was_processed(self, client_id: int, controller_name: str, seq_num: int) -> bool:
+        """
+        Returns True if the message with the given seq num of the producer was already processed, according to the state. Useful to reconcile side stores that are committed apart from the state.
+        """
+        return is_duplicate(self.__get_dedup_window(client_id, controller_name), seq_num)
+
+    def __mark_as_seen(self, client_id: int, controller_name: str, seq_num: int):
+        dedup_window = self.__get_dedup_window(client_id, controller_name)
+        dedup_window, skipped_seq_nums = mark_as_seen(dedup_window, seq_num, self.dedup_window_size)
+        self.set_state_value(client_id, ["dedup_windows", controller_name], dedup_window)
+        if skipped_seq_nums > 0:
+            slides = self.dedup_window_slides.setdefault((client_id, controller_name), [0, 0])
+            slides[0] += 1
+            slides[1] += skipped_seq_nums
+
+    def __log_dedup_window_slides(self, client_id: int, controller_name: str):
+        """
+        The skipped seq nums are kept in the dedup window until they are delivered, so the forced slides of a producer are logged once it finishes sending for the client to tune the window size.
+        """
+        slides = self.dedup_window_slides.pop((client_id, controller_name), None)
+        if slides is not None:
+            logging.info(f"[DEDUP WINDOW SLIDES]: client: {client_id} controller: {controller_name} forced slides: {slides[0]} unseen seq nums skipped: {slides[1]} window size: {self.dedup_window_size}")
+
+    def __commit_group_on_timeout(self):
+        self.group_commit.timeout_id = None
+        self.__commit_group()
+
+    def __commit_group(self):
+        """
+        Persists the state once for all the deliveries of the current window and acknowledges them with a single multiple ack.
+        The outputs of the window must be confirmed by the broker before, so that an input is never acknowledged while any of its outputs may still be lost.
+        """
+        if self.group_commit.is_empty():
+            return
+        if self.group_commit.timeout_id is not None:
+            self.group_commit.channel.connection.remove_timeout(self.group_commit.timeout_id)
+        self.mq_connection_handler.wait_for_pending_publishes()
+        self.deliver_window_outputs()
+        if self.group_commit.has_state_changes:
             self.save_state_file()
             logging.debug(f"[STATE SAVED]: {self.state}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)    
-            logging.debug(f"[ACKNOWLEDGED]: client: {received_msg.client_id} controller: {received_msg.controller_name} seq num: {received_msg.controller_seq_num}")
+        self.group_commit.channel.basic_ack(delivery_tag=self.group_commit.last_delivery_tag, multiple=True)
+        logging.debug(f"[ACKNOWLEDGED]: {self.group_commit.pending_deliveries} deliveries up to delivery tag {self.group_commit.last_delivery_tag}")
+        self.group_commit.reset()
             
 
     def get_seq_num_to_send(self, client_id: int, controller_name: str) -> int:
@@ -104,16 +241,42 @@ class MonitorableProcess:
         self.__update_seq_num_state(client_id, self.controller_name, seq_num)
         
     def __update_seq_num_state(self, client_id, controller_name, seq_num):
-        if client_id in self.state:
-            if "latest_message_per_controller" in self.state[client_id]:
-                self.state[client_id]["latest_message_per_controller"][controller_name] = seq_num
-            else:
-                self.state[client_id]["latest_message_per_controller"] = {controller_name: seq_num}
-        else:
-            self.state[client_id] = {"latest_message_per_controller": {controller_name: seq_num}}
-            
-    def __serialize_sets(self, obj):
-        if isinstance(obj, set):
-            return list(obj)
+        self.set_state_value(client_id, ["latest_message_per_controller", controller_name], seq_num)
+
+
+    # ==============================================================================================================
+    # State mutations. Every change to the state of a client must go through these methods so that it is recorded 
+    # as a delta in the state store.
+
+
+    def set_state_value(self, client_id: int, keys: list, value: Any) -> Any:
+        return self.__apply_state_delta([SET_OP, [client_id, *keys], value])
+
+    def increment_state_value(self, client_id: int, keys: list, amount: int | float = 1) -> int | float:
+        return self.__apply_state_delta([INCREMENT_OP, [client_id, *keys], amount])
+
+    def append_to_state_list(self, client_id: int, keys: list, value: Any) -> list:
+        return self.__apply_state_delta([APPEND_OP, [client_id, *keys], value])
+
+    def insert_in_state_list(self, client_id: int, keys: list, position: int, value: Any) -> list:
+        return self.__apply_state_delta([INSERT_OP, [client_id, *keys], [position, value]])
+
+    def add_to_state_set(self, client_id: int, keys: list, value: Any) -> set:
+        return self.__apply_state_delta([ADD_TO_SET_OP, [client_id, *keys], value])
+
+    def bit_or_state_value(self, client_id: int, keys: list, bits: int) -> int:
+        return self.__apply_state_delta([BIT_OR_OP, [client_id, *keys], bits])
+
+    def remove_state_value(self, client_id: int, keys: list):
+        self.__apply_state_delta([DELETE_OP, [client_id, *keys]])
+
+    def reset_client_state(self, client_id: int):
+        if self.fused_pipeline is not None:
+            # The pipeline resets the whole client state once the abort went through all of its stages
+            return
+        self.__apply_state_delta([SET_OP, [client_id], {}])
 
-        return obj
+    def __apply_state_delta(self, delta: list) -> Any:
+        result = apply_state_delta(self.state, delta)
+        self.state_store.record(delta)
+        return result
@@ -1,6 +1,10 @@
 import functools
 from typing import Callable, Optional
 import pika
+from shared.async_publisher import AsyncPublisher
+from shared.protocol_messages import SystemMessage
+
+RABBITMQ_HOST = 'rabbitmq'
 
 class MQConnectionHandler:
     def __init__(self, 
@@ -8,7 +12,10 @@ class MQConnectionHandler:
                  output_queues_to_bind: dict[str,list[str]] | None, 
                  input_exchange_name: str | None, 
                  input_queues_to_recv_from: list[str] | None,
-                 aux_input_exchange_name: str | None = None
+                 aux_input_exchange_name: str | None = None,
+                 prefetch_count: int = 1,
+                 async_publishing: bool = False,
+                 max_publishes_in_flight: int = 1000
                  ):
         """
         Creates a connection to a RabbitMQ server and declares the necessary exchanges and queues.
@@ -20,8 +27,11 @@ class MQConnectionHandler:
         Although parameters may be None, they can only be so in the rare case in which the handler is used solely for either sending only or receiving only. (Example of usage: server process)
 
         - aux_input_exchange_name: Rare usage, thus optional. Only used when the channel must consume from an additional exchange. To be used with proper message handling as it makes the start_consuming method to consume from the related queues of both exchanges. (Example of usage: merger process)
+        - prefetch_count: Amount of unacknowledged deliveries that the broker can push to each consumer of the channel. Must be at least the size of the group commit window of the consumer, as messages are acknowledged in bulk once the window is committed.
+        - async_publishing: When enabled, messages are published through an AsyncPublisher that keeps up to max_publishes_in_flight unconfirmed publishes instead of waiting for the confirm of each publish. The consumer must call wait_for_pending_publishes before acknowledging its input messages.
         """
-        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq', heartbeat=3600))
+        self.async_publisher: Optional[AsyncPublisher] = None
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, heartbeat=3600))
         self.channel = self.connection.channel()
 
         # Notation: 
@@ -30,8 +40,11 @@ class MQConnectionHandler:
             self.__declare_output_flows(output_exchange_name, output_queues_to_bind)
         if input_exchange_name is not None:
             self.__declare_input_flows(input_exchange_name, input_queues_to_recv_from, aux_input_exchange_name)
-        self.channel.basic_qos(prefetch_count=1)
-        self.channel.confirm_delivery()
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+        if async_publishing and output_exchange_name is not None:
+            self.async_publisher = AsyncPublisher(RABBITMQ_HOST, output_exchange_name, max_publishes_in_flight)
+        else:
+            self.channel.confirm_delivery()
 
 
     def __declare_input_flows(self, 
@@ -71,14 +84,37 @@ class MQConnectionHandler:
     def start_consuming(self):
         self.channel.start_consuming()
 
-    def send_message(self, routing_key: str, msg_body: str):
+    def send_message(self, routing_key: str, msg_body: str | bytes | SystemMessage):
         """
         Sends a message with a specified routing_key to inform the output_exchange about which queues to route the message to.
+        A SystemMessage is encoded here, so the controllers that may run fused can hand their messages as objects.
         """
+        if isinstance(msg_body, SystemMessage):
+            msg_body = msg_body.encode()
+        if self.async_publisher is not None:
+            self.async_publisher.publish(routing_key, msg_body)
+            return
         self.channel.basic_publish(exchange=self.output_exchange_name, routing_key=routing_key, body=msg_body, properties=pika.BasicProperties(delivery_mode=pika.DeliveryMode.Persistent), mandatory=True)
 
 
+    def get_queue_length(self, queue_name: str) -> int:
+        """
+        Amount of messages of the queue that are ready to be delivered, without the ones that were delivered and not acknowledged yet.
+        """
+        return self.channel.queue_declare(queue=queue_name, durable=True, passive=True).method.message_count
+
+
+    def wait_for_pending_publishes(self):
+        """
+        Blocks until every message sent so far is confirmed by the broker. Publishes are already confirmed one by one when async publishing is disabled.
+        """
+        if self.async_publisher is not None:
+            self.async_publisher.wait_for_pending_publishes()
+
+
     def close_connection(self):
+        if self.async_publisher is not None:
+            self.async_publisher.close()
         self.channel.stop_consuming()
         self.connection.close()
 
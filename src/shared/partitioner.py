@@ -0,0 +1,66 @@
+import bisect
+import hashlib
+import zlib
+
+PARTITIONING_MODULO = "modulo"
+PARTITIONING_CONSISTENT = "consistent"
+
+
+def stable_hash(key: str) -> int:
+    """
+    32 bits hash of the key that, unlike the builtin hash, is the same in every process regardless of PYTHONHASHSEED.
+    """
+    return zlib.crc32(key.encode('utf-8'))
+
+
+def create_partitioner(output_queues: list[str], partitioning_mode: str, virtual_nodes_per_shard: int):
+    """
+    Creates the partitioner used to route the keys (titles, authors) to the shards of the next stage.
+    Every producer that routes to the same shards must use the same partitioning mode.
+
+    :param output_queues: queues of the shards, ordered by shard index
+    :param partitioning_mode: 'modulo' to route by the hash of the key modulo the amount of shards or 'consistent' to use a consistent hashing ring
+    :param virtual_nodes_per_shard: amount of points that each shard has on the ring when the mode is 'consistent'
+    """
+    if partitioning_mode == PARTITIONING_MODULO:
+        return ModuloPartitioner(output_queues)
+    if partitioning_mode == PARTITIONING_CONSISTENT:
+        return ConsistentHashPartitioner(output_queues, virtual_nodes_per_shard)
+    raise ValueError(f"Unknown partitioning mode: {partitioning_mode}")
+
+
+class ModuloPartitioner:
+    """
+    Routes each key to the shard at index stable_hash(key) % amount of shards. Changing the amount of shards moves almost every key to another shard.
+    """
+    def __init__(self, output_queues: list[str]):
+        self.output_queues = tuple(output_queues)
+
+    def select_queue(self, key: str) -> str:
+        return self.output_queues[stable_hash(key) % len(self.output_queues)]
+
+
+class ConsistentHashPartitioner:
+    """
+    Routes each key to the shard that owns the first point of the ring after the hash of the key.
+
+    The points of each shard only depend on its shard index, so when shards are added only the keys that land on the points of the new shards move, which is about 1/N of them, and the rest of the shards keep their keys and their state.
+    """
+    def __init__(self, output_queues: list[str], virtual_nodes_per_shard: int):
+        ring = []
+        for shard_index, output_queue in enumerate(output_queues):
+            for virtual_node in range(max(1, virtual_nodes_per_shard)):
+                ring.append((self.__ring_point(shard_index, virtual_node), output_queue))
+        ring.sort()
+        self.ring_points = [point for point, _ in ring]
+        self.ring_queues = [output_queue for _, output_queue in ring]
+
+    def __ring_point(self, shard_index: int, virtual_node: int) -> int:
+        digest = hashlib.blake2b(f"shard-{shard_index}-{virtual_node}".encode('utf-8'), digest_size=4).digest()
+        return int.from_bytes(digest, 'big')
+
+    def select_queue(self, key: str) -> str:
+        position = bisect.bisect_right(self.ring_points, stable_hash(key))
+        if position == len(self.ring_points):
+            position = 0
+        return self.ring_queues[position]
@@ -2,10 +2,23 @@ import csv
 from enum import Enum
 import io
 import logging
+import struct
+from typing import Iterator
 
 
 SEPARATOR = "<|>"
 
+WIRE_FORMAT_TEXT = "text"
+WIRE_FORMAT_BINARY = "binary"
+
+# Binary SystemMessage frame: 
+# magic (1B) | version (1B) | type (1B) | client id (4B) | seq num (8B) | controller name length (2B) | controller name | payload length (4B) | payload
+# The text format always starts with the ascii digits of the type, so the magic byte is enough to tell both formats apart.
+BINARY_MAGIC = 0x00
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("!BBBIQH")
+BINARY_PAYLOAD_LENGTH = struct.Struct("!I")
+
 class QueryMessageType(Enum):
     EOF_B = 1
     EOF_R = 2
@@ -16,6 +29,15 @@ class QueryMessageType(Enum):
     CONTINUE = 7
     SV_RESULT = 8
     SV_FINISHED = 9
+    CREDIT = 10
+    RESULT_CHUNK = 11
+    RESULTS_FLUSH = 12
+    RESULTS_ACK = 13
+
+# Payload of a CREDIT message: the amount of upload messages of the connection that the server already published and the amount of them that the client is allowed to send, both cumulative
+CREDIT_SEPARATOR = ","
+# Payload of a RESULT_CHUNK message: the seq number of the chunk in the results stream of the client and the encoded result message
+RESULT_CHUNK_SEPARATOR = ","
 
 class QueryMessage:
     def __init__(self, msg_type: Enum, client_id: int, payload: str = ""):
@@ -28,8 +50,31 @@ class QueryMessage:
     
     @classmethod
     def decode_from_str(cls, msg: str):
-        msg_type, client_id, payload = msg.split(f"{SEPARATOR}")
+        # The payload may contain another encoded message, as in the result chunks
+        msg_type, client_id, payload = msg.split(f"{SEPARATOR}", 2)
         return cls(QueryMessageType(int(msg_type)), int(client_id), payload)
+
+    @classmethod
+    def credit(cls, client_id: int, acked_msgs: int, granted_msgs: int):
+        return cls(QueryMessageType.CREDIT, client_id, f"{acked_msgs}{CREDIT_SEPARATOR}{granted_msgs}")
+
+    def get_credit(self) -> tuple[int, int]:
+        """
+        Returns the acked and granted amounts of messages of a CREDIT message
+        """
+        acked_msgs, granted_msgs = self.payload.split(CREDIT_SEPARATOR)
+        return int(acked_msgs), int(granted_msgs)
+
+    @classmethod
+    def result_chunk(cls, chunk_seq_num: int, result_msg: "QueryMessage"):
+        return cls(QueryMessageType.RESULT_CHUNK, result_msg.client_id, f"{chunk_seq_num}{RESULT_CHUNK_SEPARATOR}{result_msg.encode_to_str()}")
+
+    def get_result_chunk(self) -> tuple[int, "QueryMessage"]:
+        """
+        Returns the seq number and the result message of a RESULT_CHUNK message
+        """
+        chunk_seq_num, result_msg = self.payload.split(RESULT_CHUNK_SEPARATOR, 1)
+        return int(chunk_seq_num), QueryMessage.decode_from_str(result_msg)
     
 
 
@@ -46,26 +91,219 @@ class SystemMessageType(Enum):
     ABORT = 6
 
 class SystemMessage:
-    def __init__(self, msg_type: Enum, client_id: int, controller_name: str, controller_seq_num: int, payload: str = ""):
+    wire_format = WIRE_FORMAT_TEXT
+
+    def __init__(self, msg_type: Enum, client_id: int, controller_name: str, controller_seq_num: int, payload: str | bytes = ""):
         self.type = msg_type
         self.client_id = client_id
         self.controller_name = controller_name
         self.controller_seq_num = controller_seq_num
-        self.payload = payload
+        self._payload: str | bytes | None = payload
+        self._raw_payload: memoryview | None = None
+
+    @classmethod
+    def set_wire_format(cls, wire_format: str):
+        """
+        Sets the format used by encode. Both formats are always accepted by decode_from_bytes, so producers can be switched one at a time.
+        """
+        if wire_format not in (WIRE_FORMAT_TEXT, WIRE_FORMAT_BINARY):
+            raise ValueError(f"Unknown wire format: {wire_format}")
+        cls.wire_format = wire_format
+
+    @property
+    def payload(self) -> str:
+        """
+        The payload of a binary frame is only decoded the first time it is accessed.
+        """
+        if self._payload is None:
+            self._payload = str(self._raw_payload, 'utf-8')
+            self._raw_payload = None
+        return self._payload
+
+    @payload.setter
+    def payload(self, payload: str | bytes):
+        self._payload = payload
+        self._raw_payload = None
+
+    @property
+    def payload_view(self) -> memoryview:
+        """
+        Returns the encoded payload without decoding it.
+        """
+        if self._raw_payload is None:
+            if isinstance(self._payload, bytes):
+                return memoryview(self._payload)
+            return memoryview(self._payload.encode('utf-8'))
+        return self._raw_payload
+
+    def encode(self) -> str | bytes:
+        """
+        Binary payloads, such as columnar batches, can only travel in binary frames.
+        """
+        if SystemMessage.wire_format == WIRE_FORMAT_BINARY or isinstance(self._payload, bytes):
+            return self.encode_to_bytes()
+        return self.encode_to_str()
 
     def encode_to_str(self) -> str:
         return f"{self.type.value}{SEPARATOR}{self.client_id}{SEPARATOR}{self.controller_name}{SEPARATOR}{self.controller_seq_num}{SEPARATOR}{self.payload}"
+
+    def encode_to_bytes(self) -> bytes:
+        controller_name = self.controller_name.encode('utf-8')
+        payload = self.payload_view
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, self.type.value, self.client_id, self.controller_seq_num, len(controller_name))
+        return b"".join((header, controller_name, BINARY_PAYLOAD_LENGTH.pack(len(payload)), payload))
     
     @classmethod
     def decode_from_bytes(cls, raw_msg_body: bytes):
+        if raw_msg_body[:1] == bytes([BINARY_MAGIC]):
+            return cls.__decode_binary_frame(raw_msg_body)
+
         msg = raw_msg_body.decode()
-        msg_type, client_id, controller_name, controller_seq_num, payload = msg.split(f"{SEPARATOR}")
+        msg_type, client_id, controller_name, controller_seq_num, payload = msg.split(f"{SEPARATOR}", 4)
         
         return cls(SystemMessageType(int(msg_type)), int(client_id), controller_name, int(controller_seq_num), payload)
+
+    @classmethod
+    def __decode_binary_frame(cls, raw_msg_body: bytes):
+        frame = memoryview(raw_msg_body)
+        _, version, msg_type, client_id, controller_seq_num, controller_name_length = BINARY_HEADER.unpack_from(frame)
+        if version != BINARY_VERSION:
+            raise ValueError(f"Unsupported SystemMessage frame version: {version}")
+        offset = BINARY_HEADER.size
+        controller_name = str(frame[offset:offset + controller_name_length], 'utf-8')
+        offset += controller_name_length
+        (payload_length,) = BINARY_PAYLOAD_LENGTH.unpack_from(frame, offset)
+        offset += BINARY_PAYLOAD_LENGTH.size
+
+        msg = cls(SystemMessageType(msg_type), client_id, controller_name, controller_seq_num, None)
+        msg._raw_payload = frame[offset:offset + payload_length]
+        return msg
     
     def get_batch_iter_from_payload(self):
+        """
+        Parses a csv payload. Only used for the raw data that the clients send through the server, as the controllers exchange columnar batches.
+        """
         if self.type == SystemMessageType.DATA:
             return csv.reader(io.StringIO(self.payload), delimiter=',', quotechar='"')
         else:
             return None
-    
+
+    def get_batch_from_payload(self, schema: tuple["ColumnType", ...]):
+        if self.type == SystemMessageType.DATA:
+            return ColumnarBatch.decode(self.payload_view, schema)
+        else:
+            return None
+
+
+
+# ========================================================================================================
+
+
+
+class ColumnType(Enum):
+    STR = 1
+    INT = 2
+    FLOAT = 3
+    STR_LIST = 4
+    INT_LIST = 5
+
+# Columnar batch payload:
+# rows count (4B) | columns count (1B) | column types (1B each) | columns
+# - INT and FLOAT columns are packed as int64 and float64 values.
+# - STR columns are the lengths of the utf-8 encoded values (4B each) followed by the concatenated values.
+# - List columns are the lengths of the lists (4B each) followed by a column with the flattened elements.
+BATCH_HEADER = struct.Struct("<IB")
+STR_LENGTHS_FORMAT = "<{}I"
+FIXED_SIZE_COLUMN_FORMATS = {ColumnType.INT: "<{}q", ColumnType.FLOAT: "<{}d"}
+LIST_ELEMENTS_TYPE = {ColumnType.STR_LIST: ColumnType.STR, ColumnType.INT_LIST: ColumnType.INT}
+
+class ColumnarBatch:
+    def __init__(self, schema: tuple[ColumnType, ...], columns: list[list] | None = None):
+        """
+        A batch of rows stored column by column. The schema of each edge of the pipeline is defined in shared.batch_schemas, and the index constants of each controller refer to the columns of its schemas.
+        """
+        self.schema = schema
+        self.columns: list[list] = columns if columns is not None else [[] for _ in schema]
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def append_row(self, *values):
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def rows(self) -> Iterator[tuple]:
+        return zip(*self.columns)
+
+    def encode(self) -> bytes:
+        parts = [BATCH_HEADER.pack(len(self), len(self.schema)), bytes(column_type.value for column_type in self.schema)]
+        for column_type, column in zip(self.schema, self.columns):
+            self.__encode_column(column_type, column, parts)
+        return b"".join(parts)
+
+    @classmethod
+    def encoded_row_size(cls, schema: tuple[ColumnType, ...], row: tuple) -> int:
+        """
+        Bytes that the row takes in an encoded batch of the schema, without the header of the batch
+        """
+        return sum(cls.__encoded_value_size(column_type, value) for column_type, value in zip(schema, row))
+
+    @classmethod
+    def __encoded_value_size(cls, column_type: ColumnType, value) -> int:
+        if column_type in FIXED_SIZE_COLUMN_FORMATS:
+            return 8
+        elif column_type == ColumnType.STR:
+            return 4 + len(value.encode('utf-8'))
+        return 4 + sum(cls.__encoded_value_size(LIST_ELEMENTS_TYPE[column_type], element) for element in value)
+
+    @classmethod
+    def decode(cls, raw_batch: bytes | memoryview, schema: tuple[ColumnType, ...]):
+        raw_batch = memoryview(raw_batch)
+        rows_count, columns_count = BATCH_HEADER.unpack_from(raw_batch)
+        offset = BATCH_HEADER.size
+        received_schema = tuple(ColumnType(value) for value in raw_batch[offset:offset + columns_count])
+        if received_schema != schema:
+            raise ValueError(f"Unexpected batch schema. Expected: {schema}. Received: {received_schema}")
+        offset += columns_count
+
+        columns = []
+        for column_type in schema:
+            column, offset = cls.__decode_column(column_type, raw_batch, offset, rows_count)
+            columns.append(column)
+        return cls(schema, columns)
+
+    @classmethod
+    def __encode_column(cls, column_type: ColumnType, column: list, parts: list):
+        if column_type in FIXED_SIZE_COLUMN_FORMATS:
+            parts.append(struct.pack(FIXED_SIZE_COLUMN_FORMATS[column_type].format(len(column)), *column))
+        elif column_type == ColumnType.STR:
+            encoded_values = [value.encode('utf-8') for value in column]
+            parts.append(struct.pack(STR_LENGTHS_FORMAT.format(len(encoded_values)), *map(len, encoded_values)))
+            parts.extend(encoded_values)
+        else:
+            parts.append(struct.pack(STR_LENGTHS_FORMAT.format(len(column)), *map(len, column)))
+            cls.__encode_column(LIST_ELEMENTS_TYPE[column_type], [element for values in column for element in values], parts)
+
+    @classmethod
+    def __decode_column(cls, column_type: ColumnType, raw_batch: memoryview, offset: int, rows_count: int) -> tuple[list, int]:
+        if column_type in FIXED_SIZE_COLUMN_FORMATS:
+            column_format = struct.Struct(FIXED_SIZE_COLUMN_FORMATS[column_type].format(rows_count))
+            return list(column_format.unpack_from(raw_batch, offset)), offset + column_format.size
+
+        lengths_format = struct.Struct(STR_LENGTHS_FORMAT.format(rows_count))
+        lengths = lengths_format.unpack_from(raw_batch, offset)
+        offset += lengths_format.size
+        if column_type == ColumnType.STR:
+            column = []
+            for length in lengths:
+                column.append(str(raw_batch[offset:offset + length], 'utf-8'))
+                offset += length
+            return column, offset
+
+        elements, offset = cls.__decode_column(LIST_ELEMENTS_TYPE[column_type], raw_batch, offset, sum(lengths))
+        column = []
+        start = 0
+        for length in lengths:
+            column.append(elements[start:start + length])
+            start += length
+        return column, offset
@@ -0,0 +1,104 @@
+import math
+import random
+from typing import Iterable, Optional
+
+# KLL quantile sketch (Karnin, Lang and Liberty). The values are kept in a hierarchy of compactors: each value of level h stands for 2^h values of the stream.
+# When the sketch is full, the lowest compactor that reached its capacity is sorted and half of its values (the odd or the even ones, at random) are promoted to the next level.
+# The capacity of the compactors decays geometrically from the top level down, so the size of the sketch is O(k) no matter how many values it summarizes.
+CAPACITY_DECAY = 2 / 3
+MIN_CAPACITY = 2
+MIN_K = 8
+# Normalized rank error of a single quantile, with 99% confidence, is about this constant divided by k
+RANK_ERROR_TIMES_K = 3.3
+
+# A sketch is encoded as [k, compactors] so it can be persisted with the rest of the state
+K_IDX = 0
+COMPACTORS_IDX = 1
+
+
+class QuantileSketch:
+    def __init__(self, k: int, compactors: Optional[list[list[float]]] = None):
+        """
+        Mergeable quantile sketch: the quantiles of the union of two streams can be estimated by merging the sketches of each stream.
+        """
+        self.k = max(MIN_K, k)
+        self.compactors: list[list[float]] = [list(compactor) for compactor in compactors] if compactors else [[]]
+        self.size = sum(len(compactor) for compactor in self.compactors)
+        self.max_size = self.__max_size()
+
+    @classmethod
+    def with_rank_error(cls, rank_error: float):
+        """
+        Sketch whose estimated quantiles are within rank_error of the requested quantile (e.g. the estimated 0.9 quantile is between the exact 0.89 and 0.91 quantiles for a rank_error of 0.01)
+        """
+        return cls(math.ceil(RANK_ERROR_TIMES_K / rank_error))
+
+    def encode(self) -> list:
+        return [self.k, self.compactors]
+
+    @classmethod
+    def decode(cls, encoded_sketch: list):
+        return cls(encoded_sketch[K_IDX], encoded_sketch[COMPACTORS_IDX])
+
+    def __capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(MIN_CAPACITY, math.ceil(self.k * CAPACITY_DECAY ** depth))
+
+    def __max_size(self) -> int:
+        return sum(self.__capacity(level) for level in range(len(self.compactors)))
+
+    def count(self) -> int:
+        """
+        Number of values summarized by the sketch
+        """
+        return sum(len(compactor) << level for level, compactor in enumerate(self.compactors))
+
+    def update(self, value: float):
+        self.compactors[0].append(value)
+        self.size += 1
+        if self.size >= self.max_size:
+            self.__compress()
+
+    def update_all(self, values: Iterable[float]):
+        for value in values:
+            self.update(value)
+
+    def merge(self, other: "QuantileSketch"):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level].extend(compactor)
+        self.size = sum(len(compactor) for compactor in self.compactors)
+        self.max_size = self.__max_size()
+        self.__compress()
+
+    def __compress(self):
+        while self.size >= self.max_size:
+            for level, compactor in enumerate(self.compactors):
+                if len(compactor) >= self.__capacity(level):
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append([])
+                        self.max_size = self.__max_size()
+                    compactor.sort()
+                    # With an odd number of values, the smallest one stays in the compactor
+                    leftover = len(compactor) % 2
+                    promoted = compactor[leftover + random.getrandbits(1)::2]
+                    self.compactors[level + 1].extend(promoted)
+                    del compactor[leftover:]
+                    self.size = sum(len(compactor) for compactor in self.compactors)
+                    break
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimated value at the quantile q of the summarized values, or None if the sketch is empty
+        """
+        weighted_values = sorted((value, 1 << level) for level, compactor in enumerate(self.compactors) for value in compactor)
+        if not weighted_values:
+            return None
+        target_rank = q * sum(weight for _, weight in weighted_values)
+        rank = 0
+        for value, weight in weighted_values:
+            rank += weight
+            if rank >= target_rank:
+                return value
+        return weighted_values[-1][0]
@@ -25,15 +25,23 @@ class SocketConnectionHandler:
         """
         Sends a message to the client stream. With the lenght of the message in the first 4 bytes.
         """
-        message = message.encode('utf-8')
-        size_of_message = len(message)
-        self._stream.send(int(size_of_message).to_bytes(4, byteorder='big'))
-        self._stream.send(message)
+        self.send_messages([message])
+
+    def send_messages(self, messages: list[str]):
+        """
+        Sends several messages to the client stream with a single write, each one framed as in send_message. The headers and the messages are sent without joining them.
+        """
+        buffers = []
+        for message in messages:
+            message = message.encode('utf-8')
+            buffers.append(len(message).to_bytes(4, byteorder='big'))
+            buffers.append(message)
+        self._stream.send_buffers(buffers)
         
         
-    def read_message_raw(self):
+    def read_frame(self) -> memoryview:
         """
-        Reads a message from the client stream. Returns the raw bytes read.
+        Reads a message from the client stream. Returns a view of the bytes read, which is only valid until the next read.
         """
         try: 
             size_of_message = int.from_bytes(self._stream.recv(4), byteorder='big')
@@ -44,11 +52,18 @@ class SocketConnectionHandler:
         return message
 
 
+    def read_message_raw(self):
+        """
+        Reads a message from the client stream. Returns the raw bytes read.
+        """
+        return bytes(self.read_frame())
+
+
     def read_message(self):
         """
         Reads a message from the client stream and decodes it.
         """
-        return self.read_message_raw().decode('utf-8')
+        return str(self.read_frame(), 'utf-8')
     
     
 
@@ -57,13 +72,8 @@ class SocketConnectionHandler:
         """
         Reads a message from the client stream.
         """
-        try: 
-            size_of_message = int.from_bytes(self._stream.recv(4), byteorder='big')
-            message = self._stream.recv(size_of_message).decode('utf-8')
-            size_in_lines = message.count("\n")
-        except OSError as e:
-            logging.error(f"action: read_message_size | result: fail | error: {e}")
-            raise OSError("Socket connection broken")
+        message = self.read_message()
+        size_in_lines = message.count("\n")
         return message, size_in_lines
         
         
@@ -0,0 +1,285 @@
+import glob
+import json
+import logging
+import os
+import time
+from multiprocessing import Process
+from typing import Any, Optional
+
+from shared.atomic_writer import AtomicWriter
+
+
+STATE_STORE_SNAPSHOT = "snapshot"
+STATE_STORE_LOG = "log"
+
+FSYNC_POLICY_ALWAYS = "always"
+FSYNC_POLICY_INTERVAL = "interval"
+FSYNC_POLICY_NEVER = "never"
+
+# Delta operations. A delta is encoded as [op, path, value] where path is the list of keys
+# (or list indexes) to follow from the root of the state, starting with the client id.
+SET_OP = "set"
+INCREMENT_OP = "incr"
+APPEND_OP = "append"
+INSERT_OP = "insert"
+ADD_TO_SET_OP = "add"
+BIT_OR_OP = "or"
+DELETE_OP = "del"
+COMMIT_MARKER = ["commit"]
+
+OP_IDX = 0
+PATH_IDX = 1
+VALUE_IDX = 2
+INSERT_POSITION_IDX = 0
+INSERT_ITEM_IDX = 1
+
+
+def apply_state_delta(state: dict, delta: list) -> Any:
+    """
+    Applies a single delta to the state. The same function is used both when the controller mutates its state and when the log is replayed, so both paths always produce the same state.
+
+    :return: the resulting value at the path of the delta
+    """
+    op, path = delta[OP_IDX], delta[PATH_IDX]
+    container = state
+    for key in path[:-1]:
+        container = container[key] if isinstance(container, list) else container.setdefault(key, {})
+    key = path[-1]
+
+    if op == SET_OP:
+        container[key] = delta[VALUE_IDX]
+    elif op == INCREMENT_OP:
+        current_value = container[key] if isinstance(container, list) else container.get(key, 0)
+        container[key] = current_value + delta[VALUE_IDX]
+    elif op == APPEND_OP:
+        if isinstance(container, dict):
+            container.setdefault(key, [])
+        container[key].append(delta[VALUE_IDX])
+    elif op == INSERT_OP:
+        if isinstance(container, dict):
+            container.setdefault(key, [])
+        container[key].insert(delta[VALUE_IDX][INSERT_POSITION_IDX], delta[VALUE_IDX][INSERT_ITEM_IDX])
+    elif op == ADD_TO_SET_OP:
+        # Sets are serialized as lists in the snapshots
+        if not isinstance(container.get(key), set):
+            container[key] = set(container.get(key) or [])
+        container[key].add(delta[VALUE_IDX])
+    elif op == BIT_OR_OP:
+        container[key] = container.get(key, 0) | delta[VALUE_IDX]
+    elif op == DELETE_OP:
+        if isinstance(container, list):
+            container.pop(key)
+        else:
+            container.pop(key, None)
+        return None
+    else:
+        raise ValueError(f"Unknown state delta operation: {op}")
+    return container[key]
+
+
+def serialize_sets(obj):
+    if isinstance(obj, set):
+        return list(obj)
+
+    return obj
+
+
+def create_state_store(state_file_path: str,
+                       store_type: str,
+                       fsync_policy: str,
+                       fsync_interval: float,
+                       snapshot_threshold: int):
+    """
+    Creates the state store configured for the controller
+
+    :param state_file_path: path of the state file of the controller
+    :param store_type: 'snapshot' to dump the full state on every commit or 'log' to append the deltas to a log
+    :param fsync_policy: 'always' to fsync on every commit, 'interval' to fsync at most once every fsync_interval seconds or 'never'
+    :param fsync_interval: seconds between fsyncs when the policy is 'interval'
+    :param snapshot_threshold: size in bytes of the log after which a new snapshot is taken
+    """
+    if store_type == STATE_STORE_SNAPSHOT:
+        return SnapshotStateStore(state_file_path, fsync_policy)
+    if store_type == STATE_STORE_LOG:
+        return LogStateStore(state_file_path, fsync_policy, fsync_interval, snapshot_threshold)
+    raise ValueError(f"Unknown state store: {store_type}")
+
+
+class SnapshotStateStore:
+    """
+    Persists the whole state of the controller on every commit. Deltas are ignored as the full state is always written.
+    """
+    def __init__(self, state_file_path: str, fsync_policy: str = FSYNC_POLICY_NEVER):
+        self.state_file_path = state_file_path
+        self.fsync = (fsync_policy != FSYNC_POLICY_NEVER)
+
+    def load(self) -> dict:
+        try:
+            with open(self.state_file_path, 'r') as f:
+                state_json = json.load(f)
+                return {int(k): v for k, v in state_json.items()}
+        except FileNotFoundError:
+            return {}
+
+    def record(self, delta: list):
+        pass
+
+    def commit(self, state: dict):
+        writer = AtomicWriter(self.state_file_path, fsync=self.fsync)
+        writer.write(json.dumps(state, default=serialize_sets))
+
+
+class LogStateStore:
+    """
+    Persists the state as an append-only log of deltas split in segments plus a periodic snapshot.
+
+    The deltas recorded between two commits are appended to the current segment followed by a commit marker, so on restart only fully committed windows are replayed and a torn tail is discarded.
+    Once the segments written after the last snapshot exceed snapshot_threshold bytes, the current segment is sealed and a forked process writes the snapshot of the state in the background.
+    The segments covered by a snapshot are deleted once it has been written.
+    """
+    def __init__(self, state_file_path: str, fsync_policy: str, fsync_interval: float, snapshot_threshold: int):
+        self.state_file_path = state_file_path
+        base_path = os.path.splitext(state_file_path)[0]
+        self.snapshot_path = f"{base_path}.snapshot.json"
+        self.segment_path_prefix = f"{base_path}.log."
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.snapshot_threshold = snapshot_threshold
+
+        self.pending_deltas: list[str] = []
+        self.sealed_segments: list[int] = []
+        self.current_segment = 0
+        self.current_segment_file = None
+        self.bytes_since_snapshot = 0
+        self.last_fsync_time = time.monotonic()
+        self.snapshot_process: Optional[Process] = None
+        self.segment_covered_by_snapshot_in_progress: Optional[int] = None
+
+    def load(self) -> dict:
+        state, last_covered_segment = self.__load_snapshot()
+        segments = self.__list_segments()
+        if last_covered_segment < 0 and not segments:
+            state = self.__load_legacy_state_file()
+        for segment in segments:
+            segment_path = self.__segment_path(segment)
+            if segment <= last_covered_segment:
+                os.remove(segment_path)
+                continue
+            self.__replay_segment(state, segment_path)
+            self.bytes_since_snapshot += os.path.getsize(segment_path)
+            self.sealed_segments.append(segment)
+
+        # A new segment is always started so that a torn tail of the previous one is never appended to
+        self.current_segment = max(self.sealed_segments + [last_covered_segment]) + 1
+        self.current_segment_file = open(self.__segment_path(self.current_segment), 'a')
+        logging.info(f"[STATE LOADED]: snapshot covering up to segment {last_covered_segment} and {len(self.sealed_segments)} log segments replayed")
+        return state
+
+    def record(self, delta: list):
+        self.pending_deltas.append(json.dumps(delta, separators=(',', ':'), default=serialize_sets))
+
+    def commit(self, state: dict):
+        if self.pending_deltas:
+            self.pending_deltas.append(json.dumps(COMMIT_MARKER))
+            data = "\n".join(self.pending_deltas) + "\n"
+            self.pending_deltas = []
+            self.current_segment_file.write(data)
+            self.current_segment_file.flush()
+            self.__fsync_if_required()
+            self.bytes_since_snapshot += len(data)
+
+        self.__check_snapshot_in_progress()
+        if self.bytes_since_snapshot >= self.snapshot_threshold and self.snapshot_process is None:
+            self.__take_snapshot(state)
+
+    def __fsync_if_required(self):
+        if self.fsync_policy == FSYNC_POLICY_ALWAYS:
+            os.fsync(self.current_segment_file.fileno())
+        elif self.fsync_policy == FSYNC_POLICY_INTERVAL and (time.monotonic() - self.last_fsync_time) >= self.fsync_interval:
+            os.fsync(self.current_segment_file.fileno())
+            self.last_fsync_time = time.monotonic()
+
+    # ==============================================================================================================
+
+    def __take_snapshot(self, state: dict):
+        """
+        Seals the current segment and forks a process that writes the snapshot. The child gets a copy on write view of the state at this point, which is exactly the state described by the sealed segments.
+        """
+        self.current_segment_file.close()
+        self.sealed_segments.append(self.current_segment)
+        self.segment_covered_by_snapshot_in_progress = self.current_segment
+        self.current_segment += 1
+        self.current_segment_file = open(self.__segment_path(self.current_segment), 'a')
+        self.bytes_since_snapshot = 0
+
+        self.snapshot_process = Process(target=self.__write_snapshot, args=(state, self.segment_covered_by_snapshot_in_progress))
+        self.snapshot_process.start()
+        logging.debug(f"[SNAPSHOT STARTED]: covering up to segment {self.segment_covered_by_snapshot_in_progress}")
+
+    def __write_snapshot(self, state: dict, last_covered_segment: int):
+        writer = AtomicWriter(self.snapshot_path, fsync=(self.fsync_policy != FSYNC_POLICY_NEVER))
+        writer.write(json.dumps({"last_covered_segment": last_covered_segment, "state": state}, default=serialize_sets))
+
+    def __check_snapshot_in_progress(self):
+        if self.snapshot_process is None or self.snapshot_process.is_alive():
+            return
+        self.snapshot_process.join()
+        if self.snapshot_process.exitcode == 0:
+            covered_segments = [segment for segment in self.sealed_segments if segment <= self.segment_covered_by_snapshot_in_progress]
+            for segment in covered_segments:
+                os.remove(self.__segment_path(segment))
+            self.sealed_segments = [segment for segment in self.sealed_segments if segment > self.segment_covered_by_snapshot_in_progress]
+            logging.debug(f"[SNAPSHOT FINISHED]: {len(covered_segments)} log segments compacted")
+        else:
+            # The sealed segments are kept so the next snapshot covers them
+            logging.error(f"[SNAPSHOT FAILED]: exit code {self.snapshot_process.exitcode}")
+            self.bytes_since_snapshot = self.snapshot_threshold
+        self.snapshot_process = None
+        self.segment_covered_by_snapshot_in_progress = None
+
+    # ==============================================================================================================
+
+    def __load_snapshot(self) -> tuple[dict, int]:
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+                return {int(k): v for k, v in snapshot["state"].items()}, snapshot["last_covered_segment"]
+        except FileNotFoundError:
+            return {}, -1
+
+    def __load_legacy_state_file(self) -> dict:
+        """
+        Loads the state file written by a SnapshotStateStore, so a controller that switches to the log keeps its state. The state is written as the initial snapshot, covering no segments.
+        """
+        state = SnapshotStateStore(self.state_file_path).load()
+        if state:
+            self.__write_snapshot(state, -1)
+            logging.info(f"[STATE MIGRATED]: {self.state_file_path} written as the initial snapshot of the log")
+        return state
+
+    def __replay_segment(self, state: dict, segment_path: str):
+        uncommitted_deltas = []
+        with open(segment_path, 'r') as f:
+            for line in f:
+                try:
+                    delta = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.info(f"[TORN LOG TAIL]: discarding the uncommitted deltas of {segment_path}")
+                    break
+                if delta == COMMIT_MARKER:
+                    for uncommitted_delta in uncommitted_deltas:
+                        apply_state_delta(state, uncommitted_delta)
+                    uncommitted_deltas = []
+                else:
+                    uncommitted_deltas.append(delta)
+
+    def __list_segments(self) -> list[int]:
+        segments = []
+        for segment_path in glob.glob(f"{glob.escape(self.segment_path_prefix)}*"):
+            suffix = segment_path[len(self.segment_path_prefix):]
+            if suffix.isdigit():
+                segments.append(int(suffix))
+        return sorted(segments)
+
+    def __segment_path(self, segment: int) -> str:
+        return f"{self.segment_path_prefix}{segment}"
@@ -1,38 +1,78 @@
 import logging
 import socket
 
+INITIAL_BUFFER_SIZE = 64 * 1024
+# Maximum amount of buffers of a single sendmsg call (IOV_MAX in Linux)
+MAX_BUFFERS_PER_SEND = 1024
+
 class Stream:
     def __init__(self, sock: socket.socket):
+        """
+        Socket stream without copies: the received bytes are read into a buffer that is reused by every recv, and the buffers to send are written with scatter/gather sends.
+        """
         self._socket = sock
+        self._buffer = bytearray(INITIAL_BUFFER_SIZE)
+        self._buffer_view = memoryview(self._buffer)
         addr = sock.getpeername()
-        
+
     def send(self, message):
         """
         Sends a message to the client socket, followed by a newline character, preventing short-writes.
         """
-        
-        bytes_sent = 0
-        bytes_to_send = len(message)
-        while bytes_sent < bytes_to_send:
-            send_result = self._socket.send(message[bytes_sent:])
-            if send_result == 0:
+        self.send_buffers([message])
+
+    def send_buffers(self, buffers: list):
+        """
+        Sends the concatenation of the buffers to the client socket with as few syscalls as possible, without joining them, preventing short-writes.
+        """
+        bytes_to_send = sum(len(buffer) for buffer in buffers)
+        if len(buffers) <= MAX_BUFFERS_PER_SEND:
+            # Most writes are complete, so the views of the buffers are only created after a short write
+            bytes_sent = self._socket.sendmsg(buffers)
+            if bytes_sent == bytes_to_send:
+                return
+            if bytes_sent == 0 and bytes_to_send > 0:
                 raise OSError("Socket connection broken")
-            bytes_sent += send_result
-        
-    def recv(self, bytes_to_receive):
+        else:
+            bytes_sent = 0
+        pending_buffers = [memoryview(buffer).cast('B') for buffer in buffers if len(buffer) > 0]
+        self.__skip_sent_bytes(pending_buffers, bytes_sent)
+        while pending_buffers:
+            bytes_sent = self._socket.sendmsg(pending_buffers[:MAX_BUFFERS_PER_SEND])
+            if bytes_sent == 0:
+                raise OSError("Socket connection broken")
+            self.__skip_sent_bytes(pending_buffers, bytes_sent)
+
+    def __skip_sent_bytes(self, pending_buffers: list[memoryview], bytes_sent: int):
+        """
+        Removes the buffers that were completely sent and keeps the rest of a partially sent one
+        """
+        sent_buffers = 0
+        while sent_buffers < len(pending_buffers) and bytes_sent >= len(pending_buffers[sent_buffers]):
+            bytes_sent -= len(pending_buffers[sent_buffers])
+            sent_buffers += 1
+        del pending_buffers[:sent_buffers]
+        if bytes_sent > 0:
+            pending_buffers[0] = pending_buffers[0][bytes_sent:]
+
+    def recv(self, bytes_to_receive) -> memoryview:
         """
         Receives a message from the client socket, preventing short-reads.
-        And returns the message received in bytes, must be decoded.
+        The message is returned as a view of the receive buffer of the stream, so it is only valid until the next recv. It must be decoded or copied before that.
         """
-        message = b""
-        bytes_read = 0
+        if bytes_to_receive > len(self._buffer):
+            self._buffer = bytearray(max(bytes_to_receive, 2 * len(self._buffer)))
+            self._buffer_view = memoryview(self._buffer)
+        view = self._buffer_view
+        bytes_read = self._socket.recv_into(view, bytes_to_receive)
+        if not bytes_read and bytes_to_receive > 0:
+            raise OSError("Socket connection broken")
         while bytes_read < bytes_to_receive:
-            received = self._socket.recv(bytes_to_receive - bytes_read)
+            received = self._socket.recv_into(view[bytes_read:bytes_to_receive])
             if not received:
                 raise OSError("Socket connection broken")
-            message += received
-            bytes_read += len(received)
-        return message
-    
+            bytes_read += received
+        return view[:bytes_to_receive]
+
     def close(self):
-        self._socket.close()
\ No newline at end of file
+        self._socket.close()
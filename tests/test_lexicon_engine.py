@@ -0,0 +1,50 @@
+"""
+Parity of the lexicon engine of the sentiment analyzer with TextBlob.sentiment.polarity on a fixed corpus of reviews.
+
+Requires numpy and textblob with its corpora, as the sentiment analyzer image does. Run with: python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("textblob")
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "src", "controllers", "accumulators", "sentiment_analyzer"))
+
+from textblob import TextBlob
+from lexicon_engine import LexiconPolarityEngine
+
+CORPUS_PATH = os.path.join(TESTS_DIR, "data", "sentiment_parity_corpus.txt")
+# The engine reproduces the rules of TextBlob, so both polarities may only differ by float rounding
+POLARITY_TOLERANCE = 1e-9
+
+
+@pytest.fixture(scope="module")
+def engine() -> LexiconPolarityEngine:
+    return LexiconPolarityEngine()
+
+
+@pytest.fixture(scope="module")
+def corpus() -> list[str]:
+    with open(CORPUS_PATH, 'r') as f:
+        return [line for line in f.read().splitlines() if line]
+
+
+def test_polarities_of_corpus_match_textblob(engine: LexiconPolarityEngine, corpus: list[str]):
+    polarities = engine.polarities_of_texts(corpus)
+    assert len(polarities) == len(corpus)
+    for text, polarity in zip(corpus, polarities):
+        assert polarity == pytest.approx(TextBlob(text).sentiment.polarity, abs=POLARITY_TOLERANCE), text
+
+
+def test_polarities_do_not_depend_on_the_batch(engine: LexiconPolarityEngine, corpus: list[str]):
+    batch_polarities = engine.polarities_of_texts(corpus)
+    single_polarities = [engine.polarities_of_texts([text])[0] for text in corpus]
+    assert batch_polarities == pytest.approx(single_polarities, abs=POLARITY_TOLERANCE)
+
+
+def test_texts_without_assessments_are_neutral(engine: LexiconPolarityEngine):
+    assert engine.polarities_of_texts(["", "   ", "The book has 300 pages."]) == [0.0, 0.0, 0.0]